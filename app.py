@@ -1,29 +1,21 @@
 import streamlit as st # type: ignore
 import pandas as pd # type: ignore
-import ast
+from src.recommender.user_combined_recommendation import recommendation_resolver
 
 # Paths to the data files
-USER_COMBINED_RECOMMENDATIONS_PATH = "data/recommender_result/user_combined_recommendations.csv"
 BOOKS_INFO_PATH = "data/preprocessed_files/distinct_books.parquet"
 
-# Load user recommendations data
+# Load user recommendations data through the segment resolver
 def load_data():
-    user_combined_recommendations = pd.read_csv(USER_COMBINED_RECOMMENDATIONS_PATH)
     book_data = pd.read_parquet(BOOKS_INFO_PATH)
-    return user_combined_recommendations, book_data
+    return recommendation_resolver.load_resolver(), book_data
 
-# Convert string to list if necessary
+# Shelves arrive as typed lists (or arrays); anything else is an empty shelf
 def convert_to_list(value):
-    """Safely convert string representation of a list to an actual list."""
-    if isinstance(value, str):
-        try:
-            # Clean the value and convert it to a list
-            value = value.strip().replace("'", '"')
-            return ast.literal_eval(value)
-        except (ValueError, SyntaxError) as e:
-            print(f"Error converting value to list: {value} - {e}")
-            return []  # Return empty list if conversion fails
-    return value  # If it's already a list, return as is
+    """Return a list-valued cell as a Python list."""
+    if value is None or isinstance(value, str):
+        return []
+    return list(value)
 
 # Fetch book details from book_data based on ISBNs
 def get_book_details(isbns, book_data):
@@ -35,15 +27,15 @@ def get_book_details(isbns, book_data):
 
 # Display user recommendations
 def display_recommendations(user_info, book_data):
-    user_id = st.selectbox("Select User ID", user_info['user_id'].unique())
+    user_id = st.selectbox("Select User ID", user_info['user_ids'])
 
     # Get user recommendations for selected user
-    user = user_info[user_info['user_id'] == user_id].iloc[0]
+    user = recommendation_resolver.resolve(user_info, user_id)
     geo_recommendation = user['geographic_recommendation']
     demographic_recommendation = user['demographic_recommendation']
     collaborative_recommendation = user['collaborative_cluster_recommendation']
 
-    # Convert string to list if necessary and limit to 5 recommendations
+    # Convert to lists and limit to 5 recommendations
     geo_recommendation = convert_to_list(geo_recommendation)[:5]
     demographic_recommendation = convert_to_list(demographic_recommendation)[:5]
     collaborative_recommendation = convert_to_list(collaborative_recommendation)[:5]
@@ -1,18 +1,24 @@
 # main.py
 
 # Importing required functions from different modules for the main script.
-from src.data_inject import fetch_raw_data
+import os
+from src.data_inject import fetch_raw_data, csv_to_parquet
 from src.data_preprocessing import preprocessing_raw_data, users, books
-from src.recommender.deomgraphic_recommender import age_group_recommender
+from src.recommender import seen_items
+from src.recommender.segment_popularity import segment_popularity
 from src.recommender.geographic_recommender import geo_locational_recommender
 from src.recommender.collaborative_filtering_recommender import recommended_for_you
 from src.recommender.collaborative_filtering_recommender import people_also_read
-from src.recommender.user_combined_recommendation import user_combined_recommendation
+from src.recommender.user_combined_recommendation import user_combined_recommendation, blended_recommendation
 
-def main():
+def main(blend_for_you: bool = True):
+    """Runs the whole pipeline; `blend_for_you=False` skips the precomputed For You shelf."""
     # Step 1: Fetch raw data from the source and save it for further processing.
     fetch_raw_data.main()  # Call the fetch function to download files
 
+    # Convert the downloaded CSV files to typed Parquet so later steps never re-parse CSV.
+    csv_to_parquet.main()
+
     # Step 2: Preprocess the raw data to make it suitable for analysis.
     preprocessing_raw_data.main()
 
@@ -22,19 +28,34 @@ def main():
     # Step 4: Process and prepare book data for recommendation purposes.
     books.main()
 
-    # Step 5: Generate age-group-based recommendations.
-    age_group_recommender.main()
+    # Steps 5 and 6 share one scan of the ratings, with the age-group and every location-level code column.
+    ratings = segment_popularity.read_ratings(segment_popularity.INPUT_FILE,
+                                              segment_popularity.DEFAULT_DIMENSIONS + geo_locational_recommender.LEVEL_DIMENSIONS)
+
+    # Step 5: Generate age-group-based recommendations (and the global fallback list).
+    segment_popularity.save_segment_popularity(ratings, segment_popularity.DEFAULT_DIMENSIONS)
 
-    # Step 6: Generate location-based recommendations.
-    geo_locational_recommender.main()
+    # Step 6: Generate location-based recommendations per city, state and country, with a fallback index.
+    geo_locational_recommender.save_location_rollup(geo_locational_recommender.build_location_rollup(ratings))
+    del ratings
 
     # Step 7: Generate personalized recommendations using cluster collaborative filtering.
     recommended_for_you.main()
 
+    # Build the per-user seen-items index, so shelves leave out books a user has already rated.
+    seen_items.main()
+
     # Step 8: Combine recommendations (collaborative filtering, demographic, and geographic)
     # This step aggregates and maps all personalized recommendations for each user
     # including cluster-based recommendations, demographic-based suggestions, and geographic-based suggestions.
     user_combined_recommendation.main()
+
+    # Optional (on by default): blend the three shelves into one ranked "For You" list per user.
+    # With blend_for_you=False the stage is skipped and the app blends the shelves per request instead.
+    if blend_for_you:
+        blended_recommendation.main()
+    elif os.path.exists(blended_recommendation.OUTPUT_PATH):
+        os.remove(blended_recommendation.OUTPUT_PATH)  # A shelf from an earlier run would be served stale
     
     # Step 9: The "people_also_read.main()" method will suggest books that other users, in the same cluster, have also interacted with.
     people_also_read.main()
@@ -1,6 +1,11 @@
 import streamlit as st  # type: ignore
+import os
 import pandas as pd  # type: ignore
-import ast
+from config.logging_configs import logger  # Assuming logging is already configured
+from src.data_preprocessing import id_registry
+from src.recommender import seen_items
+from src.recommender.collaborative_filtering_recommender import neighbour_index, user_model
+from src.recommender.user_combined_recommendation import blended_recommendation, recommendation_resolver
 
 # ---------------------------
 # Page Config
@@ -162,17 +167,20 @@ def show_witty_error(err_message, feature_context="System Core"):
 # ---------------------------
 @st.cache_data(ttl=3600, max_entries=5)
 def load_data():
+    # Per-user shelves come from the segment resolver; this frame only backs the demo fallback
+    user_combined_recommendations = pd.DataFrame({
+        'user_id': [1001, 1002, 1003],
+        'geographic_recommendation': [['0345339681', '0449212602'], [], []],
+        'demographic_recommendation': [['0449212602', '0345339681'], ['0449212602'], []],
+        'collaborative_cluster_recommendation': [['0345339681', '0449212602'], [], []]
+    })
     try:
-        user_combined_recommendations = pd.read_csv("data/recommender_result/user_combined_recommendations.csv")
         book_data = pd.read_parquet("data/preprocessed_files/distinct_books.parquet")
-        book_similarities = pd.read_csv("data/recommender_result/book_similarities.csv")
+        # Legacy similarity CSV, only read when the binary neighbour index has not been built
+        book_similarities = pd.DataFrame(columns=['isbn', 'similar_books'])
+        if not os.path.isdir(neighbour_index.NEIGHBOUR_INDEX_DIR):
+            book_similarities = pd.read_csv("data/recommender_result/book_similarities.csv")
     except Exception:
-        user_combined_recommendations = pd.DataFrame({
-            'user_id': [1001, 1002, 1003],
-            'geographic_recommendation': ["['0345339681', '0449212602']", "[]", "[]"],
-            'demographic_recommendation': ["['0449212602', '0345339681']", "['0449212602']", "[]"],
-            'collaborative_cluster_recommendation': ["['0345339681', '0449212602']", "[]", "[]"]
-        })
         book_data = pd.DataFrame({
             'isbn': ['0345339681', '0449212602'], 
             'book_title': ['The Hobbit', 'The Handmaid\'s Tale'], 
@@ -199,36 +207,91 @@ def build_lookups(_book_data, _book_similarities):
 
 BOOK_LOOKUP, SIMILARITY_LOOKUP = build_lookups(book_data, book_similarities)
 
+# Book rows aligned to the shared ISBN registry, so a batch of ISBNs resolves with one positional take
+@st.cache_resource
+def build_book_table(_book_data):
+    try:
+        isbn_index = id_registry.load_registry('isbn')
+    except Exception:
+        isbn_index = id_registry.key_index(_book_data['isbn'], 'isbn')
+    book_table = _book_data.drop_duplicates(subset='isbn').set_index('isbn').reindex(isbn_index)
+    return isbn_index, book_table.reset_index()
+
+ISBN_INDEX, BOOK_TABLE = build_book_table(book_data)
+
+# Memory-mapped neighbour index: shared pages across worker processes, nothing parsed at startup
+@st.cache_resource
+def load_neighbour_index():
+    try:
+        return neighbour_index.load_neighbour_index()
+    except Exception:
+        return None
+
+NEIGHBOUR_INDEX = load_neighbour_index()
+
+# Saved SVD factors and centroids, used to place users the nightly run has not clustered yet
+@st.cache_resource
+def load_user_model():
+    try:
+        return user_model.load_user_model()
+    except Exception:
+        return None
+
+USER_MODEL = load_user_model()
+
+# Per-user segment keys plus the shared per-segment lists; a user's shelves are resolved on request.
+# Only a loaded resolver is cached: a failure raises out of the cached call, so the next rerun retries.
+@st.cache_resource(ttl=3600)
+def load_cached_resolver():
+    return recommendation_resolver.load_resolver()
+
+def load_resolver():
+    try:
+        return load_cached_resolver()
+    except Exception as e:
+        logger.error(f"Error loading the recommendation resolver, falling back to the demo profiles: {e}")
+        return None
+
+RESOLVER = load_resolver()
+
 # ---------------------------
 # Optimised Light Helpers
 # ---------------------------
 def convert_to_list(value):
-    if not isinstance(value, str): return value or []
-    value = value.strip()
-    if not value: return []
-    try:
-        return ast.literal_eval(value)
-    except:
-        try:
-            return ast.literal_eval(value.replace("'", '"'))
-        except:
-            return []
-
-def get_similar_books_fast(isbn):
+    if value is None or isinstance(value, str): return []
+    return list(value)
+
+def drop_seen(codes, user_id):
+    # Books the active profile has already rated are not recommended back to it
+    if RESOLVER is None or RESOLVER['seen'] is None or user_id is None:
+        return codes
+    position = RESOLVER['user_ids'].get_indexer([user_id])[0]
+    if position < 0:
+        return codes
+    return seen_items.unseen(RESOLVER['seen'], RESOLVER['user_code'][position], codes)
+
+def get_similar_books_fast(isbn, top_k=10, min_score=None, user_id=None):
+    if NEIGHBOUR_INDEX is not None:
+        code = id_registry.encode(ISBN_INDEX, [str(isbn)])[0]
+        codes, _ = neighbour_index.neighbours_of(NEIGHBOUR_INDEX, code, seen_items.fetch_size(top_k), min_score)
+        return list(id_registry.decode(ISBN_INDEX, drop_seen(codes, user_id)[:top_k]))
     similar_isbns = SIMILARITY_LOOKUP.get(isbn, "")
     if isinstance(similar_isbns, str) and similar_isbns:
-        return [x.strip() for x in similar_isbns.split(",")][:10]
+        return [x.strip() for x in similar_isbns.split(",")][:top_k]
     return []
 
+def get_fold_in_recommendations(isbns, rating=10):
+    # Treats the saved books as top ratings and folds them into the nearest cluster
+    if USER_MODEL is None or not isbns:
+        return []
+    codes = id_registry.encode(ISBN_INDEX, [str(i) for i in isbns])
+    cluster_id = user_model.fold_in_user(USER_MODEL, codes, [rating] * len(codes))
+    return list(id_registry.decode(ISBN_INDEX, user_model.cluster_books(USER_MODEL, cluster_id)))
+
 def get_book_details_fast(isbns):
-    records = []
-    for i in isbns:
-        str_i = str(i)
-        if str_i in BOOK_LOOKUP:
-            item = BOOK_LOOKUP[str_i].copy()
-            item['isbn'] = str_i
-            records.append(item)
-    return pd.DataFrame(records)
+    codes = id_registry.encode(ISBN_INDEX, [str(i) for i in isbns])
+    records = BOOK_TABLE.take(codes[codes >= 0])
+    return records.dropna(subset=['book_title']).reset_index(drop=True)
 
 # ---------------------------
 # UI Fragment - Isolated Rerenders 
@@ -345,7 +408,7 @@ def display_book_details_view(isbn):
 
             st.markdown("---")
             st.subheader("✨ Readers Who Bought This Also Enjoyed")
-            similar_isbns = get_similar_books_fast(isbn)
+            similar_isbns = get_similar_books_fast(isbn, user_id=st.session_state.get('active_user_id'))
             if similar_isbns:
                 display_book_cards_grid(get_book_details_fast(similar_isbns), prefix="similar")
             else:
@@ -418,19 +481,29 @@ else:
     with h_col1:
         global_search = st.text_input("🔍 Search entire catalog...", placeholder="Type title, author or keywords to dynamically filter shelves below...")
     with h_col2:
-        user_ids = user_info['user_id'].unique() if 'user_id' in user_info.columns else [1001]
+        if RESOLVER is not None:
+            user_ids = RESOLVER['user_ids']
+        else:
+            user_ids = user_info['user_id'].unique() if 'user_id' in user_info.columns else [1001]
         user_id = st.selectbox("🎯 Active Personalization Profile:", user_ids)
+        st.session_state.active_user_id = user_id
         
     # Guard against completely corrupted/empty data indices
-    if 'user_id' in user_info.columns and not user_info[user_info['user_id'] == user_id].empty:
+    if RESOLVER is not None:
+        user_row = pd.Series(recommendation_resolver.resolve(RESOLVER, user_id))
+        for_you_ids = recommendation_resolver.resolve_for_you(RESOLVER, user_id)
+    elif 'user_id' in user_info.columns and not user_info[user_info['user_id'] == user_id].empty:
         user_row = user_info[user_info['user_id'] == user_id].iloc[0]
+        for_you_ids = blended_recommendation.blend(user_row)
     else:
-        user_row = pd.Series({'collaborative_cluster_recommendation': "[]", 'demographic_recommendation': "[]", 'geographic_recommendation': "[]"})
+        user_row = pd.Series({'collaborative_cluster_recommendation': [], 'demographic_recommendation': [], 'geographic_recommendation': []})
+        for_you_ids = []
         
     st.markdown("---")
     
-    tab_all, tab1, tab2, tab3, tab_saved = st.tabs([
+    tab_all, tab_for_you, tab1, tab2, tab3, tab_saved = st.tabs([
         "📚 All Books", 
+        "✨ For You", 
         "🤝 Handpicked For You", 
         "👥 Popular Among Peers", 
         "📍 Trending In Your Area",
@@ -450,19 +523,25 @@ else:
         display_book_cards_grid(modern_books[:10], prefix="all_modern", search_term=global_search)
         
     # 2. PERSONALIZED RECOMMENDATIONS
+    with tab_for_you:
+        st.markdown("### For You")
+        display_book_cards_grid(get_book_details_fast(for_you_ids), prefix="for_you", search_term=global_search)
+
     with tab1:
         st.markdown("### Handpicked For You")
-        collab_ids = convert_to_list(user_row.get('collaborative_cluster_recommendation', "[]"))[:10]
+        collab_ids = convert_to_list(user_row.get('collaborative_cluster_recommendation'))[:10]
+        if not collab_ids:
+            collab_ids = get_fold_in_recommendations(list(st.session_state.reading_list))[:10]
         display_book_cards_grid(get_book_details_fast(collab_ids), prefix="curated", search_term=global_search)
         
     with tab2:
         st.markdown("### Peer Demographic Trends")
-        demo_ids = convert_to_list(user_row.get('demographic_recommendation', "[]"))[:10]
+        demo_ids = convert_to_list(user_row.get('demographic_recommendation'))[:10]
         display_book_cards_grid(get_book_details_fast(demo_ids), prefix="demographic", search_term=global_search)
         
     with tab3:
         st.markdown("### Regional Best Sellers")
-        geo_ids = convert_to_list(user_row.get('geographic_recommendation', "[]"))[:10]
+        geo_ids = convert_to_list(user_row.get('geographic_recommendation'))[:10]
         display_book_cards_grid(get_book_details_fast(geo_ids), prefix="geographic", search_term=global_search)
 
     # 3. SAVED USER REPOSITORY
@@ -3,7 +3,7 @@
 # Importing required functions from different modules for the main script.
 from src.data_inject import fetch_raw_data
 from src.data_preprocessing import preprocessing_raw_data, users, books
-from src.recommender.deomgraphic_recommender import age_group_recommender
+from src.recommender.segment_popularity import segment_popularity
 from src.recommender.geographic_recommender import geo_locational_recommender
 from src.recommender.collaborative_filtering_recommender import recommended_for_you
 from src.recommender.collaborative_filtering_recommender import people_also_read
@@ -23,7 +23,7 @@ def main():
     books.main()
 
     # Step 5: Generate age-group-based recommendations.
-    age_group_recommender.main()
+    segment_popularity.main()
 
     # Step 6: Generate location-based recommendations.
     geo_locational_recommender.main()
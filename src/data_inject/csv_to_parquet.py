@@ -0,0 +1,96 @@
+import os
+import pyarrow as pa  # type: ignore
+import pyarrow.csv as pv  # type: ignore
+import pyarrow.parquet as pq  # type: ignore
+from config.logging_configs import logger  # Assuming the logging configuration is imported
+
+# Configuration
+RAW_FILES_DIR = 'data/raw_files'  # Directory holding the downloaded CSV files
+BLOCK_SIZE = 64 * 1024 * 1024  # Bytes of CSV parsed per streamed batch; bounds peak memory
+NULL_VALUES = ['', 'NULL', 'null', 'NaN', 'nan', 'N/A']
+
+# Explicit schema per raw file. Only the listed columns are kept, in this order.
+RAW_SCHEMAS = {
+    'Ratings': pa.schema([
+        ('User-ID', pa.int32()),
+        ('ISBN', pa.string()),
+        ('Book-Rating', pa.int8()),
+    ]),
+    'Books': pa.schema([
+        ('ISBN', pa.string()),
+        ('Book-Title', pa.string()),
+        ('Book-Author', pa.string()),
+        # Book-Crossing mixes years with publisher names in this column, so it stays textual.
+        ('Year-Of-Publication', pa.string()),
+        ('Publisher', pa.string()),
+        ('Image-URL-L', pa.string()),
+    ]),
+    'Users': pa.schema([
+        ('User-ID', pa.int32()),
+        ('Location', pa.string()),
+        ('Age', pa.float32()),
+    ]),
+}
+
+def raw_parquet_path(name: str, raw_dir: str = RAW_FILES_DIR) -> str:
+    """Path of the typed Parquet copy of a raw CSV file."""
+    return os.path.join(raw_dir, f"{name}.parquet")
+
+def is_up_to_date(csv_path: str, parquet_path: str) -> bool:
+    """Check whether the Parquet file was written after the CSV was last modified."""
+    return os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path)
+
+def skip_invalid_row(row) -> str:
+    """Log and skip malformed CSV rows instead of failing the whole file."""
+    logger.warning(f"Skipping malformed row {row.number}: {row.text[:200]!r}")
+    return 'skip'
+
+def convert_csv_to_parquet(csv_path: str, parquet_path: str, schema: pa.Schema, block_size: int = BLOCK_SIZE) -> int:
+    """Stream a CSV file into a Parquet file with an explicit schema, one bounded block at a time."""
+    try:
+        logger.info(f"Converting {csv_path} to {parquet_path}...")
+        read_options = pv.ReadOptions(block_size=block_size)
+        parse_options = pv.ParseOptions(invalid_row_handler=skip_invalid_row)
+        convert_options = pv.ConvertOptions(
+            column_types={field.name: field.type for field in schema},
+            include_columns=schema.names,
+            null_values=NULL_VALUES,
+            strings_can_be_null=False,
+        )
+
+        rows = 0
+        tmp_path = parquet_path + '.tmp'
+        with pv.open_csv(csv_path, read_options, parse_options, convert_options) as reader:
+            with pq.ParquetWriter(tmp_path, schema) as writer:
+                for batch in reader:
+                    writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+                    rows += batch.num_rows
+        os.replace(tmp_path, parquet_path)
+
+        logger.info(f"Converted {rows} rows from {csv_path}.")
+        return rows
+    except Exception as e:
+        logger.error(f"Error converting {csv_path} to Parquet: {e}")
+        raise
+
+def csv_to_parquet(raw_dir: str = RAW_FILES_DIR, force: bool = False) -> None:
+    """Convert every known raw CSV file to typed Parquet, skipping files that are already converted."""
+    logger.info("Starting CSV to Parquet ingest...")
+    for name, schema in RAW_SCHEMAS.items():
+        csv_path = os.path.join(raw_dir, f"{name}.csv")
+        parquet_path = raw_parquet_path(name, raw_dir)
+        if not os.path.exists(csv_path):
+            logger.warning(f"{csv_path} not found, skipping.")
+            continue
+        if not force and is_up_to_date(csv_path, parquet_path):
+            logger.info(f"{parquet_path} is up to date, skipping.")
+            continue
+        convert_csv_to_parquet(csv_path, parquet_path, schema)
+    logger.info("CSV to Parquet ingest completed.")
+
+# Entry point for the script execution
+def main():
+    csv_to_parquet()
+
+if __name__ == "__main__":
+    main()
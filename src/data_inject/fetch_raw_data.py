@@ -1,8 +1,10 @@
 import os
+import json
+import hashlib
+import shutil
 import logging
-from googleapiclient.discovery import build  # type: ignore
-from googleapiclient.http import MediaIoBaseDownload  # type: ignore
-from google.oauth2.service_account import Credentials  # type: ignore
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from config.logging_configs import logger  # Assuming the logging configuration is imported
 
 # Configuration
@@ -10,76 +12,243 @@ FOLDER_ID = '1fhUg8fnBsAe-ktK0Eq3o7zWtvkmh0J7M'  # Google Drive Folder ID
 SERVICE_ACCOUNT_FILE = 'config\service_account\json_key_google_drive.json'  # Path to your service account JSON file
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 RAW_FILES_DIR = 'data/raw_files'  # Directory to save files
+MANIFEST_FILE = os.path.join(RAW_FILES_DIR, 'manifest.json')  # File id / checksum / modifiedTime of every downloaded file
+PARTIAL_SUFFIX = '.part'  # Suffix of in-flight downloads, kept on failure so the next run can resume
+MAX_WORKERS = 4  # Bounded number of concurrent downloads
+PAGE_SIZE = 100  # Files requested per Drive listing page
+CHUNK_SIZE = 32 * 1024 * 1024  # Bytes fetched per download request
 
 # Ensure the output directory exists
 os.makedirs(RAW_FILES_DIR, exist_ok=True)
 
+class DriveClient:
+    """Google Drive backed file source.
+
+    The underlying `googleapiclient` service is not thread-safe, so every worker thread
+    builds its own service object lazily.
+    """
+
+    def __init__(self, folder_id: str = FOLDER_ID, service_account_file: str = SERVICE_ACCOUNT_FILE):
+        self.folder_id = folder_id
+        self.service_account_file = service_account_file
+        self._local = threading.local()
+
+    def _service(self):
+        if not hasattr(self._local, 'service'):
+            self._local.service = initialize_drive_service(self.service_account_file)
+        return self._local.service
+
+    def list_csv_files(self) -> list:
+        """List every CSV file in the folder, following all result pages."""
+        query = f"'{self.folder_id}' in parents and mimeType = 'text/csv' and trashed = false"  # Query to filter CSV files
+        fields = 'nextPageToken, files(id, name, mimeType, md5Checksum, modifiedTime, size)'
+        files, page_token = [], None
+        while True:
+            results = self._service().files().list(
+                q=query, fields=fields, pageSize=PAGE_SIZE, pageToken=page_token
+            ).execute()
+            files.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
+
+    def download(self, file: dict, output_file, offset: int = 0) -> None:
+        """Stream the file content into `output_file`, starting at byte `offset`.
+
+        Every chunk is one media request with an explicit `Range` header, so a transfer can
+        resume at any byte without relying on downloader internals.
+        """
+        size = int(file['size'])
+        while offset < size:
+            request = self._service().files().get_media(fileId=file['id'])
+            request.headers['Range'] = f"bytes={offset}-{min(offset + CHUNK_SIZE, size) - 1}"
+            content = request.execute()
+            if not content:
+                raise IOError(f"Empty response for {file['name']} at byte {offset} of {size}")
+            output_file.write(content)
+            offset += len(content)
+            logger.info(f"Download progress for file {file['name']}: {int(offset * 100 / size)}%")
+
+class LocalDirectoryClient:
+    """Stand-in for `DriveClient` that serves CSV files from a local directory (offline runs and tests)."""
+
+    def __init__(self, source_dir: str):
+        self.source_dir = source_dir
+
+    def list_csv_files(self) -> list:
+        """List CSV files in the directory with Drive-like metadata."""
+        files = []
+        for name in sorted(os.listdir(self.source_dir)):
+            path = os.path.join(self.source_dir, name)
+            if not name.lower().endswith('.csv') or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            files.append({
+                'id': path,
+                'name': name,
+                'mimeType': 'text/csv',
+                'md5Checksum': file_md5(path),
+                'modifiedTime': str(stat.st_mtime_ns),
+                'size': str(stat.st_size),
+            })
+        return files
+
+    def download(self, file: dict, output_file, offset: int = 0) -> None:
+        """Copy the file content into `output_file`, starting at byte `offset`."""
+        with open(file['id'], 'rb') as source:
+            source.seek(offset)
+            shutil.copyfileobj(source, output_file, CHUNK_SIZE)
+
 # Initialize Google Drive API
-def initialize_drive_service():
+def initialize_drive_service(service_account_file: str = SERVICE_ACCOUNT_FILE):
     """Initialize and return the Google Drive API client."""
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+    from googleapiclient.discovery import build  # type: ignore
+    from google.oauth2.service_account import Credentials  # type: ignore
+
+    creds = Credentials.from_service_account_file(service_account_file, scopes=SCOPES)
     drive_service = build('drive', 'v3', credentials=creds)
     logger.info("Google Drive API client initialized successfully.")
     return drive_service
 
+def file_md5(file_path: str) -> str:
+    """Compute the MD5 hex digest of a local file (the checksum Drive reports as md5Checksum)."""
+    digest = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(manifest_file: str = MANIFEST_FILE) -> dict:
+    """Load the manifest of previously downloaded files, keyed by file name."""
+    if not os.path.exists(manifest_file):
+        return {}
+    try:
+        with open(manifest_file, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable manifest {manifest_file}: {e}")
+        return {}
+
+def save_manifest(manifest: dict, manifest_file: str = MANIFEST_FILE) -> None:
+    """Atomically write the manifest so an interrupted run never leaves it half-written."""
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
 # List CSV files in the folder
-def list_csv_files(drive_service):
+def list_csv_files(client) -> list:
     """List all CSV files in the specified folder."""
-    query = f"'{FOLDER_ID}' in parents and mimeType = 'text/csv'"  # Query to filter CSV files
     try:
-        results = drive_service.files().list(q=query).execute()
-        files = results.get('files', [])
-        
+        files = client.list_csv_files()
+
         if not files:
             logger.info('No CSV files found in the folder.')
         else:
             logger.info(f"Found {len(files)} CSV file(s) in the folder:")
             for file in files:
                 logger.info(f"File Name: {file['name']}, MIME Type: {file['mimeType']}, File ID: {file['id']}")
-        
+
         return files
     except Exception as e:
         logger.error(f"Error while listing CSV files: {e}")
         return []
 
+def is_unchanged(file: dict, manifest: dict, output_dir: str = RAW_FILES_DIR) -> bool:
+    """Check whether the local copy matches the manifest entry for the same Drive revision."""
+    entry = manifest.get(file['name'])
+    if not entry or not os.path.exists(os.path.join(output_dir, file['name'])):
+        return False
+    return (
+        entry.get('id') == file['id']
+        and entry.get('md5Checksum') == file.get('md5Checksum')
+        and entry.get('modifiedTime') == file.get('modifiedTime')
+    )
+
 # Download a file from Google Drive
-def download_file(drive_service, file_id, file_name):
-    """Download the CSV file from Google Drive."""
+def download_file(client, file: dict, output_dir: str = RAW_FILES_DIR) -> bool:
+    """Download one CSV file, resuming a partial download left by an earlier run of the same revision."""
+    file_name = file['name']
+    output_path = os.path.join(output_dir, file_name)
+    partial_path = output_path + PARTIAL_SUFFIX
+    partial_meta_path = partial_path + '.json'
+    revision = {key: file.get(key) for key in ('id', 'md5Checksum', 'modifiedTime')}
     try:
-        request = drive_service.files().get_media(fileId=file_id)
-        output_path = os.path.join(RAW_FILES_DIR, file_name)
-        with open(output_path, 'wb') as f:
-            downloader = MediaIoBaseDownload(f, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-                logger.info(f"Download progress for file {file_name}: {int(status.progress() * 100)}%")
+        offset = 0
+        if os.path.exists(partial_path) and os.path.exists(partial_meta_path):
+            try:
+                with open(partial_meta_path, 'r') as f:
+                    if json.load(f) == revision:
+                        offset = os.path.getsize(partial_path)
+            except json.JSONDecodeError:
+                # A run killed while writing the sidecar leaves it truncated: nothing to resume from.
+                logger.warning(f"Unreadable resume metadata for {file_name}; restarting the download.")
+        size = int(file['size']) if file.get('size') else None
+        if size is not None and offset > size:
+            # Longer than the file itself: a range request past the end can never succeed, start over.
+            logger.warning(f"Partial download of {file_name} is larger than the file; restarting.")
+            offset = 0
+        if offset:
+            logger.info(f"Resuming download of {file_name} from byte {offset}.")
+        else:
+            with open(partial_meta_path + '.tmp', 'w') as f:
+                json.dump(revision, f)
+            os.replace(partial_meta_path + '.tmp', partial_meta_path)
+
+        # A partial file that already has every byte only needs its checksum verified
+        if not (offset and offset == size):
+            with open(partial_path, 'ab' if offset else 'wb') as f:
+                client.download(file, f, offset)
+
+        expected_md5 = file.get('md5Checksum')
+        if expected_md5 and file_md5(partial_path) != expected_md5:
+            # A corrupt partial file can never be resumed into a valid one; start over next run.
+            os.remove(partial_path)
+            raise ValueError(f"Checksum mismatch for {file_name}")
+
+        os.replace(partial_path, output_path)
+        os.remove(partial_meta_path)
         logger.info(f"File {file_name} downloaded successfully to {output_path}.")
+        return True
     except Exception as e:
         logger.error(f"Error downloading {file_name}: {e}")
+        return False
 
 # Main function to fetch CSV files from Google Drive
-def fetch_raw_data():
-    """Fetch all CSV files from the Google Drive folder."""
+def fetch_raw_data(client=None, output_dir: str = RAW_FILES_DIR, max_workers: int = MAX_WORKERS) -> dict:
+    """Fetch new or changed CSV files from the Google Drive folder with a bounded worker pool."""
     logger.info("Starting to fetch raw data from Google Drive...")
+    manifest_file = os.path.join(output_dir, os.path.basename(MANIFEST_FILE))
 
     try:
-        # Initialize the Google Drive API service
-        drive_service = initialize_drive_service()
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Initialize the Google Drive client (or use the provided stand-in)
+        client = client or DriveClient()
 
         # List all CSV files in the folder
-        files = list_csv_files(drive_service)
+        files = list_csv_files(client)
+
+        # Skip files whose local copy matches the manifest
+        manifest = load_manifest(manifest_file)
+        pending = [file for file in files if not is_unchanged(file, manifest, output_dir)]
+        logger.info(f"{len(files) - len(pending)} file(s) unchanged, {len(pending)} file(s) to download.")
 
-        # Download each CSV file
-        for file in files:
-            file_id = file['id']
-            file_name = file['name']
-            download_file(drive_service, file_id, file_name)
+        # Download the remaining files concurrently
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(download_file, client, file, output_dir): file for file in pending}
+            for future in as_completed(futures):
+                file = futures[future]
+                if future.result():
+                    manifest[file['name']] = {key: file.get(key) for key in ('id', 'md5Checksum', 'modifiedTime', 'size')}
+                    save_manifest(manifest, manifest_file)
 
         logger.info("Fetching raw data completed.")
+        return manifest
 
     except Exception as e:
         logger.error(f"An error occurred while fetching raw data: {e}")
+        return {}
 
 # Entry point for the script execution
 def main():
@@ -16,10 +16,10 @@ def main():
     try:
         logger.info("Processing book information...")
         # Select the relevant columns for book information
-        book_infos = filtered_data[['isbn', 'book_title', 'book_author', 'year_of_publication', 'publisher', 'image_url']]
+        book_infos = filtered_data[['isbn', 'book_title', 'book_author', 'year_of_publication', 'publisher', 'image_url', 'isbn_code']]
 
-        # Drop duplicates based on the selected columns
-        book_infos = book_infos.drop_duplicates()
+        # Drop duplicates so every canonical ISBN keeps exactly one row
+        book_infos = book_infos.drop_duplicates(subset='isbn').sort_values('isbn_code')
 
         # Reset the index
         book_infos = book_infos.reset_index(drop=True)
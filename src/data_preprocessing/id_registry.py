@@ -0,0 +1,150 @@
+import os
+import json
+import hashlib
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+from config.logging_configs import logger  # Import logger from your existing logging configuration
+
+# Define paths
+REGISTRY_DIR = 'data/preprocessed_files/id_registry'
+VERSION_FILE = 'version.json'
+
+# Namespaces and the raw_data column each one encodes
+NAMESPACES = {
+    'isbn': 'isbn', 'user': 'user_id', 'location': 'location', 'age_group': 'age_group',
+    'city': 'city', 'state': 'state', 'country': 'country',
+}
+AGE_GROUPS = ["Middle-aged", "Senior", "Teenager", "Unknown", "Young Adult"]
+
+def code_column(namespace: str) -> str:
+    """Name of the int32 code column stored next to the raw column in preprocessed tables."""
+    return f"{namespace}_code"
+
+def _digit_matrix(values: np.ndarray, width: int) -> np.ndarray:
+    """Fixed-width ASCII strings -> (n, width) matrix of digit values, with 'X' mapped to 10."""
+    raw = np.frombuffer(values.astype(f"S{width}").tobytes(), dtype=np.uint8).reshape(-1, width)
+    return np.where(raw == ord('X'), 10, raw.astype(np.int64) - ord('0'))
+
+def canonicalize_isbn(isbns: pd.Series) -> pd.Series:
+    """Normalizes ISBNs to one canonical string per book.
+
+    Hyphens, spaces and other separators are dropped and a lowercase check digit 'x' is
+    upper-cased. Checksum-valid ISBN-13s with the 978 prefix become the equivalent ISBN-10,
+    which is the form the Book-Crossing catalog uses. Values that are not checksum-valid
+    ISBNs are only stripped of surrounding whitespace, so they still get a stable code.
+    """
+    original = isbns.astype(str).str.strip()
+    cleaned = original.str.upper().str.replace(r'[^0-9X]', '', regex=True)
+    canonical = original.to_numpy(dtype=object).copy()
+    lengths = cleaned.str.len().to_numpy()
+
+    # ISBN-10: digits with an optional trailing X, weighted sum 10..1 divisible by 11
+    is10 = (lengths == 10) & cleaned.str.fullmatch(r'\d{9}[\dX]').to_numpy()
+    if is10.any():
+        digits = _digit_matrix(cleaned[is10].to_numpy(), 10)
+        is10[is10] = (digits @ np.arange(10, 0, -1)) % 11 == 0
+        canonical[is10] = cleaned[is10].to_numpy()
+
+    # ISBN-13: digits only, alternating 1/3 weights divisible by 10; 978-prefixed ones map to ISBN-10
+    is13 = (lengths == 13) & cleaned.str.fullmatch(r'97[89]\d{10}').to_numpy()
+    if is13.any():
+        digits = _digit_matrix(cleaned[is13].to_numpy(), 13)
+        is13[is13] = (digits @ np.tile([1, 3], 7)[:13]) % 10 == 0
+        canonical[is13] = cleaned[is13].to_numpy()
+    is978 = is13 & cleaned.str.startswith('978').to_numpy()
+    if is978.any():
+        body = _digit_matrix(cleaned[is978].to_numpy(), 13)[:, 3:12]
+        check = (11 - (body @ np.arange(10, 1, -1)) % 11) % 11
+        check_chars = np.where(check == 10, 'X', check.astype(str))
+        canonical[is978] = (cleaned[is978].str.slice(3, 12) + check_chars).to_numpy()
+
+    return pd.Series(canonical, index=isbns.index, dtype=object)
+
+def key_index(keys, column: str) -> pd.Index:
+    """Sorted index of distinct keys; a key's position is its dense int32 code.
+
+    Sorting keeps codes in the same order pandas uses for pivot/groupby labels, so code-indexed
+    arrays line up with label-indexed frames.
+    """
+    return pd.Index(np.sort(pd.unique(np.asarray(keys))), name=column)
+
+def build_registry(data: pd.DataFrame) -> dict:
+    """Builds one key index per namespace from the columns of a preprocessed table."""
+    registry = {}
+    for namespace, column in NAMESPACES.items():
+        keys = AGE_GROUPS if namespace == 'age_group' else data[column].dropna()
+        registry[namespace] = key_index(keys, column)
+    return registry
+
+def encode(index: pd.Index, values) -> np.ndarray:
+    """Maps keys to int32 codes; unknown keys map to -1."""
+    return index.get_indexer(values).astype(np.int32)
+
+def decode(index: pd.Index, codes) -> np.ndarray:
+    """Maps int32 codes back to keys; unknown codes (-1) map to None instead of wrapping to the last key."""
+    codes = np.asarray(codes)
+    unknown = codes < 0
+    if not unknown.any():
+        return index.to_numpy()[codes]
+    keys = np.full(codes.shape, None, dtype=object)
+    keys[~unknown] = index.to_numpy()[codes[~unknown]]
+    return keys if codes.ndim else keys.item()
+
+def encode_frame(data: pd.DataFrame, registry: dict) -> pd.DataFrame:
+    """Adds an int32 `<namespace>_code` column for every registry namespace present in `data`."""
+    for namespace, column in NAMESPACES.items():
+        if column in data.columns:
+            data[code_column(namespace)] = encode(registry[namespace], data[column])
+    return data
+
+def registry_version(registry: dict) -> str:
+    """Digest of every namespace's keys in code order.
+
+    Codes are positions in sorted key lists, so a re-preprocess that adds one key shifts every later
+    code; the digest changes with it, which lets code-keyed artifacts tell they are stale.
+    """
+    digest = hashlib.sha1()
+    for namespace in sorted(registry):
+        digest.update(namespace.encode())
+        digest.update(pd.util.hash_pandas_object(pd.Series(registry[namespace]), index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+def save_registry(registry: dict, registry_dir: str = REGISTRY_DIR) -> None:
+    """Persists every namespace as a two-column (code, key) Parquet file."""
+    try:
+        os.makedirs(registry_dir, exist_ok=True)
+        for namespace, index in registry.items():
+            pd.DataFrame({
+                'code': np.arange(len(index), dtype=np.int32),
+                'key': index.to_numpy(),
+            }).to_parquet(os.path.join(registry_dir, f"{namespace}.parquet"), index=False)
+            logger.info(f"Registry namespace '{namespace}' saved with {len(index)} keys.")
+        with open(os.path.join(registry_dir, VERSION_FILE), 'w') as f:
+            json.dump({'version': registry_version(registry), 'keys': {n: len(i) for n, i in registry.items()}}, f, indent=2)
+    except Exception as e:
+        logger.error(f"Error saving ID registry: {e}")
+        raise
+
+def load_registry(namespace: str, registry_dir: str = REGISTRY_DIR) -> pd.Index:
+    """Loads one namespace as a key index whose positions are the codes."""
+    try:
+        table = pd.read_parquet(os.path.join(registry_dir, f"{namespace}.parquet"))
+        return pd.Index(table.sort_values('code')['key'].to_numpy(), name=NAMESPACES[namespace])
+    except Exception as e:
+        logger.error(f"Error loading ID registry namespace '{namespace}': {e}")
+        raise
+
+def load_registry_version(registry_dir: str = REGISTRY_DIR) -> str:
+    """Version of the registry on disk, as written by `save_registry`."""
+    try:
+        with open(os.path.join(registry_dir, VERSION_FILE)) as f:
+            return json.load(f)['version']
+    except Exception as e:
+        logger.error(f"Error loading ID registry version: {e}")
+        raise
+
+def check_registry_version(stored, artifact: str, registry_dir: str = REGISTRY_DIR) -> None:
+    """Rejects a code-keyed artifact built against another registry than the one on disk."""
+    current = load_registry_version(registry_dir)
+    if str(stored) != current:
+        raise ValueError(f"{artifact} was built against ID registry {stored}, but the current one is {current}; rebuild it.")
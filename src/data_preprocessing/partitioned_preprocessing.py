@@ -0,0 +1,245 @@
+import os
+import glob
+import shutil
+import argparse
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+import pyarrow as pa  # type: ignore
+import pyarrow.parquet as pq  # type: ignore
+from config.logging_configs import logger  # Import logger from your existing logging configuration
+from src.data_inject.csv_to_parquet import raw_parquet_path
+from src.data_preprocessing import id_registry
+from src.data_preprocessing.preprocessing_raw_data import (
+    OUTPUT_PATH, MIN_USER_RATINGS, MIN_BOOK_RATINGS,
+    RATINGS_COLUMNS, BOOKS_COLUMNS, USERS_COLUMNS,
+    scan_table, join_multiplicity, categorize_age, split_location, LOCATION_LEVELS,
+)
+
+# Define paths
+SHARDS_DIR = 'data/preprocessed_files/shards'  # Hash-partitioned Ratings/Users shards
+
+N_PARTITIONS = 64  # Number of user_id hash partitions; size it so one shard fits comfortably in memory
+BATCH_SIZE = 1_000_000  # Rows read per streamed batch while partitioning
+
+def partition_of(user_ids: np.ndarray, n_partitions: int) -> np.ndarray:
+    """Hash partition of each user id (multiplicative hash, so sequential ids spread evenly)."""
+    hashed = (user_ids.astype(np.uint64) * np.uint64(2654435761)) & np.uint64(0xFFFFFFFF)
+    return (hashed % np.uint64(n_partitions)).astype(np.int64)
+
+def shard_path(table: str, partition: int, shards_dir: str = SHARDS_DIR) -> str:
+    """Path of one hash partition of a raw table."""
+    return os.path.join(shards_dir, table, f"part-{partition:05d}.parquet")
+
+def partition_table(name: str, columns: dict, n_partitions: int, shards_dir: str = SHARDS_DIR,
+                    batch_size: int = BATCH_SIZE) -> None:
+    """Streams a raw Parquet table and appends each batch's rows to their user_id hash shard.
+
+    ISBNs are canonicalized on the way in, so every later pass counts and joins canonical keys.
+    """
+    try:
+        logger.info(f"Partitioning {name} into {n_partitions} shards...")
+        table_dir = os.path.join(shards_dir, name)
+        shutil.rmtree(table_dir, ignore_errors=True)
+        os.makedirs(table_dir, exist_ok=True)
+
+        parquet_file = pq.ParquetFile(raw_parquet_path(name))
+        schema = pa.schema([parquet_file.schema_arrow.field(raw).with_name(renamed) for raw, renamed in columns.items()])
+        writers = {}
+        try:
+            for batch in parquet_file.iter_batches(batch_size=batch_size, columns=list(columns)):
+                table = pa.Table.from_batches([batch]).rename_columns(list(columns.values()))
+                if 'isbn' in table.column_names:
+                    isbns = id_registry.canonicalize_isbn(table.column('isbn').to_pandas())
+                    table = table.set_column(table.column_names.index('isbn'), 'isbn', pa.array(isbns, type=pa.string()))
+                partitions = partition_of(table.column('user_id').to_numpy(), n_partitions)
+                order = np.argsort(partitions, kind='stable')
+                bounds = np.searchsorted(partitions[order], np.arange(n_partitions + 1))
+                for partition in range(n_partitions):
+                    if bounds[partition] == bounds[partition + 1]:
+                        continue
+                    if partition not in writers:
+                        writers[partition] = pq.ParquetWriter(shard_path(name, partition, shards_dir), schema)
+                    writers[partition].write_table(table.take(order[bounds[partition]:bounds[partition + 1]]))
+        finally:
+            for writer in writers.values():
+                writer.close()
+        logger.info(f"{name} partitioned into {len(writers)} non-empty shards.")
+    except Exception as e:
+        logger.error(f"Error partitioning {name}: {e}")
+        raise
+
+def read_shard(table: str, partition: int, columns: list = None, shards_dir: str = SHARDS_DIR) -> pd.DataFrame:
+    """Reads one shard, or an empty frame when the partition received no rows."""
+    path = shard_path(table, partition, shards_dir)
+    if not os.path.exists(path):
+        names = list((RATINGS_COLUMNS if table == 'Ratings' else USERS_COLUMNS).values())
+        return pd.DataFrame(columns=columns or names)
+    return pd.read_parquet(path, columns=columns)
+
+def valid_user_rows(ratings: pd.DataFrame, user_keys: pd.Series, book_multiplicity: np.ndarray,
+                    min_user_ratings: int = MIN_USER_RATINGS):
+    """Joined-row multiplicity of a shard's ratings and the mask of rows whose user passes the threshold.
+
+    `book_multiplicity` is already zero for ISBNs outside the current valid book set. Users are
+    never split across shards, so the user counts are exact.
+    """
+    multiplicity = book_multiplicity * join_multiplicity(ratings['user_id'], user_keys)
+    user_codes, _ = pd.factorize(ratings['user_id'])
+    user_counts = np.bincount(user_codes, weights=multiplicity, minlength=1)
+    return multiplicity, (multiplicity > 0) & (user_counts[user_codes] > min_user_ratings)
+
+def count_valid_books(catalog: pd.Index, book_weights: np.ndarray, n_partitions: int,
+                      shards_dir: str = SHARDS_DIR) -> np.ndarray:
+    """One pass over all shards: per-ISBN joined-row counts among rows of users passing the threshold."""
+    book_counts = np.zeros(len(catalog), dtype=np.float64)
+    for partition in range(n_partitions):
+        ratings = read_shard('Ratings', partition, ['user_id', 'isbn'], shards_dir)
+        user_keys = read_shard('Users', partition, ['user_id'], shards_dir)['user_id']
+        book_codes = catalog.get_indexer(ratings['isbn'])
+        book_multiplicity = np.where(book_codes >= 0, book_weights[book_codes], 0)
+        multiplicity, mask = valid_user_rows(ratings, user_keys, book_multiplicity)
+        book_counts += np.bincount(book_codes[mask], weights=multiplicity[mask], minlength=len(catalog))
+    return book_counts
+
+def filter_partition(partition: int, catalog: pd.Index, count_weights: np.ndarray, book_weights: np.ndarray,
+                     shards_dir: str = SHARDS_DIR):
+    """Ratings and Users rows of one shard that survive the thresholds.
+
+    Users are filtered against the book set the final counting pass used (`count_weights`),
+    books against the final valid set (`book_weights`); both coincide in k-core mode.
+    """
+    ratings = read_shard('Ratings', partition, shards_dir=shards_dir)
+    users = read_shard('Users', partition, shards_dir=shards_dir)
+    book_codes = catalog.get_indexer(ratings['isbn'])
+    book_multiplicity = np.where(book_codes >= 0, count_weights[book_codes], 0)
+    _, mask = valid_user_rows(ratings, users['user_id'], book_multiplicity)
+    ratings = ratings[mask & (book_weights[book_codes] > 0)]
+    return ratings, users[users['user_id'].isin(ratings['user_id'])]
+
+def build_partitioned_registry(catalog: pd.Index, count_weights: np.ndarray, book_weights: np.ndarray,
+                               n_partitions: int, shards_dir: str = SHARDS_DIR) -> dict:
+    """Builds the ID registry from the distinct surviving keys, collected shard by shard."""
+    user_ids, locations = [], []
+    for partition in range(n_partitions):
+        _, users = filter_partition(partition, catalog, count_weights, book_weights, shards_dir)
+        user_ids.append(users['user_id'].unique())
+        locations.append(users['location'].dropna().unique())
+    locations = pd.Series(np.concatenate(locations)).drop_duplicates()
+    levels = split_location(locations)
+    return {
+        'isbn': id_registry.key_index(catalog[book_weights > 0], 'isbn'),
+        'user': id_registry.key_index(np.concatenate(user_ids), 'user_id'),
+        'location': id_registry.key_index(locations, 'location'),
+        'age_group': id_registry.key_index(id_registry.AGE_GROUPS, 'age_group'),
+        **{level: id_registry.key_index(levels[level].dropna(), level) for level in LOCATION_LEVELS},
+    }
+
+def write_partition(partition: int, catalog: pd.Index, count_weights: np.ndarray, book_weights: np.ndarray,
+                    books_df: pd.DataFrame, registry: dict, output_dir: str, shards_dir: str = SHARDS_DIR) -> int:
+    """Filters one shard, joins attributes, encodes ids and writes it to the dataset."""
+    ratings, users = filter_partition(partition, catalog, count_weights, book_weights, shards_dir)
+    if ratings.empty:
+        return 0
+
+    valid_books = ratings.merge(books_df, on="isbn", how="inner").merge(users, on="user_id", how="inner")
+    valid_books["age_group"] = categorize_age(valid_books["age"])
+    valid_books[LOCATION_LEVELS] = split_location(valid_books["location"])
+    valid_books = id_registry.encode_frame(valid_books, registry)
+    valid_books.to_parquet(os.path.join(output_dir, f"part-{partition:05d}.parquet"), index=False)
+    return len(valid_books)
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Out-of-core, hash-partitioned preprocessing of raw ratings.")
+    parser.add_argument(
+        '--n_partitions', type=int, default=N_PARTITIONS, help='Number of user_id hash partitions.'
+    )
+    parser.add_argument(
+        '--k_core', action='store_true', help='Repeat the user/book threshold filters until both hold at once.'
+    )
+    parser.add_argument(
+        '--output_dir', type=str, default=OUTPUT_PATH, help='Directory of the partitioned raw_data dataset.'
+    )
+    parser.add_argument(
+        '--shards_dir', type=str, default=SHARDS_DIR, help='Scratch directory for the hash-partitioned shards.'
+    )
+    parser.add_argument(
+        '--keep_shards', action='store_true', help='Keep the shards after the dataset is written (they are removed by default).'
+    )
+    return parser.parse_args()
+
+def main():
+    """Main executable for out-of-core preprocessing.
+
+    Only the Books catalog is held in memory; Ratings and Users are co-partitioned by user_id so
+    each shard can be joined and user-filtered on its own. The book threshold needs global counts,
+    which are accumulated shard by shard into an array indexed by catalog position.
+    """
+    args = parse_args()
+
+    # Step 1: Hash-partition Ratings and Users by user_id
+    partition_table('Ratings', RATINGS_COLUMNS, args.n_partitions, args.shards_dir)
+    partition_table('Users', USERS_COLUMNS, args.n_partitions, args.shards_dir)
+
+    # Step 2: Load the Books catalog (canonical ISBNs) and its per-ISBN join multiplicity
+    try:
+        logger.info("Loading Books catalog...")
+        books_df = scan_table('Books', BOOKS_COLUMNS)
+        books_df['isbn'] = id_registry.canonicalize_isbn(books_df['isbn'])
+        catalog_counts = books_df['isbn'].value_counts(sort=False)
+        catalog, book_weights = catalog_counts.index, catalog_counts.to_numpy(dtype=np.float64)
+        logger.info(f"Books catalog loaded with {len(catalog)} distinct ISBNs.")
+    except Exception as e:
+        logger.error(f"Error loading Books catalog: {e}")
+        raise
+
+    # Step 3: Count ratings per book among valid users; repeat until stable in k-core mode
+    try:
+        logger.info(f"Filtering users with more than {MIN_USER_RATINGS} and books with more than {MIN_BOOK_RATINGS} ratings (k-core: {args.k_core})...")
+        count_weights = book_weights
+        while True:
+            book_counts = count_valid_books(catalog, count_weights, args.n_partitions, args.shards_dir)
+            book_weights = np.where(book_counts > MIN_BOOK_RATINGS, count_weights, 0)
+            logger.info(f"{np.count_nonzero(book_weights)} books pass the threshold.")
+            if not args.k_core or np.array_equal(book_weights, count_weights):
+                break
+            count_weights = book_weights
+    except Exception as e:
+        logger.error(f"Error filtering ratings: {e}")
+        raise
+
+    # Step 4: Build the ID registry from the surviving keys
+    try:
+        logger.info("Building the ID registry...")
+        registry = build_partitioned_registry(catalog, count_weights, book_weights, args.n_partitions, args.shards_dir)
+        id_registry.save_registry(registry)
+    except Exception as e:
+        logger.error(f"Error building ID registry: {e}")
+        raise
+
+    # Step 5: Join attributes per shard and write the partitioned raw_data dataset
+    try:
+        logger.info(f"Writing partitioned dataset to {args.output_dir}...")
+        if os.path.isdir(args.output_dir):
+            shutil.rmtree(args.output_dir)
+        elif os.path.exists(args.output_dir):
+            os.remove(args.output_dir)
+        os.makedirs(args.output_dir)
+        rows = sum(
+            write_partition(partition, catalog, count_weights, book_weights, books_df, registry, args.output_dir, args.shards_dir)
+            for partition in range(args.n_partitions)
+        )
+        logger.info(f"Partitioned dataset written with {rows} rows in {len(glob.glob(os.path.join(args.output_dir, '*.parquet')))} files.")
+    except Exception as e:
+        logger.error(f"Error writing partitioned dataset: {e}")
+        raise
+
+    # Step 6: Drop the shards, a full second copy of Ratings and Users, once the dataset is written
+    if not args.keep_shards:
+        shutil.rmtree(args.shards_dir, ignore_errors=True)
+        logger.info(f"Removed the shards under {args.shards_dir}.")
+
+    logger.info("Out-of-core data processing completed successfully.")
+
+if __name__ == "__main__":
+    main()
@@ -1,116 +1,193 @@
 import os
+import shutil
+import argparse
+import numpy as np  # type: ignore
 import pandas as pd  # type: ignore
 import logging
 from config.logging_configs import logger  # Import logger from your existing logging configuration
+from src.data_inject.csv_to_parquet import raw_parquet_path
+from src.data_preprocessing import id_registry
+
+# Define paths
+OUTPUT_PATH = 'data/preprocessed_files/raw_data.parquet'
+
+# Filtering thresholds: keep users with more than MIN_USER_RATINGS and books with more than MIN_BOOK_RATINGS ratings
+MIN_USER_RATINGS = 5
+MIN_BOOK_RATINGS = 10
+
+# Raw column name -> pipeline column name, per raw table
+RATINGS_COLUMNS = {'User-ID': 'user_id', 'ISBN': 'isbn', 'Book-Rating': 'book_rating'}
+BOOKS_COLUMNS = {
+    'ISBN': 'isbn',
+    'Book-Title': 'book_title',
+    'Book-Author': 'book_author',
+    'Year-Of-Publication': 'year_of_publication',
+    'Publisher': 'publisher',
+    'Image-URL-L': 'image_url',
+}
+USERS_COLUMNS = {'User-ID': 'user_id', 'Location': 'location', 'Age': 'age'}
+
+# Location hierarchy, finest level first, and location parts that count as missing
+LOCATION_LEVELS = ['city', 'state', 'country']
+MISSING_LOCATION_PARTS = ['', 'n/a']
+
+def scan_table(name: str, columns: dict, keep: list = None, filters=None) -> pd.DataFrame:
+    """Reads only the requested columns (and optionally only matching rows) of a raw Parquet table."""
+    raw_columns = [raw for raw, renamed in columns.items() if keep is None or renamed in keep]
+    return pd.read_parquet(raw_parquet_path(name), columns=raw_columns, filters=filters).rename(columns=columns)
+
+def join_multiplicity(keys: pd.Series, lookup_keys: pd.Series) -> np.ndarray:
+    """Number of rows an inner join of `keys` against `lookup_keys` produces for each key."""
+    return keys.map(lookup_keys.value_counts()).fillna(0).to_numpy(dtype=np.int64)
+
+def categorize_age(age: pd.Series) -> pd.Series:
+    """Buckets ages into age groups; same boundaries as the original row-wise rule."""
+    values = age.to_numpy(dtype=np.float64)
+    conditions = [
+        np.isnan(values),
+        values <= 19,
+        (values >= 20) & (values <= 35),
+        (values >= 36) & (values <= 55),
+    ]
+    choices = ["Unknown", "Teenager", "Young Adult", "Middle-aged"]
+    return pd.Series(np.select(conditions, choices, default="Senior"), index=age.index, dtype=object)
+
+def split_location(location: pd.Series) -> pd.DataFrame:
+    """Splits "city, state, country" strings into hierarchical city/state/country keys.
+
+    Parts are taken from the right, so a location with extra commas keeps them in the city and
+    one with fewer parts still has its country last. Each key carries its parents ("city, state,
+    country", "state, country", "country") so equal names in different regions stay distinct.
+    Blank and "n/a" parts are missing, and a level with a missing part is missing.
+    """
+    padded = (", , " + location.fillna("").astype(str).str.lower()).str.rsplit(",", n=2, expand=True)
+    parts = padded.apply(lambda part: part.str.strip())
+    parts[0] = parts[0].str.lstrip(", ")
+    parts = parts.mask(parts.isin(MISSING_LOCATION_PARTS))
+    city, state, country = parts[0], parts[1], parts[2]
+    return pd.DataFrame({
+        'city': city + ", " + state.fillna("") + ", " + country.fillna(""),
+        'state': state + ", " + country.fillna(""),
+        'country': country,
+    }, index=location.index)
+
+def threshold_mask(user_codes: np.ndarray, book_codes: np.ndarray, weights: np.ndarray,
+                   min_user_ratings: int = MIN_USER_RATINGS, min_book_ratings: int = MIN_BOOK_RATINGS,
+                   k_core: bool = False) -> np.ndarray:
+    """Computes which rows survive the user and book rating-count thresholds.
+
+    Counts come from `np.bincount` over dense codes, weighted by the number of joined rows each
+    rating expands to. The default is the original single pass (users first, then books among
+    valid users). With `k_core` the two filters repeat until both thresholds hold at once.
+    """
+    mask = weights > 0
+    while True:
+        user_counts = np.bincount(user_codes, weights=weights * mask)
+        mask_after_users = mask & (user_counts[user_codes] > min_user_ratings)
+        book_counts = np.bincount(book_codes, weights=weights * mask_after_users)
+        new_mask = mask_after_users & (book_counts[book_codes] > min_book_ratings)
+        if not k_core or np.array_equal(new_mask, mask):
+            return new_mask
+        mask = new_mask
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Preprocess raw ratings, books and users.")
+    parser.add_argument(
+        '--k_core', action='store_true', help='Repeat the user/book threshold filters until both hold at once.'
+    )
+    parser.add_argument(
+        '--output_file', type=str, default=OUTPUT_PATH, help='Path of the filtered ratings Parquet file.'
+    )
+    return parser.parse_args()
 
 def main():
-    # Step 1: Read CSV files into DataFrames
-    try:
-        logger.info("Reading CSV files...")
-        # Set low_memory=False to handle columns with mixed data types
-        books_df = pd.read_csv('data/raw_files/Books.csv', low_memory=False)
-        ratings_df = pd.read_csv('data/raw_files/Ratings.csv', low_memory=False)
-        users_df = pd.read_csv('data/raw_files/Users.csv', low_memory=False)
-        logger.info(f"CSV files read successfully. Rows in Books: {len(books_df)}, Rows in Ratings: {len(ratings_df)}, Rows in Users: {len(users_df)}")
-    except Exception as e:
-        logger.error(f"Error reading CSV files: {e}")
-        raise
+    args = parse_args()
 
-    # Step 2: Rename columns to match the required names
+    # Step 1: Scan only the join keys and ratings; wide attributes are read after filtering.
+    # ISBNs are canonicalized here so joins and thresholds count every spelling of a book as one
     try:
-        logger.info("Renaming columns...")
-        users_df_v2 = users_df.rename(columns={
-            'User-ID': 'user_id',
-            'Location': 'location',
-            'Age': 'age'
-        })
-
-        ratings_df_v2 = ratings_df.rename(columns={
-            'User-ID': 'user_id',
-            'ISBN': 'isbn',
-            'Book-Rating': 'book_rating'
-        })
-
-        # Step 3: Select the required columns for books and rename
-        books_v2 = books_df[['ISBN', 'Book-Title', 'Book-Author', 'Year-Of-Publication', 'Publisher', 'Image-URL-L']].copy()
-        books_v2.rename(columns={
-            'ISBN': 'isbn',
-            'Book-Title': 'book_title',
-            'Book-Author': 'book_author',
-            'Year-Of-Publication': 'year_of_publication',
-            'Publisher': 'publisher',
-            'Image-URL-L': 'image_url'
-        }, inplace=True)
-        logger.info(f"Columns renamed successfully. Rows in Books: {len(books_v2)}, Rows in Ratings: {len(ratings_df_v2)}, Rows in Users: {len(users_df_v2)}")
+        logger.info("Reading raw Parquet key columns...")
+        ratings_df = scan_table('Ratings', RATINGS_COLUMNS)
+        ratings_df['isbn'] = id_registry.canonicalize_isbn(ratings_df['isbn'])
+        raw_book_keys = scan_table('Books', BOOKS_COLUMNS, keep=['isbn'])['isbn']
+        book_keys = id_registry.canonicalize_isbn(raw_book_keys)
+        user_keys = scan_table('Users', USERS_COLUMNS, keep=['user_id'])['user_id']
+        logger.info(f"Key columns read successfully. Rows in Books: {len(book_keys)}, Rows in Ratings: {len(ratings_df)}, Rows in Users: {len(user_keys)}")
     except Exception as e:
-        logger.error(f"Error renaming columns: {e}")
+        logger.error(f"Error reading raw Parquet files: {e}")
         raise
 
-    # Step 4: Merge Ratings with Books
+    # Step 2: Resolve the Books and Users inner joins as per-rating row multiplicities
     try:
-        logger.info("Merging Ratings with Books...")
-        ratings_with_books = ratings_df_v2.merge(books_v2, on="isbn", how="inner")
-        logger.info(f"Merge with Books completed. Rows after merge: {len(ratings_with_books)}")
+        logger.info("Resolving joins with Books and Users...")
+        multiplicity = join_multiplicity(ratings_df['isbn'], book_keys) * join_multiplicity(ratings_df['user_id'], user_keys)
+        logger.info(f"Joins resolved. Rows after merge: {multiplicity.sum()}")
     except Exception as e:
-        logger.error(f"Error merging Ratings with Books: {e}")
+        logger.error(f"Error resolving joins: {e}")
         raise
 
-    # Step 5: Merge Ratings with Users (age)
+    # Step 3: Filter users with more than 5 ratings and books with more than 10 ratings
     try:
-        logger.info("Merging Ratings with Users (age)...")
-        ratings_with_age_books = ratings_with_books.merge(users_df_v2, on="user_id", how="inner")
-        logger.info(f"Merge with Users completed. Rows after merge: {len(ratings_with_age_books)}")
+        logger.info(f"Filtering users with more than {MIN_USER_RATINGS} and books with more than {MIN_BOOK_RATINGS} ratings (k-core: {args.k_core})...")
+        user_codes, _ = pd.factorize(ratings_df['user_id'], use_na_sentinel=False)
+        book_codes, _ = pd.factorize(ratings_df['isbn'], use_na_sentinel=False)
+        mask = threshold_mask(user_codes, book_codes, multiplicity, k_core=args.k_core)
+        # Row position each rating would have had in the fully merged, re-indexed frame
+        first_row = np.cumsum(multiplicity) - multiplicity
+        ratings_df = ratings_df[mask]
+        first_row, multiplicity = first_row[mask], multiplicity[mask]
+        logger.info(f"Filtered {multiplicity.sum()} valid rows.")
     except Exception as e:
-        logger.error(f"Error merging Ratings with Users: {e}")
+        logger.error(f"Error filtering ratings: {e}")
         raise
 
-    # Step 6: Reset the index and drop the old index column
-    ratings_data_with_age_books_infos = ratings_with_age_books.reset_index(drop=True)
-
-    # Step 7: Categorize Age Groups
+    # Step 4: Materialize book and user attributes for the surviving keys only
     try:
-        logger.info("Categorizing Age Groups...")
-        def categorize_age(age):
-            if pd.isna(age):
-                return "Unknown"
-            elif age <= 19:
-                return "Teenager"
-            elif 20 <= age <= 35:
-                return "Young Adult"
-            elif 36 <= age <= 55:
-                return "Middle-aged"
-            else:
-                return "Senior"
-
-        ratings_data_with_age_books_infos["age_group"] = ratings_data_with_age_books_infos["age"].apply(categorize_age)
-        logger.info(f"Age categorization completed. Rows after categorization: {len(ratings_data_with_age_books_infos)}")
+        logger.info("Merging surviving ratings with Books and Users...")
+        raw_isbns = raw_book_keys[book_keys.isin(ratings_df['isbn'].unique())].unique().tolist()
+        books_df = scan_table('Books', BOOKS_COLUMNS, filters=[('ISBN', 'in', raw_isbns)])
+        books_df['isbn'] = id_registry.canonicalize_isbn(books_df['isbn'])
+        users_df = scan_table('Users', USERS_COLUMNS, filters=[('User-ID', 'in', ratings_df['user_id'].unique().tolist())])
+        valid_books = ratings_df.merge(books_df, on="isbn", how="inner").merge(users_df, on="user_id", how="inner")
+        # Keep the index the original full merge + reset_index produced
+        offsets = np.arange(len(valid_books)) - np.repeat(np.cumsum(multiplicity) - multiplicity, multiplicity)
+        valid_books.index = np.repeat(first_row, multiplicity) + offsets
+        logger.info(f"Merge completed. Rows after merge: {len(valid_books)}")
     except Exception as e:
-        logger.error(f"Error categorizing age: {e}")
+        logger.error(f"Error merging attributes: {e}")
         raise
 
-    # Step 8: Filter for users with more than 5 ratings
+    # Step 5: Categorize Age Groups and split locations into city/state/country levels
     try:
-        logger.info("Filtering users with more than 5 ratings...")
-        valid_users = ratings_data_with_age_books_infos.groupby('user_id').filter(lambda x: len(x) > 5)
-        logger.info(f"Filtered {len(valid_users)} valid users.")
+        logger.info("Categorizing Age Groups and splitting locations...")
+        valid_books["age_group"] = categorize_age(valid_books["age"])
+        valid_books[LOCATION_LEVELS] = split_location(valid_books["location"])
+        logger.info(f"Age categorization completed. Rows after categorization: {len(valid_books)}")
     except Exception as e:
-        logger.error(f"Error filtering users: {e}")
+        logger.error(f"Error categorizing age or splitting locations: {e}")
         raise
 
-    # Step 9: Filter for books (ISBNs) with more than 10 ratings
+    # Step 6: Encode ids with the shared registry
     try:
-        logger.info("Filtering books with more than 10 ratings...")
-        valid_books = valid_users.groupby('isbn').filter(lambda x: len(x) > 10)
-        logger.info(f"Filtered {len(valid_books)} valid books.")
+        logger.info("Building the ID registry...")
+        registry = id_registry.build_registry(valid_books)
+        id_registry.save_registry(registry)
+        valid_books = id_registry.encode_frame(valid_books, registry)
+        logger.info("ID registry built and code columns added.")
     except Exception as e:
-        logger.error(f"Error filtering books: {e}")
+        logger.error(f"Error building ID registry: {e}")
         raise
 
-    # Step 10: Save the filtered data to a Parquet file
+    # Step 7: Save the filtered data to a Parquet file
     try:
         logger.info("Saving filtered data to a Parquet file...")
-        valid_books.to_parquet('data/preprocessed_files/raw_data.parquet')
-        logger.info("Filtered data saved successfully to data/preprocessed_files/raw_data.parquet.")
+        os.makedirs(os.path.dirname(args.output_file), exist_ok=True)
+        if os.path.isdir(args.output_file):
+            # Replace a partitioned dataset left by the out-of-core mode
+            shutil.rmtree(args.output_file)
+        valid_books.to_parquet(args.output_file)
+        logger.info(f"Filtered data saved successfully to {args.output_file}.")
     except Exception as e:
         logger.error(f"Error saving data to Parquet: {e}")
         raise
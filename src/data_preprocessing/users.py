@@ -16,7 +16,10 @@ def main():
     try:
         logger.info("Processing user information...")
         # Select the relevant columns
-        user_infos = filtered_data[['user_id', 'location', 'age', 'age_group']]
+        user_infos = filtered_data[[
+            'user_id', 'location', 'age', 'age_group', 'city', 'state', 'country',
+            'user_code', 'location_code', 'age_group_code', 'city_code', 'state_code', 'country_code',
+        ]]
 
         # Drop duplicates based on user_id, location, and age
         user_infos = user_infos.drop_duplicates()
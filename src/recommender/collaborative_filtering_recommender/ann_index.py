@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import numpy as np  # type: ignore
+from scipy.sparse import csr_matrix, issparse  # type: ignore
+from sklearn.decomposition import TruncatedSVD  # type: ignore
+from config.logging_configs import logger  # Assuming your logging is set up
+from src.recommender.collaborative_filtering_recommender import item_similarity
+
+# Define paths
+ANN_INDEX_PATH = "data/recommender_result/ann_index.npz"
+RECALL_REPORT_PATH = "data/recommender_result/ann_recall_report.json"
+
+# Recall/speed knobs: more tables, a wider window and more NN-descent passes raise recall;
+# more bits make buckets smaller and seeding faster
+N_TABLES = 8
+N_BITS = 12
+WINDOW = 8
+N_ITERATIONS = 3  # NN-descent refinement passes over the seeded k-NN graph
+N_WALKS = 32  # Two-hop co-rating walks per item that also seed the graph (interaction vectors only)
+MAX_CANDIDATES = 512  # Serve-time cap on candidates re-ranked per query
+
+def item_vectors(user_item_matrix: csr_matrix, source: str = 'interactions', n_components: int = 64):
+    """Unit-norm item vectors: raw interaction columns (sparse) or SVD item factors (dense)."""
+    if source == 'interactions':
+        return item_similarity.normalize_columns(user_item_matrix).T.tocsr()
+    if source == 'svd':
+        n_components = max(1, min(n_components, min(user_item_matrix.shape) - 1))
+        svd = TruncatedSVD(n_components=n_components, random_state=42).fit(user_item_matrix)
+        factors = (svd.components_.T * svd.singular_values_).astype(np.float32)
+        norms = np.linalg.norm(factors, axis=1, keepdims=True)
+        return np.divide(factors, norms, out=np.zeros_like(factors), where=norms > 0)
+    raise ValueError(f"Unknown vector source {source!r}; use 'interactions' or 'svd'.")
+
+def hash_keys(vectors, planes: np.ndarray) -> np.ndarray:
+    """Signed random projection hash: one int64 bucket key per table and vector."""
+    weights = np.left_shift(1, np.arange(planes.shape[2], dtype=np.int64))
+    return np.stack([((vectors @ table_planes) > 0) @ weights for table_planes in planes]).astype(np.int64)
+
+def build_ann_index(vectors, n_tables: int = N_TABLES, n_bits: int = N_BITS, seed: int = 42) -> dict:
+    """Random-projection LSH tables over unit-norm item vectors (dense array or CSR rows)."""
+    try:
+        logger.info(f"Building LSH index with {n_tables} tables of {n_bits} bits over {vectors.shape[0]} items...")
+        rng = np.random.default_rng(seed)
+        planes = rng.standard_normal((n_tables, vectors.shape[1], n_bits)).astype(np.float32)
+        keys = hash_keys(vectors, planes)
+        order = np.argsort(keys, axis=1, kind='stable').astype(np.int32)
+        return {
+            'planes': planes,
+            'keys': keys,
+            'order': order,
+            'sorted_keys': np.take_along_axis(keys, order, axis=1),
+            'vectors': vectors,
+        }
+    except Exception as e:
+        logger.error(f"Error building ANN index: {e}")
+        raise
+
+def pair_scores(vectors, rows: np.ndarray, candidates: np.ndarray, max_elements: int = 1 << 24) -> np.ndarray:
+    """Cosine score of every (row, candidate) pair; candidate -1 scores -inf."""
+    safe = np.where(candidates >= 0, candidates, 0)
+    scores = np.zeros(candidates.shape, dtype=np.float32)
+    if issparse(vectors):
+        row_vectors = vectors[rows]
+        for c in range(candidates.shape[1]):
+            scores[:, c] = np.asarray(row_vectors.multiply(vectors[safe[:, c]]).sum(axis=1)).ravel()
+    else:
+        chunk = max(1, max_elements // max(1, candidates.shape[1] * vectors.shape[1]))
+        for start in range(0, len(rows), chunk):
+            stop = start + chunk
+            scores[start:stop] = np.einsum('nd,ncd->nc', vectors[rows[start:stop]], vectors[safe[start:stop]])
+    return np.where(candidates >= 0, scores, -np.inf).astype(np.float32)
+
+def rerank(vectors, rows: np.ndarray, candidates: np.ndarray, top_k: int):
+    """De-duplicates candidate ids per row, scores them exactly and keeps the top k."""
+    candidates = np.sort(candidates, axis=1)
+    candidates[:, 1:][candidates[:, 1:] == candidates[:, :-1]] = -1
+    candidates[candidates == rows[:, None]] = -1
+    positions, scores = item_similarity.top_k_rows(pair_scores(vectors, rows, candidates), top_k)
+    picked = np.take_along_axis(candidates, np.maximum(positions, 0), axis=1)
+    neighbours = np.full((len(rows), top_k), -1, dtype=np.int32)
+    padded_scores = np.zeros((len(rows), top_k), dtype=np.float32)
+    neighbours[:, :picked.shape[1]] = np.where(positions >= 0, picked, -1)
+    padded_scores[:, :scores.shape[1]] = scores
+    return neighbours, padded_scores
+
+def lsh_candidates(index: dict, rows: np.ndarray, positions: np.ndarray, window: int) -> np.ndarray:
+    """Items within `window` key-sorted positions of each row that share its bucket, in every table."""
+    n_items = index['keys'].shape[1]
+    offsets = np.r_[-window:0, 1:window + 1]
+    candidates = []
+    for t in range(index['keys'].shape[0]):
+        probe = np.clip(positions[t, rows][:, None] + offsets[None, :], 0, n_items - 1)
+        same_bucket = index['sorted_keys'][t, probe] == index['keys'][t, rows][:, None]
+        candidates.append(np.where(same_bucket, index['order'][t, probe], -1))
+    return np.concatenate(candidates, axis=1)
+
+def walk_candidates(vectors: csr_matrix, users: csr_matrix, rows: np.ndarray, n_walks: int,
+                    rng: np.random.Generator) -> np.ndarray:
+    """Two-hop random walks item -> one of its users -> one of that user's items.
+
+    Only meaningful for interaction vectors: every item with a positive cosine shares a user with
+    the row, and walks reach items in proportion to how many users they share.
+    """
+    if vectors.nnz == 0 or users.nnz == 0:
+        return np.full((len(rows), n_walks), -1, dtype=np.int32)
+    degrees = np.diff(vectors.indptr)[rows]
+    picks = (rng.random((len(rows), n_walks)) * degrees[:, None]).astype(np.int64)
+    walked_users = vectors.indices[np.minimum(vectors.indptr[rows][:, None] + picks, len(vectors.indices) - 1)]
+    user_degrees = np.diff(users.indptr)[walked_users]
+    picks = (rng.random(walked_users.shape) * user_degrees).astype(np.int64)
+    candidates = users.indices[np.minimum(users.indptr[walked_users] + picks, len(users.indices) - 1)]
+    return np.where(degrees[:, None] > 0, candidates, -1).astype(np.int32)
+
+def reverse_neighbours(neighbours: np.ndarray) -> np.ndarray:
+    """For every item, up to k items that list it as a neighbour (the reverse k-NN graph)."""
+    n_items, top_k = neighbours.shape
+    sources = np.repeat(np.arange(n_items, dtype=np.int32), top_k)
+    targets = neighbours.ravel()
+    sources, targets = sources[targets >= 0], targets[targets >= 0]
+    order = np.argsort(targets, kind='stable')
+    sources, targets = sources[order], targets[order]
+    rank = np.arange(len(targets)) - np.searchsorted(targets, targets)
+    keep = rank < top_k
+    reverse = np.full((n_items, top_k), -1, dtype=np.int32)
+    reverse[targets[keep], rank[keep]] = sources[keep]
+    return reverse
+
+def ann_top_k(index: dict, top_k: int = 10, window: int = WINDOW, n_iterations: int = N_ITERATIONS,
+              n_walks: int = N_WALKS, batch_size: int = 10000, seed: int = 42):
+    """Approximate top-k neighbours of every indexed item.
+
+    A k-NN graph is seeded from the LSH tables (same-bucket items within `window` positions of
+    each item's key-sorted slot) plus, for interaction vectors, `n_walks` two-hop co-rating walks.
+    NN-descent then refines it: every iteration re-ranks each item's neighbours, reverse
+    neighbours and their neighbours by exact cosine and keeps the best k.
+    """
+    try:
+        n_tables, n_items = index['keys'].shape
+        vectors = index['vectors']
+        users = vectors.T.tocsr() if issparse(vectors) and n_walks > 0 else None
+        rng = np.random.default_rng(seed)
+        positions = np.empty_like(index['order'])
+        np.put_along_axis(positions, index['order'], np.tile(np.arange(n_items, dtype=np.int32), (n_tables, 1)), axis=1)
+
+        neighbours = np.full((n_items, top_k), -1, dtype=np.int32)
+        scores = np.zeros((n_items, top_k), dtype=np.float32)
+        for start in range(0, n_items, batch_size):
+            rows = np.arange(start, min(start + batch_size, n_items))
+            candidates = lsh_candidates(index, rows, positions, window)
+            if users is not None:
+                candidates = np.concatenate([candidates, walk_candidates(vectors, users, rows, n_walks, rng)], axis=1)
+            neighbours[rows], scores[rows] = rerank(vectors, rows, candidates, top_k)
+
+        for iteration in range(n_iterations):
+            graph = np.concatenate([neighbours, reverse_neighbours(neighbours)], axis=1)
+            previous = neighbours.copy()
+            for start in range(0, n_items, batch_size):
+                rows = np.arange(start, min(start + batch_size, n_items))
+                current = graph[rows]
+                expanded = np.where(current[:, :, None] >= 0, neighbours[np.maximum(current, 0)], -1).reshape(len(rows), -1)
+                neighbours[rows], scores[rows] = rerank(vectors, rows, np.concatenate([current, expanded], axis=1), top_k)
+            changed = np.count_nonzero(neighbours != previous)
+            logger.info(f"NN-descent iteration {iteration + 1}: {changed} neighbour slots changed.")
+            if changed == 0:
+                break
+        return neighbours, scores
+    except Exception as e:
+        logger.error(f"Error querying ANN index: {e}")
+        raise
+
+def query_ann(index: dict, item: int, top_k: int = 10, max_candidates: int = MAX_CANDIDATES):
+    """Serve-time lookup of one item's approximate neighbours, as `top_k` (neighbour, score) entries padded with -1 / 0.
+
+    Reads the item's row of the refined k-NN graph when the index carries one; otherwise re-ranks
+    the item's bucket-mates from every table, or scores the item against every item when its
+    buckets hold fewer than `top_k` others.
+    """
+    if 'neighbours' in index and top_k <= index['neighbours'].shape[1]:
+        return index['neighbours'][item, :top_k], index['scores'][item, :top_k]
+    candidates = []
+    for t in range(index['keys'].shape[0]):
+        key = index['keys'][t, item]
+        lo, hi = np.searchsorted(index['sorted_keys'][t], [key, key + 1])
+        candidates.append(index['order'][t, lo:min(hi, lo + max_candidates)])
+    candidates = np.unique(np.concatenate(candidates))
+    candidates = candidates[candidates != item][:max_candidates]
+    if len(candidates) >= top_k:
+        neighbours, scores = rerank(index['vectors'], np.array([item]), candidates[None, :], top_k)
+        return neighbours[0], scores[0]
+
+    # Buckets too small to fill the list: brute-force the item's row against every item
+    row = index['vectors'][item] @ index['vectors'].T
+    block = (row.toarray() if issparse(row) else np.asarray(row).reshape(1, -1)).astype(np.float32)
+    block[0, item] = -np.inf
+    positions, block_scores = item_similarity.top_k_rows(block, top_k)
+    neighbours, scores = np.full(top_k, -1, dtype=np.int32), np.zeros(top_k, dtype=np.float32)
+    neighbours[:positions.shape[1]], scores[:block_scores.shape[1]] = positions[0], block_scores[0]
+    return neighbours, scores
+
+def save_ann_index(index: dict, path: str = ANN_INDEX_PATH) -> None:
+    """Persists the index (planes, bucket tables, item vectors and any k-NN graph) to one `.npz` file."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {name: value for name, value in index.items() if name != 'vectors'}
+        vectors = index['vectors']
+        if issparse(vectors):
+            arrays.update(vector_data=vectors.data, vector_indices=vectors.indices,
+                          vector_indptr=vectors.indptr, vector_shape=np.array(vectors.shape))
+        else:
+            arrays['vectors'] = vectors
+        np.savez(path, **arrays)
+        logger.info(f"ANN index saved to {path}.")
+    except Exception as e:
+        logger.error(f"Error saving ANN index: {e}")
+        raise
+
+def load_ann_index(path: str = ANN_INDEX_PATH) -> dict:
+    """Loads an index written by `save_ann_index`."""
+    with np.load(path) as stored:
+        index = {name: stored[name] for name in ('planes', 'keys', 'order', 'sorted_keys', 'neighbours', 'scores')
+                 if name in stored}
+        if 'vectors' in stored:
+            index['vectors'] = stored['vectors']
+        else:
+            index['vectors'] = csr_matrix(
+                (stored['vector_data'], stored['vector_indices'], stored['vector_indptr']),
+                shape=tuple(stored['vector_shape']),
+            )
+    return index
+
+def recall_report(user_item_matrix: csr_matrix, approximate: np.ndarray, top_k: int = 10, sample_size: int = 1000,
+                  seed: int = 42) -> dict:
+    """recall@k of approximate neighbours against the exact engine, on a random sample of items."""
+    try:
+        n_items = user_item_matrix.shape[1]
+        sample = np.sort(np.random.default_rng(seed).choice(n_items, size=min(sample_size, n_items), replace=False))
+
+        started = time.perf_counter()
+        normalized = item_similarity.normalize_columns(user_item_matrix)
+        block = (normalized.T.tocsr()[sample] @ normalized).toarray()
+        block[np.arange(len(sample)), sample] = -np.inf
+        exact, _ = item_similarity.top_k_rows(block, top_k)
+        exact_seconds = time.perf_counter() - started
+
+        hits = total = 0
+        for exact_row, ann_row in zip(exact, approximate[sample]):
+            truth = set(exact_row[exact_row >= 0].tolist())
+            hits += len(truth & set(ann_row[ann_row >= 0].tolist()))
+            total += len(truth)
+        report = {
+            'top_k': top_k,
+            'sample_size': int(len(sample)),
+            'n_items': int(n_items),
+            f'recall_at_{top_k}': hits / total if total else 1.0,
+            'exact_seconds_on_sample': round(exact_seconds, 3),
+            'exact_seconds_all_items_estimate': round(exact_seconds * n_items / max(len(sample), 1), 3),
+        }
+        logger.info(f"ANN recall report: {report}")
+        return report
+    except Exception as e:
+        logger.error(f"Error computing ANN recall report: {e}")
+        raise
+
+def save_recall_report(report: dict, path: str = RECALL_REPORT_PATH) -> None:
+    """Writes the recall report as JSON."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,104 @@
+import os
+import time
+import argparse
+import tracemalloc
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.cluster import MiniBatchKMeans  # type: ignore
+from sklearn.metrics import silhouette_score  # type: ignore
+from config.logging_configs import logger  # Assuming your logging is set up
+from src.recommender.collaborative_filtering_recommender import interaction_matrix, item_similarity
+from src.recommender.collaborative_filtering_recommender.recommended_for_you import perform_svd
+
+# Define paths
+RAW_PARQUET_PATH = "data/preprocessed_files/raw_data.parquet"
+FACTORS_PATH = "data/recommender_result/sweep_factors.npy"  # Shared with the workers through a memory map
+REPORT_PATH = "data/recommender_result/sweep_report.csv"
+
+N_COMPONENTS = [25, 50, 100]
+N_CLUSTERS = [10, 20, 30, 50]
+SILHOUETTE_SAMPLE = 10_000
+
+def fit_config(factors_path: str, n_components: int, n_clusters: int, silhouette_sample: int) -> dict:
+    """Worker: KMeans on the first `n_components` SVD coordinates, with quality, time and peak memory."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    factors = np.ascontiguousarray(np.load(factors_path, mmap_mode='r')[:, :n_components])
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=1000)
+    labels = kmeans.fit_predict(factors)
+    fit_seconds = time.perf_counter() - started
+    sample_size = min(silhouette_sample, len(factors))
+    silhouette = (silhouette_score(factors, labels, sample_size=sample_size, random_state=42)
+                  if 1 < len(np.unique(labels)) < sample_size else float('nan'))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'n_components': n_components,
+        'n_clusters': n_clusters,
+        'inertia': float(kmeans.inertia_),
+        'silhouette': float(silhouette),
+        'fit_seconds': round(fit_seconds, 3),
+        'total_seconds': round(time.perf_counter() - started, 3),
+        'peak_memory_mb': round(peak / 2**20, 1),
+    }
+
+def sweep(user_book_sparse, n_components: list = N_COMPONENTS, n_clusters: list = N_CLUSTERS,
+          silhouette_sample: int = SILHOUETTE_SAMPLE, n_jobs: int = item_similarity.N_JOBS,
+          factors_path: str = FACTORS_PATH) -> pd.DataFrame:
+    """Fits the SVD once at the largest rank and every (rank, cluster count) KMeans in a process pool.
+
+    TruncatedSVD orders components by singular value, so the first k columns of the largest-rank
+    coordinates are the rank-k coordinates; workers read them from one memory-mapped file.
+    """
+    try:
+        max_rank = min(max(n_components), min(user_book_sparse.shape) - 1)
+        started = time.perf_counter()
+        factors, _ = perform_svd(user_book_sparse, max_rank)
+        svd_seconds = time.perf_counter() - started
+        os.makedirs(os.path.dirname(factors_path), exist_ok=True)
+        np.save(factors_path, factors.astype(np.float32))
+
+        configs = [(k, c) for k in sorted(set(n_components)) if k <= max_rank for c in sorted(set(n_clusters))]
+        logger.info(f"Sweeping {len(configs)} configurations with {n_jobs} processes (SVD took {svd_seconds:.2f}s)...")
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(fit_config, factors_path, k, c, silhouette_sample) for k, c in configs]
+            results = [future.result() for future in futures]
+        os.remove(factors_path)
+
+        report = pd.DataFrame(results)
+        report['svd_seconds_shared'] = round(svd_seconds, 3)
+        return report.sort_values('silhouette', ascending=False).reset_index(drop=True)
+    except Exception as e:
+        logger.error(f"Error running hyperparameter sweep: {e}")
+        raise
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Sweep SVD rank and cluster count for recommended_for_you.")
+    parser.add_argument('--n_components', type=int, nargs='+', default=N_COMPONENTS, help='SVD ranks to try.')
+    parser.add_argument('--n_clusters', type=int, nargs='+', default=N_CLUSTERS, help='Cluster counts to try.')
+    parser.add_argument('--silhouette_sample', type=int, default=SILHOUETTE_SAMPLE, help='Users sampled for the silhouette score.')
+    parser.add_argument('--n_jobs', type=int, default=item_similarity.N_JOBS, help='Worker processes.')
+    return parser.parse_args()
+
+def main():
+    """Main executable for the hyperparameter sweep."""
+    args = parse_args()
+    try:
+        # Step 1: Load the shared user-book matrix
+        user_book_sparse, _, _ = interaction_matrix.load_interaction_matrix(RAW_PARQUET_PATH)
+
+        # Step 2: Run the sweep
+        report = sweep(user_book_sparse, args.n_components, args.n_clusters, args.silhouette_sample, args.n_jobs)
+
+        # Step 3: Save the report
+        report.to_csv(REPORT_PATH, index=False)
+        best = report.iloc[0]
+        logger.info(f"Sweep report saved to {REPORT_PATH}; best silhouette: {int(best['n_components'])} components, {int(best['n_clusters'])} clusters.")
+    except Exception as e:
+        logger.error(f"An error occurred in the main process: {e}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import argparse
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+from concurrent.futures import ThreadPoolExecutor
+from scipy.sparse import csr_matrix  # type: ignore
+from config.logging_configs import logger  # Assuming your logging is set up
+from src.data_preprocessing import id_registry
+from src.recommender.collaborative_filtering_recommender import interaction_matrix, item_similarity, latent_scoring
+from src.recommender import list_artifacts
+
+# Define paths
+RAW_PARQUET_PATH = "data/preprocessed_files/raw_data.parquet"
+MATRIX_CACHE_PATH = interaction_matrix.IMPLICIT_MATRIX_CACHE_PATH
+OUTPUT_DIR = "data/recommender_result/als"
+EVALUATION_PATH = "data/recommender_result/als/evaluation.json"
+
+N_FACTORS = 64
+N_ITERATIONS = 15
+ALPHA = 10.0  # Confidence slope: c = 1 + alpha * (1 + rating / 10), so a 0 rating still counts as a read
+REGULARIZATION = 0.1
+CG_STEPS = 3  # Conjugate-gradient steps per half-iteration (warm-started from the previous factors)
+USER_BATCH = 20_000  # Rows solved per thread task
+
+def confidence_matrix(ratings: csr_matrix, alpha: float = ALPHA) -> csr_matrix:
+    """Confidence weights of every stored interaction, explicit 0 ratings included."""
+    confidence = ratings.copy().astype(np.float32)
+    confidence.data = 1 + alpha * (1 + confidence.data / 10)
+    return confidence
+
+def solve_direct(confidence: csr_matrix, fixed: np.ndarray, gram: np.ndarray, start: int, stop: int, out: np.ndarray) -> None:
+    """Exact least-squares solve of rows [start, stop): (Y^T Y + Y^T (C_u - I) Y + reg I) x_u = Y^T C_u 1."""
+    for row in range(start, stop):
+        begin, end = confidence.indptr[row], confidence.indptr[row + 1]
+        if begin == end:
+            out[row] = 0
+            continue
+        factors = fixed[confidence.indices[begin:end]]
+        weights = confidence.data[begin:end]
+        a = gram + (factors.T * (weights - 1)) @ factors
+        out[row] = np.linalg.solve(a, factors.T @ weights)
+
+def solve_cg(confidence: csr_matrix, fixed: np.ndarray, gram: np.ndarray, start: int, stop: int, out: np.ndarray,
+             steps: int = CG_STEPS) -> None:
+    """A few conjugate-gradient steps for rows [start, stop), vectorized across the rows.
+
+    A_u v only needs the rows' stored entries: v Y^T Y plus Y^T ((C_u - I) * (Y v)), so every step is
+    two sparse products over the block instead of one dense f x f solve per row.
+    """
+    block = confidence[start:stop]
+    rows = np.repeat(np.arange(stop - start), np.diff(block.indptr))
+    items = fixed[block.indices]
+    weights_minus_one = block.data - 1
+
+    def apply(vectors):
+        dots = np.einsum('nf,nf->n', vectors[rows], items)
+        return vectors @ gram + csr_matrix((weights_minus_one * dots, block.indices, block.indptr),
+                                           shape=block.shape) @ fixed
+
+    x = out[start:stop]
+    residual = block @ fixed - apply(x)
+    direction = residual.copy()
+    residual_norm = np.einsum('nf,nf->n', residual, residual)
+    for _ in range(steps):
+        applied = apply(direction)
+        curvature = np.einsum('nf,nf->n', direction, applied)
+        step = np.divide(residual_norm, curvature, out=np.zeros_like(residual_norm), where=curvature > 0)
+        x += step[:, None] * direction
+        residual -= step[:, None] * applied
+        new_norm = np.einsum('nf,nf->n', residual, residual)
+        ratio = np.divide(new_norm, residual_norm, out=np.zeros_like(new_norm), where=residual_norm > 0)
+        direction = residual + ratio[:, None] * direction
+        residual_norm = new_norm
+    out[start:stop] = x
+
+def half_step(confidence: csr_matrix, fixed: np.ndarray, solving: np.ndarray, regularization: float, solver: str,
+              n_jobs: int) -> None:
+    """Re-solves every row of `solving` with `fixed` held constant, in parallel row blocks."""
+    gram = fixed.T @ fixed + regularization * np.eye(fixed.shape[1], dtype=fixed.dtype)
+    solve = solve_cg if solver == 'cg' else solve_direct
+    n_rows = confidence.shape[0]
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(solve, confidence, fixed, gram, start, min(start + USER_BATCH, n_rows), solving)
+                   for start in range(0, n_rows, USER_BATCH)]
+        for future in futures:
+            future.result()
+
+def train_als(ratings: csr_matrix, n_factors: int = N_FACTORS, n_iterations: int = N_ITERATIONS, alpha: float = ALPHA,
+              regularization: float = REGULARIZATION, solver: str = 'cg', n_jobs: int = item_similarity.N_JOBS,
+              seed: int = 42):
+    """Confidence-weighted implicit ALS (Hu, Koren & Volinsky) over a user x item interaction matrix.
+
+    Every stored entry, including explicit 0 ratings, is a positive preference with confidence from
+    `confidence_matrix`; missing entries are preference 0 with confidence 1. Returns (user factors,
+    item factors), both float32.
+    """
+    try:
+        if solver not in ('cg', 'direct'):
+            raise ValueError(f"solver must be 'cg' or 'direct', got {solver!r}")
+        started = time.perf_counter()
+        confidence = confidence_matrix(ratings, alpha)
+        confidence_t = confidence.T.tocsr()
+        rng = np.random.default_rng(seed)
+        user_factors = (rng.standard_normal((ratings.shape[0], n_factors)) * 0.01).astype(np.float32)
+        item_factors = (rng.standard_normal((ratings.shape[1], n_factors)) * 0.01).astype(np.float32)
+        logger.info(f"Training implicit ALS ({solver}) with {n_factors} factors on {ratings.shape[0]} users x {ratings.shape[1]} books...")
+        for iteration in range(n_iterations):
+            half_step(confidence, item_factors, user_factors, regularization, solver, n_jobs)
+            half_step(confidence_t, user_factors, item_factors, regularization, solver, n_jobs)
+        logger.info(f"ALS trained in {time.perf_counter() - started:.2f}s.")
+        return user_factors, item_factors
+    except Exception as e:
+        logger.error(f"Error training ALS: {e}")
+        raise
+
+def holdout_split(ratings: csr_matrix, seed: int = 42):
+    """Leave-one-out split: one random interaction of every user with at least two goes to the test set."""
+    rng = np.random.default_rng(seed)
+    counts = np.diff(ratings.indptr)
+    users = np.flatnonzero(counts >= 2)
+    held = ratings.indptr[users] + (rng.random(len(users)) * counts[users]).astype(np.int64)
+    keep = np.ones(ratings.nnz, dtype=bool)
+    keep[held] = False
+    rows = np.repeat(np.arange(ratings.shape[0]), counts)
+    indptr = np.r_[0, np.cumsum(np.bincount(rows[keep], minlength=ratings.shape[0]))]
+    train = csr_matrix((ratings.data[keep], ratings.indices[keep], indptr), shape=ratings.shape)
+    return train, users, ratings.indices[held]
+
+def hit_rate(recommended: np.ndarray, users: np.ndarray, held_items: np.ndarray) -> float:
+    """Share of held-out items that appear in their user's recommendation list."""
+    return float(np.mean(np.any(recommended[users] == held_items[:, None], axis=1))) if len(users) else 0.0
+
+def cluster_baseline(train: csr_matrix, top_k: int, n_components: int = 100, n_clusters: int = 30) -> np.ndarray:
+    """Current engine on the same split: SVD + MiniBatchKMeans, every user gets their cluster's top mean-rated books."""
+    from src.recommender.collaborative_filtering_recommender import recommended_for_you
+    reduced, _ = recommended_for_you.perform_svd(train, min(n_components, min(train.shape) - 1))
+    clusters, _ = recommended_for_you.cluster_users(reduced, n_clusters)
+    coo = train.tocoo()
+    frame = pd.DataFrame({'cluster_id': clusters[coo.row], 'item': coo.col, 'rating': coo.data})
+    top = (frame.groupby(['cluster_id', 'item'])['rating'].mean().reset_index()
+           .sort_values(['cluster_id', 'rating'], ascending=[True, False]).groupby('cluster_id').head(top_k))
+    books = np.full((n_clusters, top_k), -1, dtype=np.int32)
+    for cluster_id, items in top.groupby('cluster_id')['item']:
+        books[cluster_id, :len(items)] = items.to_numpy()
+    return books[clusters]
+
+def evaluate(ratings: csr_matrix, top_k: int = 10, **als_params) -> dict:
+    """A/B on one leave-one-out split: hit rate@k and training time of ALS vs the SVD cluster engine."""
+    try:
+        train, users, held_items = holdout_split(ratings)
+        started = time.perf_counter()
+        user_factors, item_factors = train_als(train, **als_params)
+        als_items, _ = latent_scoring.score_users(user_factors, item_factors.T, train, top_k)
+        als_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        cluster_items = cluster_baseline(train, top_k)
+        cluster_seconds = time.perf_counter() - started
+        report = {
+            'top_k': top_k,
+            'test_users': int(len(users)),
+            f'als_hit_rate_at_{top_k}': hit_rate(als_items, users, held_items),
+            f'cluster_hit_rate_at_{top_k}': hit_rate(cluster_items, users, held_items),
+            'als_seconds': round(als_seconds, 3),
+            'cluster_seconds': round(cluster_seconds, 3),
+        }
+        logger.info(f"ALS evaluation: {report}")
+        return report
+    except Exception as e:
+        logger.error(f"Error evaluating ALS: {e}")
+        raise
+
+def save_results(user_codes: np.ndarray, book_codes: np.ndarray, items: np.ndarray, output_dir: str = OUTPUT_DIR) -> None:
+    """Writes the cluster-recommendation contract with one group per user.
+
+    `user_clusters.csv` maps every user to their own group id and `cluster_recommendation.parquet` lists
+    that group's ISBNs, so the combiner consumes ALS output exactly like the SVD cluster output.
+    """
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        user_ids = id_registry.decode(id_registry.load_registry('user'), user_codes)
+        isbn_registry = id_registry.load_registry('isbn')
+        group_ids = np.arange(len(user_codes))
+        pd.DataFrame({'user_id': user_ids, 'cluster_id': group_ids}).to_csv(
+            os.path.join(output_dir, "user_clusters.csv"), index=False)
+        list_artifacts.save_cluster_recommendations(
+            group_ids, [id_registry.decode(isbn_registry, book_codes[row[row >= 0]]) for row in items], output_dir)
+        logger.info(f"ALS recommendations saved in {output_dir}.")
+    except Exception as e:
+        logger.error(f"Error saving ALS recommendations: {e}")
+        raise
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Implicit-feedback ALS recommendations.")
+    parser.add_argument('--factors', type=int, default=N_FACTORS, help='Number of latent factors.')
+    parser.add_argument('--iterations', type=int, default=N_ITERATIONS, help='Number of ALS iterations.')
+    parser.add_argument('--alpha', type=float, default=ALPHA, help='Confidence slope.')
+    parser.add_argument('--regularization', type=float, default=REGULARIZATION, help='L2 regularization.')
+    parser.add_argument('--solver', choices=['cg', 'direct'], default='cg', help='Conjugate-gradient or exact per-row solves.')
+    parser.add_argument('--top_k', type=int, default=10, help='Books recommended per user.')
+    parser.add_argument('--evaluate', action='store_true', help='Also write a leave-one-out A/B report against the SVD cluster engine.')
+    return parser.parse_args()
+
+def main():
+    """Main executable for implicit ALS recommendations."""
+    args = parse_args()
+    try:
+        # Step 1: Load the interaction matrix with explicit 0 ratings kept as interactions
+        ratings, user_codes, book_codes = interaction_matrix.load_interaction_matrix(
+            RAW_PARQUET_PATH, MATRIX_CACHE_PATH, keep_zeros=True)
+        als_params = dict(n_factors=args.factors, n_iterations=args.iterations, alpha=args.alpha,
+                          regularization=args.regularization, solver=args.solver)
+
+        # Step 2: Train and score every user, excluding books they already read
+        user_factors, item_factors = train_als(ratings, **als_params)
+        items, scores = latent_scoring.score_users(user_factors, item_factors.T, ratings, args.top_k)
+
+        # Step 3: Save results in the cluster-recommendation contract and as per-user arrays
+        save_results(user_codes, book_codes, items)
+        latent_scoring.save_user_topk(user_codes, book_codes, items, scores, os.path.join(OUTPUT_DIR, "user_topk"))
+
+        # Step 4: Optional A/B quality report
+        if args.evaluate:
+            report = evaluate(ratings, args.top_k, **als_params)
+            with open(EVALUATION_PATH, 'w') as f:
+                json.dump(report, f, indent=2)
+    except Exception as e:
+        logger.error(f"An error occurred in the main process: {e}")
+        raise
+
+if __name__ == "__main__":
+    main()
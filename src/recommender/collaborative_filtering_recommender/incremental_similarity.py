@@ -0,0 +1,178 @@
+import os
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+from scipy.sparse import csr_matrix, diags  # type: ignore
+from config.logging_configs import logger  # Assuming your logging is set up
+from src.data_preprocessing import id_registry
+from src.recommender.collaborative_filtering_recommender import item_similarity
+
+# Define paths
+STATE_PATH = "data/recommender_result/similarity_state.npz"
+
+def build_state(user_item_matrix: csr_matrix, row_ids: np.ndarray, col_ids: np.ndarray, top_k: int = 10,
+                source_key: str = '') -> dict:
+    """Full build: the interaction matrix, its co-rating dot products G = X^T X and the top-k lists.
+
+    The diagonal of G holds the squared item norms, so G alone is enough to recompute any cosine.
+    `source_key` (an `interaction_matrix.cache_key`) records which raw_data the state was built from.
+    """
+    try:
+        logger.info("Building incremental similarity state...")
+        matrix = csr_matrix(user_item_matrix, dtype=np.float32)
+        gram = (matrix.T @ matrix).astype(np.float64).tocsr()
+        neighbours, scores = item_similarity.top_k_similar_items(matrix, top_k=top_k)
+        logger.info(f"State built: {gram.nnz} co-rated item pairs (including the diagonal).")
+        return {
+            'matrix': matrix, 'gram': gram,
+            'row_ids': np.asarray(row_ids, dtype=np.int32), 'col_ids': np.asarray(col_ids, dtype=np.int32),
+            'neighbours': neighbours, 'scores': scores, 'source_key': source_key,
+        }
+    except Exception as e:
+        logger.error(f"Error building similarity state: {e}")
+        raise
+
+def save_state(state: dict, path: str = STATE_PATH) -> None:
+    """Persists the state to one `.npz` file (sparse matrices as their CSR arrays)."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {}
+        for name in ('matrix', 'gram'):
+            sparse = state[name]
+            arrays.update({f"{name}_data": sparse.data, f"{name}_indices": sparse.indices,
+                           f"{name}_indptr": sparse.indptr, f"{name}_shape": np.array(sparse.shape)})
+        arrays.update({name: state[name] for name in ('row_ids', 'col_ids', 'neighbours', 'scores')})
+        arrays.update(source_key=np.str_(state.get('source_key', '')),
+                      registry_version=np.str_(id_registry.load_registry_version()))
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        logger.info(f"Similarity state saved to {path}.")
+    except Exception as e:
+        logger.error(f"Error saving similarity state: {e}")
+        raise
+
+def load_state(path: str = STATE_PATH) -> dict:
+    """Loads a state written by `save_state`; a state keyed by another registry's codes is rejected."""
+    try:
+        with np.load(path) as stored:
+            id_registry.check_registry_version(stored['registry_version'] if 'registry_version' in stored.files else None,
+                                               'Similarity state')
+            state = {
+                name: csr_matrix((stored[f"{name}_data"], stored[f"{name}_indices"], stored[f"{name}_indptr"]),
+                                 shape=tuple(stored[f"{name}_shape"]))
+                for name in ('matrix', 'gram')
+            }
+            state.update({name: stored[name] for name in ('row_ids', 'col_ids', 'neighbours', 'scores')})
+            state['source_key'] = str(stored['source_key']) if 'source_key' in stored.files else ''
+        return state
+    except Exception as e:
+        logger.error(f"Error loading similarity state: {e}")
+        raise
+
+def load_current_state(source_key: str, top_k: int, path: str = STATE_PATH):
+    """Loads the state when it is still current; returns None when it is missing, was built from another
+    raw_data or registry, or keeps another number of neighbours, so the caller rebuilds it."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as stored:
+        stamp = {name: str(stored[name]) if name in stored.files else None for name in ('source_key', 'registry_version')}
+        width = stored['neighbours'].shape[1]
+    if stamp['source_key'] != source_key or stamp['registry_version'] != id_registry.load_registry_version() or width != top_k:
+        logger.info(f"Similarity state at {path} is out of date with raw_data or the ID registry; rebuilding it.")
+        return None
+    return load_state(path)
+
+def read_deltas(path: str) -> pd.DataFrame:
+    """Reads a batch of new or changed ratings (user_id, isbn, book_rating) and encodes it with the registry.
+
+    Keys the registry does not know are dropped with a warning; they are picked up by the next full run.
+    """
+    deltas = pd.read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path, dtype={'isbn': str})
+    deltas['isbn'] = id_registry.canonicalize_isbn(deltas['isbn'])
+    deltas['user_code'] = id_registry.encode(id_registry.load_registry('user'), deltas['user_id'])
+    deltas['isbn_code'] = id_registry.encode(id_registry.load_registry('isbn'), deltas['isbn'])
+    known = (deltas['user_code'] >= 0) & (deltas['isbn_code'] >= 0)
+    if not known.all():
+        logger.warning(f"Skipping {int((~known).sum())} ratings with users or ISBNs unknown to the ID registry.")
+    # A later rating of the same (user, book) in the batch wins
+    return deltas[known].drop_duplicates(subset=['user_code', 'isbn_code'], keep='last')
+
+def extend_ids(ids: np.ndarray, codes: np.ndarray):
+    """Positions of `codes` in `ids`, appending codes that are not there yet."""
+    lookup = pd.Index(ids)
+    new_codes = pd.unique(codes[lookup.get_indexer(codes) < 0])
+    ids = np.concatenate([ids, new_codes.astype(np.int32)])
+    return ids, pd.Index(ids).get_indexer(codes), len(new_codes)
+
+def refresh_rows(gram: csr_matrix, items: np.ndarray, top_k: int, memory_budget: int = item_similarity.MEMORY_BUDGET_BYTES):
+    """Top-k cosine neighbours of `items`, recomputed from G: cos(i, j) = G[i, j] / (|i| |j|).
+
+    Rows are densified as float32 in blocks sized by `item_similarity.block_rows`, so a refresh
+    stays within the same memory budget as the full build.
+    """
+    norms = np.sqrt(np.maximum(gram.diagonal(), 0))
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    neighbours = np.full((len(items), top_k), -1, dtype=np.int32)
+    scores = np.zeros((len(items), top_k), dtype=np.float32)
+    block_size = item_similarity.block_rows(len(items), gram.shape[1], memory_budget, n_jobs=1)
+    for start in range(0, len(items), block_size):
+        rows = items[start:start + block_size]
+        block = (diags(inverse[rows]) @ gram[rows] @ diags(inverse)).astype(np.float32).toarray()
+        block[np.arange(len(rows)), rows] = -np.inf  # An item is never its own neighbour
+        block_neighbours, block_scores = item_similarity.top_k_rows(block, top_k)
+        neighbours[start:start + len(rows), :block_neighbours.shape[1]] = block_neighbours
+        scores[start:start + len(rows), :block_scores.shape[1]] = block_scores
+    return neighbours, scores
+
+def apply_deltas(state: dict, deltas: pd.DataFrame) -> np.ndarray:
+    """Applies a batch of rating deltas in place and returns the items whose top-k list was refreshed.
+
+    G changes only through the rows of users in the batch: G += X'_U^T X'_U - X_U^T X_U. An item's
+    neighbourhood can only change if its own co-rating row changed or if the norm of an item it is
+    co-rated with changed, so only those items are re-ranked.
+    """
+    try:
+        matrix, gram = state['matrix'], state['gram']
+        top_k = state['neighbours'].shape[1]
+        state['row_ids'], rows, new_users = extend_ids(state['row_ids'], deltas['user_code'].to_numpy())
+        state['col_ids'], cols, new_items = extend_ids(state['col_ids'], deltas['isbn_code'].to_numpy())
+        n_users, n_items = len(state['row_ids']), len(state['col_ids'])
+        logger.info(f"Applying {len(deltas)} rating deltas ({new_users} new users, {new_items} new books)...")
+
+        # Grow the matrix, G and the top-k arrays for new users and items
+        matrix.resize((n_users, n_items))
+        gram.resize((n_items, n_items))
+        state['neighbours'] = np.vstack([state['neighbours'], np.full((new_items, top_k), -1, dtype=np.int32)])
+        state['scores'] = np.vstack([state['scores'], np.zeros((new_items, top_k), dtype=np.float32)])
+
+        # Old and new rows of the users touched by the batch
+        users = np.unique(rows)
+        old_rows = matrix[users]
+        changes = csr_matrix((deltas['book_rating'].to_numpy(dtype=np.float32), (np.searchsorted(users, rows), cols)),
+                             shape=old_rows.shape)
+        touched = csr_matrix((np.ones(len(rows), dtype=np.float32), (np.searchsorted(users, rows), cols)), shape=old_rows.shape)
+        new_rows = (old_rows - old_rows.multiply(touched) + changes).tocsr()
+        new_rows.eliminate_zeros()
+
+        # Patch the matrix rows and G
+        keep = np.ones(n_users, dtype=bool)
+        keep[users] = False
+        patch = csr_matrix((np.ones(len(users), dtype=np.float32), (users, np.arange(len(users)))), shape=(n_users, len(users)))
+        matrix = (diags(keep.astype(np.float32)) @ matrix + patch @ new_rows).tocsr()
+        delta_gram = (new_rows.T @ new_rows).astype(np.float64) - (old_rows.T @ old_rows).astype(np.float64)
+        gram = (gram + delta_gram).tocsr()
+        gram.eliminate_zeros()
+
+        # Refresh every item whose cosine row could have changed
+        changed = np.unique(delta_gram.tocoo().row)
+        norm_changed = np.unique(cols)
+        co_rated = np.unique(gram[norm_changed].indices)
+        affected = np.union1d(np.union1d(changed, norm_changed), co_rated).astype(np.int64)
+        state['neighbours'][affected], state['scores'][affected] = refresh_rows(gram, affected, top_k)
+
+        state['matrix'], state['gram'] = matrix, gram
+        logger.info(f"Refreshed top-{top_k} lists of {len(affected)} of {n_items} books.")
+        return affected
+    except Exception as e:
+        logger.error(f"Error applying rating deltas: {e}")
+        raise
@@ -0,0 +1,104 @@
+import os
+import glob
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+from scipy.sparse import coo_matrix, csr_matrix  # type: ignore
+from config.logging_configs import logger  # Assuming your logging is set up
+
+# Define paths
+RAW_PARQUET_PATH = "data/preprocessed_files/raw_data.parquet"
+MATRIX_CACHE_PATH = "data/recommender_result/user_book_matrix.npz"
+IMPLICIT_MATRIX_CACHE_PATH = "data/recommender_result/user_book_matrix_implicit.npz"  # Keeps explicit 0 ratings
+
+AGGREGATIONS = ('mean', 'sum', 'max')
+
+def build_interaction_matrix(user_codes: np.ndarray, item_codes: np.ndarray, ratings: np.ndarray,
+                             dtype=np.float32, aggregate: str = 'mean', keep_zeros: bool = False):
+    """Builds the user x item CSR matrix straight from code arrays.
+
+    Rows and columns are the distinct user and item codes in ascending order (the same labels
+    `pivot_table` would produce); `row_ids` / `col_ids` map them back to codes. Duplicate
+    (user, item) ratings are combined with `aggregate`. With `keep_zeros` explicit 0 ratings stay
+    stored entries instead of being indistinguishable from missing ones.
+    """
+    if aggregate not in AGGREGATIONS:
+        raise ValueError(f"aggregate must be one of {AGGREGATIONS}, got {aggregate!r}")
+
+    ratings = np.asarray(ratings, dtype=np.float64)
+    present = ~np.isnan(ratings)
+    row_ids, rows = np.unique(np.asarray(user_codes)[present], return_inverse=True)
+    col_ids, cols = np.unique(np.asarray(item_codes)[present], return_inverse=True)
+    ratings = ratings[present]
+    shape = (len(row_ids), len(col_ids))
+
+    # Sort once by (row, col) so duplicates are adjacent and the CSR arrays come out canonical
+    order = np.lexsort((cols, rows))
+    rows, cols, ratings = rows[order], cols[order], ratings[order]
+    starts = np.flatnonzero(np.r_[len(ratings) > 0, (np.diff(rows) != 0) | (np.diff(cols) != 0)])
+    if aggregate == 'max':
+        values = np.maximum.reduceat(ratings, starts) if len(ratings) else ratings
+    else:
+        values = np.add.reduceat(ratings, starts) if len(ratings) else ratings
+        if aggregate == 'mean':
+            values = values / np.diff(np.r_[starts, len(ratings)])
+
+    matrix = coo_matrix((values.astype(dtype), (rows[starts], cols[starts])), shape=shape).tocsr()
+    if not keep_zeros:
+        matrix.eliminate_zeros()
+    return matrix, row_ids.astype(np.int32), col_ids.astype(np.int32)
+
+def source_signature(source_path: str) -> str:
+    """Size and modification time of the raw data file (or every file of a partitioned dataset)."""
+    paths = sorted(glob.glob(os.path.join(source_path, '*.parquet'))) if os.path.isdir(source_path) else [source_path]
+    return ';'.join(f"{os.path.basename(p)}:{os.path.getsize(p)}:{os.stat(p).st_mtime_ns}" for p in paths)
+
+def cache_key(source_path: str, dtype, aggregate: str, keep_zeros: bool) -> str:
+    """Identifies a cached matrix: the source data plus every build parameter."""
+    return f"{source_signature(source_path)}|{np.dtype(dtype).name}|{aggregate}|{keep_zeros}"
+
+def save_interaction_matrix(matrix: csr_matrix, row_ids: np.ndarray, col_ids: np.ndarray, key: str,
+                            cache_path: str = MATRIX_CACHE_PATH) -> None:
+    """Saves the CSR arrays and index maps to one `.npz` file."""
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + '.tmp.npz'
+        np.savez(tmp_path, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                 shape=np.array(matrix.shape), row_ids=row_ids, col_ids=col_ids, key=np.array(key))
+        os.replace(tmp_path, cache_path)
+        logger.info(f"Interaction matrix cached to {cache_path}.")
+    except Exception as e:
+        logger.error(f"Error caching interaction matrix: {e}")
+        raise
+
+def load_cached_matrix(cache_path: str = MATRIX_CACHE_PATH, key: str = None):
+    """Loads a cached matrix; returns None when it is missing or was built from different inputs."""
+    if not os.path.exists(cache_path):
+        return None
+    with np.load(cache_path) as cached:
+        if key is not None and str(cached['key']) != key:
+            return None
+        matrix = csr_matrix((cached['data'], cached['indices'], cached['indptr']), shape=tuple(cached['shape']))
+        return matrix, cached['row_ids'], cached['col_ids']
+
+def load_interaction_matrix(source_path: str = RAW_PARQUET_PATH, cache_path: str = MATRIX_CACHE_PATH,
+                            dtype=np.float32, aggregate: str = 'mean', keep_zeros: bool = False):
+    """Returns (matrix, row user codes, column isbn codes), reusing the on-disk cache when it is current."""
+    try:
+        key = cache_key(source_path, dtype, aggregate, keep_zeros)
+        cached = load_cached_matrix(cache_path, key)
+        if cached is not None:
+            logger.info(f"Loaded cached interaction matrix from {cache_path}.")
+            return cached
+
+        logger.info(f"Building interaction matrix from {source_path}...")
+        ratings = pd.read_parquet(source_path, columns=['user_code', 'isbn_code', 'book_rating'])
+        matrix, row_ids, col_ids = build_interaction_matrix(
+            ratings['user_code'].to_numpy(), ratings['isbn_code'].to_numpy(), ratings['book_rating'].to_numpy(),
+            dtype=dtype, aggregate=aggregate, keep_zeros=keep_zeros,
+        )
+        logger.info(f"Interaction matrix built: {matrix.shape[0]} users x {matrix.shape[1]} books, {matrix.nnz} entries.")
+        save_interaction_matrix(matrix, row_ids, col_ids, key, cache_path)
+        return matrix, row_ids, col_ids
+    except Exception as e:
+        logger.error(f"Error loading interaction matrix: {e}")
+        raise
@@ -0,0 +1,84 @@
+import os
+import numpy as np  # type: ignore
+from concurrent.futures import ThreadPoolExecutor
+from scipy.sparse import csr_matrix, diags  # type: ignore
+from config.logging_configs import logger  # Assuming your logging is set up
+
+MEMORY_BUDGET_BYTES = 512 * 1024 * 1024  # Dense similarity blocks alive at once, across all workers
+N_JOBS = os.cpu_count() or 1
+
+# Peak bytes per dense block element in `top_k_rows`: the float32 block, its negated float32 copy
+# and the int64 `argpartition` indices
+BLOCK_BYTES_PER_ELEMENT = 16
+
+def block_rows(n_rows: int, n_columns: int, memory_budget: int = MEMORY_BUDGET_BYTES, n_jobs: int = N_JOBS) -> int:
+    """Rows per dense block so that `n_jobs` blocks of `n_columns` and their top-k temporaries fit in `memory_budget`."""
+    return max(1, min(n_rows, memory_budget // (BLOCK_BYTES_PER_ELEMENT * max(n_columns, 1) * max(n_jobs, 1))))
+
+def normalize_columns(matrix: csr_matrix) -> csr_matrix:
+    """Scales every column (item) to unit L2 norm; all-zero columns stay zero."""
+    matrix = csr_matrix(matrix, dtype=np.float32)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return (matrix @ diags(inverse.astype(np.float32))).tocsr()
+
+def top_k_rows(block: np.ndarray, top_k: int, positive_only: bool = True):
+    """Top-k columns of every row of a dense block, sorted by descending score.
+
+    Uses `argpartition`, so each row costs O(n) instead of a full O(n log n) sort. Entries
+    with a non-positive score are returned as neighbour -1; with `positive_only=False` (latent
+    dot products, which can be negative) only masked -inf entries are.
+    """
+    k = min(top_k, block.shape[1])
+    if k == 0:
+        return np.full((block.shape[0], 0), -1, dtype=np.int32), np.zeros((block.shape[0], 0), dtype=np.float32)
+    candidates = np.argpartition(-block, k - 1, axis=1)[:, :k]
+    candidate_scores = np.take_along_axis(block, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+    neighbours = np.take_along_axis(candidates, order, axis=1).astype(np.int32)
+    scores = np.take_along_axis(candidate_scores, order, axis=1).astype(np.float32)
+    neighbours[~(scores > (0 if positive_only else -np.inf))] = -1
+    scores[neighbours < 0] = 0
+    return neighbours, scores
+
+def similarity_block(items: csr_matrix, normalized: csr_matrix, start: int, stop: int, top_k: int):
+    """Cosine top-k for items [start, stop): one sparse x sparse product, densified only for this block."""
+    block = (items[start:stop] @ normalized).toarray()
+    block[np.arange(stop - start), np.arange(start, stop)] = -np.inf  # An item is never its own neighbour
+    return top_k_rows(block, top_k)
+
+def top_k_similar_items(user_item_matrix: csr_matrix, top_k: int = 10, memory_budget: int = MEMORY_BUDGET_BYTES,
+                        n_jobs: int = N_JOBS):
+    """Exact item-item cosine top-k without materializing the n_items x n_items matrix.
+
+    Items are processed in blocks sized so that `n_jobs` dense float32 blocks, with their
+    partition temporaries, fit in `memory_budget`; blocks run in a thread pool (the sparse product, densification and
+    partition all run outside the GIL). Returns (neighbours, scores), both n_items x top_k,
+    with -1 / 0 padding for items that have fewer than top_k positively similar items.
+    """
+    try:
+        n_items = user_item_matrix.shape[1]
+        normalized = normalize_columns(user_item_matrix)
+        items = normalized.T.tocsr()
+        block_size = block_rows(n_items, n_items, memory_budget, n_jobs)
+        starts = list(range(0, n_items, block_size))
+        logger.info(f"Computing top-{top_k} similar items for {n_items} items in {len(starts)} blocks of {block_size} with {n_jobs} workers...")
+
+        neighbours = np.full((n_items, top_k), -1, dtype=np.int32)
+        scores = np.zeros((n_items, top_k), dtype=np.float32)
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            futures = {
+                executor.submit(similarity_block, items, normalized, start, min(start + block_size, n_items), top_k): start
+                for start in starts
+            }
+            for future, start in futures.items():
+                block_neighbours, block_scores = future.result()
+                stop = start + len(block_neighbours)
+                neighbours[start:stop, :block_neighbours.shape[1]] = block_neighbours
+                scores[start:stop, :block_scores.shape[1]] = block_scores
+
+        logger.info("Item similarity computation completed.")
+        return neighbours, scores
+    except Exception as e:
+        logger.error(f"Error computing item similarities: {e}")
+        raise
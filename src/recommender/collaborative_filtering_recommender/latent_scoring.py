@@ -0,0 +1,98 @@
+import os
+import time
+import shutil
+import numpy as np  # type: ignore
+from concurrent.futures import ThreadPoolExecutor
+from scipy.sparse import csr_matrix  # type: ignore
+from config.logging_configs import logger  # Assuming your logging is set up
+from src.recommender.collaborative_filtering_recommender import item_similarity
+
+# Define paths
+USER_TOPK_DIR = "data/recommender_result/user_topk"
+
+def mask_seen(scores: np.ndarray, seen: csr_matrix, start: int, stop: int) -> None:
+    """Sets the scores of items each user in [start, stop) already rated to -inf, in place."""
+    indptr = seen.indptr[start:stop + 1]
+    rows = np.repeat(np.arange(stop - start), np.diff(indptr))
+    scores[rows, seen.indices[indptr[0]:indptr[-1]]] = -np.inf
+
+def score_batch(user_factors: np.ndarray, item_factors: np.ndarray, seen: csr_matrix, start: int, stop: int, top_k: int):
+    """Top-k unseen items for users [start, stop): one BLAS matrix product, a mask and a partition."""
+    scores = user_factors[start:stop] @ item_factors
+    mask_seen(scores, seen, start, stop)
+    return item_similarity.top_k_rows(scores, top_k, positive_only=False)
+
+def score_users(user_factors: np.ndarray, item_factors: np.ndarray, seen: csr_matrix, top_k: int = 10,
+                memory_budget: int = item_similarity.MEMORY_BUDGET_BYTES, n_jobs: int = item_similarity.N_JOBS):
+    """Per-user top-k of user_factors . item_factors, excluding already-rated items.
+
+    `user_factors` is n_users x d (the SVD user coordinates), `item_factors` d x n_items (the SVD
+    components) and `seen` the n_users x n_items interaction matrix. Users are scored in batches sized
+    so that `n_jobs` dense float32 score blocks, with their partition temporaries, fit in `memory_budget`; batches run in a thread pool
+    (BLAS and the partition release the GIL). Returns (item columns, scores), -1 / 0 padded.
+    """
+    try:
+        n_users, n_items = user_factors.shape[0], item_factors.shape[1]
+        user_factors = np.ascontiguousarray(user_factors, dtype=np.float32)
+        item_factors = np.ascontiguousarray(item_factors, dtype=np.float32)
+        seen = csr_matrix(seen)
+        batch_size = item_similarity.block_rows(n_users, n_items, memory_budget, n_jobs)
+        starts = list(range(0, n_users, batch_size))
+        logger.info(f"Scoring {n_users} users against {n_items} books in {len(starts)} batches of {batch_size} with {n_jobs} workers...")
+
+        started = time.perf_counter()
+        items = np.full((n_users, top_k), -1, dtype=np.int32)
+        scores = np.zeros((n_users, top_k), dtype=np.float32)
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            futures = {
+                executor.submit(score_batch, user_factors, item_factors, seen, start, min(start + batch_size, n_users), top_k): start
+                for start in starts
+            }
+            for future, start in futures.items():
+                batch_items, batch_scores = future.result()
+                stop = start + len(batch_items)
+                items[start:stop, :batch_items.shape[1]] = batch_items
+                scores[start:stop, :batch_scores.shape[1]] = batch_scores
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"Scored {n_users} users in {elapsed:.2f}s ({n_users / max(elapsed, 1e-9):,.0f} users/sec).")
+        return items, scores
+    except Exception as e:
+        logger.error(f"Error scoring users: {e}")
+        raise
+
+def save_user_topk(user_codes: np.ndarray, book_codes: np.ndarray, items: np.ndarray, scores: np.ndarray,
+                   output_dir: str = USER_TOPK_DIR) -> None:
+    """Writes sorted user codes and fixed-width (n_users x k) ISBN code / float16 score arrays as `.npy`.
+
+    Item columns are translated to ISBN registry codes; padding stays -1.
+    """
+    try:
+        order = np.argsort(user_codes, kind='stable')
+        isbn_codes = np.where(items >= 0, np.asarray(book_codes)[np.maximum(items, 0)], -1).astype(np.int32)
+        tmp_dir = output_dir.rstrip('/') + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, 'user_codes.npy'), np.asarray(user_codes, dtype=np.int32)[order])
+        np.save(os.path.join(tmp_dir, 'isbn_codes.npy'), isbn_codes[order])
+        np.save(os.path.join(tmp_dir, 'scores.npy'), scores[order].astype(np.float16))
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.replace(tmp_dir, output_dir)
+        logger.info(f"Per-user top-{items.shape[1]} saved to {output_dir}.")
+    except Exception as e:
+        logger.error(f"Error saving per-user top-k: {e}")
+        raise
+
+def load_user_topk(output_dir: str = USER_TOPK_DIR) -> dict:
+    """Memory-maps the per-user arrays read-only."""
+    return {name: np.load(os.path.join(output_dir, f"{name}.npy"), mmap_mode='r')
+            for name in ('user_codes', 'isbn_codes', 'scores')}
+
+def recommendations_for(topk: dict, user_code: int):
+    """(ISBN codes, scores) of one user, best first; empty for users that were not scored."""
+    position = np.searchsorted(topk['user_codes'], user_code)
+    if position >= len(topk['user_codes']) or topk['user_codes'][position] != user_code:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+    codes = np.asarray(topk['isbn_codes'][position])
+    keep = codes >= 0
+    return codes[keep], np.asarray(topk['scores'][position], dtype=np.float32)[keep]
@@ -0,0 +1,90 @@
+import os
+import json
+import shutil
+import numpy as np  # type: ignore
+from config.logging_configs import logger  # Assuming your logging is set up
+from src.data_preprocessing import id_registry
+
+# Define paths
+NEIGHBOUR_INDEX_DIR = "data/recommender_result/neighbour_index"
+
+SCORE_DTYPES = ('float16', 'float32')
+
+def build_neighbour_index(book_codes: np.ndarray, neighbours: np.ndarray, scores: np.ndarray, n_codes: int,
+                          score_dtype: str = 'float16') -> dict:
+    """Row-offset (CSR-like) neighbour layout keyed by ISBN registry code.
+
+    `neighbours` holds matrix column positions with -1 padding; they are translated to ISBN codes
+    through `book_codes`. Row `c` spans `indptr[c]:indptr[c + 1]`, so books without neighbours (or
+    outside the matrix) cost one offset and nothing else.
+    """
+    if score_dtype not in SCORE_DTYPES:
+        raise ValueError(f"score_dtype must be one of {SCORE_DTYPES}, got {score_dtype!r}")
+
+    valid = neighbours >= 0
+    counts = np.zeros(n_codes, dtype=np.int64)
+    counts[book_codes] = valid.sum(axis=1)
+    indptr = np.zeros(n_codes + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    # Rows are written in code order; each row keeps its neighbours in descending score order
+    order = np.argsort(book_codes, kind='stable')
+    row_valid = valid[order]
+    return {
+        'indptr': indptr,
+        'neighbours': book_codes[neighbours[order][row_valid]].astype(np.int32),
+        'scores': scores[order][row_valid].astype(score_dtype),
+    }
+
+def save_neighbour_index(index: dict, index_dir: str = NEIGHBOUR_INDEX_DIR) -> None:
+    """Writes one `.npy` file per array plus a small JSON header; swaps the directory in atomically."""
+    try:
+        tmp_dir = index_dir.rstrip('/') + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, array in index.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({
+                'n_rows': int(len(index['indptr']) - 1),
+                'n_neighbours': int(len(index['neighbours'])),
+                'score_dtype': index['scores'].dtype.name,
+                'registry_version': id_registry.load_registry_version(),
+            }, f, indent=2)
+        shutil.rmtree(index_dir, ignore_errors=True)
+        os.replace(tmp_dir, index_dir)
+        size = sum(os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir))
+        logger.info(f"Neighbour index saved to {index_dir} ({size / 1024:.1f} KiB).")
+    except Exception as e:
+        logger.error(f"Error saving neighbour index: {e}")
+        raise
+
+def load_neighbour_index(index_dir: str = NEIGHBOUR_INDEX_DIR) -> dict:
+    """Memory-maps the index read-only: no parsing, and every process shares the same pages.
+
+    Raises when the index is keyed by another registry's ISBN codes than the current one.
+    """
+    try:
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            id_registry.check_registry_version(json.load(f).get('registry_version'), 'Neighbour index')
+        return {
+            name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode='r')
+            for name in ('indptr', 'neighbours', 'scores')
+        }
+    except Exception as e:
+        logger.error(f"Error loading neighbour index: {e}")
+        raise
+
+def neighbours_of(index: dict, code: int, top_k: int = None, min_score: float = None):
+    """(neighbour codes, scores) of one ISBN code, best first; empty for unknown codes."""
+    if code < 0 or code + 1 >= len(index['indptr']):
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+    start, stop = index['indptr'][code], index['indptr'][code + 1]
+    if top_k is not None:
+        stop = min(stop, start + top_k)
+    codes = np.asarray(index['neighbours'][start:stop])
+    scores = np.asarray(index['scores'][start:stop], dtype=np.float32)
+    if min_score is not None:
+        keep = scores >= min_score
+        codes, scores = codes[keep], scores[keep]
+    return codes, scores
@@ -1,8 +1,13 @@
 import os
+import time
+import argparse
+import numpy as np  # type: ignore
 import pandas as pd  # type: ignore
 from scipy.sparse import csr_matrix # type: ignore
-from sklearn.metrics.pairwise import cosine_similarity # type: ignore
 import logging
+from src.data_preprocessing import id_registry
+from src.recommender.collaborative_filtering_recommender import interaction_matrix, item_similarity, ann_index, neighbour_index, incremental_similarity
+from src.recommender import seen_items
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
@@ -12,51 +17,71 @@ logger = logging.getLogger(__name__)
 RAW_PARQUET_PATH = "data/preprocessed_files/raw_data.parquet"
 OUTPUT_FILE = "data/recommender_result/book_similarities.csv"
 
+TOP_N = seen_items.fetch_size(10)  # Neighbours kept per book, so the shelf stays full after seen-item filtering
+
 # Ensure output directory exists
 os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
 
-def read_raw_data(file_path: str) -> pd.DataFrame:
-    """Reads the raw Parquet file."""
-    try:
-        logger.info(f"Reading raw data from {file_path}...")
-        return pd.read_parquet(file_path)
-    except Exception as e:
-        logger.error(f"Error reading Parquet file: {e}")
-        raise
+def compute_book_similarities(sparse_matrix: csr_matrix, top_n: int = TOP_N, args=None):
+    """Computes the top N similar books of every book, as (neighbour column positions, scores).
 
-def process_user_book_matrix(raw_data: pd.DataFrame) -> csr_matrix:
-    """Processes the user-item matrix and converts it to a sparse format."""
+    Uses the exact blocked engine, or the approximate k-NN graph index when `args.similarity_mode` is 'ann'.
+    """
     try:
-        logger.info("Creating the user-item matrix...")
-        user_book_matrix = raw_data.pivot_table(index='user_id', columns='isbn', values='book_rating').fillna(0)
-        logger.info("Converting the user-item matrix to sparse format...")
-        return csr_matrix(user_book_matrix.values), user_book_matrix.columns
+        if args is not None and args.similarity_mode == 'ann':
+            logger.info("Computing top N similar books with the approximate k-NN graph index...")
+            vectors = ann_index.item_vectors(sparse_matrix, args.ann_vectors)
+            index = ann_index.build_ann_index(vectors, n_tables=args.ann_tables, n_bits=args.ann_bits)
+            started = time.perf_counter()
+            neighbours, scores = ann_index.ann_top_k(index, top_n, args.ann_window, args.ann_iterations, args.ann_walks)
+            ann_seconds = time.perf_counter() - started
+            index.update(neighbours=neighbours, scores=scores)
+            if args.recall_sample > 0:
+                report = ann_index.recall_report(sparse_matrix, neighbours, top_n, args.recall_sample)
+                report.update(ann_seconds_all_items=round(ann_seconds, 3), vectors=args.ann_vectors, n_tables=args.ann_tables,
+                              n_bits=args.ann_bits, window=args.ann_window, n_iterations=args.ann_iterations,
+                              n_walks=args.ann_walks)
+                ann_index.save_recall_report(report)
+            ann_index.save_ann_index(index)
+        else:
+            logger.info("Computing top N similar books with the blocked similarity engine...")
+            neighbours, scores = item_similarity.top_k_similar_items(sparse_matrix, top_k=top_n)
+        return neighbours, scores
     except Exception as e:
-        logger.error(f"Error processing user-item matrix: {e}")
+        logger.error(f"Error computing book similarities: {e}")
         raise
 
-def compute_book_similarities(sparse_matrix: csr_matrix, book_ids: pd.Index, top_n: int = 10) -> pd.DataFrame:
-    """Computes book-to-book similarities and generates top N recommendations for each book."""
+def update_book_similarities(deltas_path: str = None, top_n: int = TOP_N):
+    """Incremental mode: applies a batch of rating deltas to the persisted co-rating state.
+
+    The state is rebuilt with one full pass when it does not exist yet, or when raw_data or the ID
+    registry changed since it was built (a re-preprocess shifts codes). Returns (neighbour column
+    positions, scores, column ISBN codes).
+    """
     try:
-        logger.info("Computing cosine similarity between books...")
-        book_similarities = cosine_similarity(sparse_matrix.T)  # Transpose to calculate book similarity
-        logger.info("Generating top N similar books for each book...")
-
-        # Create a mapping of ISBN to similar books
-        similar_books = []
-        for i, isbn in enumerate(book_ids):
-            # Get top N similar books (excluding itself)
-            sim_scores = book_similarities[i]
-            top_books = book_ids[sim_scores.argsort()[::-1][1:top_n + 1]].tolist()
-            similar_books.append({"isbn": isbn, "similar_books": ",".join(top_books)})
-
-        return pd.DataFrame(similar_books)
+        source_key = interaction_matrix.cache_key(RAW_PARQUET_PATH, np.float32, 'mean', False)
+        state = incremental_similarity.load_current_state(source_key, top_n)
+        if state is None:
+            user_book_sparse, user_codes, book_codes = interaction_matrix.load_interaction_matrix(RAW_PARQUET_PATH)
+            state = incremental_similarity.build_state(user_book_sparse, user_codes, book_codes, top_n, source_key)
+        if deltas_path:
+            incremental_similarity.apply_deltas(state, incremental_similarity.read_deltas(deltas_path))
+        incremental_similarity.save_state(state)
+        return state['neighbours'], state['scores'], state['col_ids']
     except Exception as e:
-        logger.error(f"Error computing book similarities: {e}")
+        logger.error(f"Error updating book similarities: {e}")
         raise
 
+def similar_books_frame(neighbours, book_ids: pd.Index) -> pd.DataFrame:
+    """Legacy layout: one row per ISBN with its similar ISBNs comma-joined."""
+    similar_books = [
+        {"isbn": isbn, "similar_books": ",".join(book_ids[row[row >= 0]])}
+        for isbn, row in zip(book_ids, neighbours)
+    ]
+    return pd.DataFrame(similar_books)
+
 def save_results(similar_books: pd.DataFrame, output_file: str) -> None:
-    """Saves the book similarity results to a CSV file."""
+    """Saves the book similarity results to a CSV file (legacy format)."""
     try:
         logger.info("Saving book similarity results to CSV...")
         similar_books.to_csv(output_file, index=False)
@@ -65,20 +90,67 @@ def save_results(similar_books: pd.DataFrame, output_file: str) -> None:
         logger.error(f"Error saving results: {e}")
         raise
 
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Compute book-to-book recommendations.")
+    parser.add_argument(
+        '--similarity_mode', choices=['exact', 'ann'], default='exact', help='Exact blocked cosine or approximate graph-index neighbours.'
+    )
+    parser.add_argument(
+        '--ann_vectors', choices=['interactions', 'svd'], default='interactions', help='Item vectors indexed in ANN mode.'
+    )
+    parser.add_argument(
+        '--ann_tables', type=int, default=ann_index.N_TABLES, help='Number of LSH hash tables (higher: better recall, slower).'
+    )
+    parser.add_argument(
+        '--ann_bits', type=int, default=ann_index.N_BITS, help='Bits per LSH key (higher: smaller buckets, faster, lower recall).'
+    )
+    parser.add_argument(
+        '--ann_window', type=int, default=ann_index.WINDOW, help='Same-bucket neighbours probed on each side per table.'
+    )
+    parser.add_argument(
+        '--ann_iterations', type=int, default=ann_index.N_ITERATIONS, help='NN-descent refinement passes (higher: better recall, slower).'
+    )
+    parser.add_argument(
+        '--ann_walks', type=int, default=ann_index.N_WALKS, help='Two-hop co-rating walks per item seeding the graph (interaction vectors).'
+    )
+    parser.add_argument(
+        '--incremental', action='store_true', help='Keep co-rating dot products on disk and update them from rating deltas.'
+    )
+    parser.add_argument(
+        '--deltas', type=str, default=None, help='CSV/Parquet of new or changed ratings (user_id, isbn, book_rating) for --incremental.'
+    )
+    parser.add_argument(
+        '--score_dtype', choices=neighbour_index.SCORE_DTYPES, default='float16', help='Precision of scores stored in the neighbour index.'
+    )
+    parser.add_argument(
+        '--legacy_csv', action='store_true', help=f'Also write the comma-joined {OUTPUT_FILE}.'
+    )
+    parser.add_argument(
+        '--recall_sample', type=int, default=1000, help='Items sampled for the ANN recall@k report (0 disables it).'
+    )
+    return parser.parse_args()
+
 def main():
     """Main executable for book-to-book recommendations."""
+    args = parse_args()
     try:
-        # Step 1: Read raw data
-        raw_data = read_raw_data(RAW_PARQUET_PATH)
-
-        # Step 2: Process user-book matrix
-        user_book_sparse, book_ids = process_user_book_matrix(raw_data)
+        # Step 1-2: Compute book similarities, from scratch or by updating the persisted state
+        if args.incremental:
+            neighbours, scores, book_codes = update_book_similarities(args.deltas)
+        else:
+            user_book_sparse, _, book_codes = interaction_matrix.load_interaction_matrix(RAW_PARQUET_PATH)
+            neighbours, scores = compute_book_similarities(user_book_sparse, args=args)
 
-        # Step 3: Compute book similarities
-        similar_books = compute_book_similarities(user_book_sparse, book_ids)
+        # Step 3: Save the memory-mappable neighbour index, keyed by ISBN registry code
+        isbn_index = id_registry.load_registry('isbn')
+        index = neighbour_index.build_neighbour_index(book_codes, neighbours, scores, len(isbn_index), args.score_dtype)
+        neighbour_index.save_neighbour_index(index)
 
-        # Step 4: Save results
-        save_results(similar_books, OUTPUT_FILE)
+        # Step 4: Optionally keep writing the legacy CSV
+        if args.legacy_csv:
+            book_ids = pd.Index(id_registry.decode(isbn_index, book_codes))
+            save_results(similar_books_frame(neighbours, book_ids), OUTPUT_FILE)
 
     except Exception as e:
         logger.error(f"An error occurred in the main process: {e}")
@@ -1,85 +1,124 @@
 import os
+import argparse
+import numpy as np  # type: ignore
 import pandas as pd  # type: ignore
 from scipy.sparse import csr_matrix  # type: ignore
 from sklearn.decomposition import TruncatedSVD  # type: ignore
 from sklearn.cluster import MiniBatchKMeans  # type: ignore
 import logging
 from config.logging_configs import logger  # Assuming your logging is set up
+from src.data_preprocessing import id_registry
+from src.recommender.collaborative_filtering_recommender import interaction_matrix, user_model, streaming_clustering, latent_scoring, item_similarity
+from src.recommender import list_artifacts, seen_items
 
 # Define paths
 RAW_PARQUET_PATH = "data/preprocessed_files/raw_data.parquet"
 OUTPUT_DIR = "data/recommender_result"
 
+TOP_N = seen_items.fetch_size(10)  # Books saved per cluster, so shelves stay full after seen-item filtering
+MIN_SUPPORT = 3  # Centroid scoring: minimum ratings a book needs inside a cluster to be recommended
+
 # Ensure output directory exists
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 def read_raw_data(file_path: str) -> pd.DataFrame:
-    """Reads the raw Parquet file."""
+    """Reads the encoded rating columns of the raw Parquet file."""
     try:
         logger.info(f"Reading raw data from {file_path}...")
-        return pd.read_parquet(file_path)
+        return pd.read_parquet(file_path, columns=['user_code', 'isbn_code', 'book_rating'])
     except Exception as e:
         logger.error(f"Error reading Parquet file: {e}")
         raise
 
-def process_user_book_matrix(raw_data: pd.DataFrame) -> csr_matrix:
-    """Processes the user-item matrix and converts it to a sparse format."""
-    try:
-        logger.info("Creating the user-item matrix...")
-        raw_data = raw_data[['user_id', 'isbn', 'book_rating', 'location', 'age_group']]
-        user_book_matrix = raw_data.pivot_table(index='user_id', columns='isbn', values='book_rating').fillna(0)
-        logger.info("Converting the user-item matrix to sparse format...")
-        return csr_matrix(user_book_matrix.values), user_book_matrix.index
-    except Exception as e:
-        logger.error(f"Error processing user-item matrix: {e}")
-        raise
-
-def perform_svd(user_book_sparse: csr_matrix, n_components: int = 100) -> pd.DataFrame:
-    """Performs dimensionality reduction using TruncatedSVD."""
+def perform_svd(user_book_sparse: csr_matrix, n_components: int = 100):
+    """Performs dimensionality reduction using TruncatedSVD; returns the reduced matrix and the fitted model."""
     try:
         logger.info(f"Performing SVD with {n_components} components...")
         svd = TruncatedSVD(n_components=n_components, random_state=42)
-        return svd.fit_transform(user_book_sparse)
+        return svd.fit_transform(user_book_sparse), svd
     except Exception as e:
         logger.error(f"Error performing SVD: {e}")
         raise
 
-def cluster_users(reduced_matrix: pd.DataFrame, n_clusters: int = 30) -> pd.DataFrame:
-    """Clusters users into groups using MiniBatchKMeans."""
+def cluster_users(reduced_matrix: pd.DataFrame, n_clusters: int = 30):
+    """Clusters users into groups using MiniBatchKMeans; returns the labels and the fitted model."""
     try:
         logger.info(f"Clustering users into {n_clusters} clusters...")
         kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=1000)
         clusters = kmeans.fit_predict(reduced_matrix)
         logger.info("User clustering completed.")
-        return clusters
+        return clusters, kmeans
     except Exception as e:
         logger.error(f"Error clustering users: {e}")
         raise
 
-def generate_cluster_recommendations(data: pd.DataFrame, clusters: pd.DataFrame, user_indices) -> pd.DataFrame:
-    """Generates top ISBN recommendations for each cluster."""
+def map_users_to_clusters(user_indices, clusters) -> pd.DataFrame:
+    """User id -> cluster id table for the matrix rows."""
+    logger.info("Mapping clusters to users...")
+    return pd.DataFrame({
+        'user_id': id_registry.decode(id_registry.load_registry('user'), user_indices),
+        'cluster_id': clusters
+    })
+
+def generate_centroid_recommendations(user_book_sparse: csr_matrix, clusters, centroids: np.ndarray, components: np.ndarray,
+                                      book_codes, top_n: int = TOP_N, min_support: int = MIN_SUPPORT) -> pd.DataFrame:
+    """Scores every book for every cluster at once: the centroids back-projected through the SVD components.
+
+    Books rated by fewer than `min_support` users of a cluster are masked out, so a single 10 cannot
+    dominate; the top N per cluster come from `argpartition`, O(clusters x books) with no sort of the
+    raw ratings. Returns the same (cluster_id, isbn list) frame as the mean-rating scoring.
+    """
     try:
-        logger.info("Mapping clusters to users...")
-        user_cluster_mapping = pd.DataFrame({
-            'user_id': user_indices,
-            'cluster_id': clusters
+        logger.info(f"Scoring books per cluster by centroid projection (min support {min_support})...")
+        n_clusters = centroids.shape[0]
+        scores = (centroids @ components).astype(np.float32)
+
+        membership = csr_matrix((np.ones(len(clusters), dtype=np.float32), (np.asarray(clusters), np.arange(len(clusters)))),
+                                shape=(n_clusters, user_book_sparse.shape[0]))
+        rated = csr_matrix(user_book_sparse, dtype=np.float32, copy=True)
+        rated.data[:] = 1
+        support = (membership @ rated).toarray()
+        scores[support < min_support] = -np.inf
+
+        items, _ = item_similarity.top_k_rows(scores, top_n)
+        isbn_registry = id_registry.load_registry('isbn')
+        top_books_per_cluster = pd.DataFrame({
+            'cluster_id': np.arange(n_clusters),
+            'isbn': [list(id_registry.decode(isbn_registry, np.asarray(book_codes)[row[row >= 0]])) for row in items],
         })
+        logger.info("Cluster recommendations generated successfully.")
+        return top_books_per_cluster[top_books_per_cluster['isbn'].str.len() > 0].reset_index(drop=True)
+    except Exception as e:
+        logger.error(f"Error generating centroid recommendations: {e}")
+        raise
+
+def generate_cluster_recommendations(data: pd.DataFrame, clusters: pd.DataFrame, user_indices) -> pd.DataFrame:
+    """Generates top ISBN recommendations for each cluster.
+
+    `user_indices` are the user codes of the matrix rows; ids are decoded through the registry
+    only for the saved results.
+    """
+    try:
+        user_registry = id_registry.load_registry('user')
+        isbn_registry = id_registry.load_registry('isbn')
+        user_cluster_mapping = map_users_to_clusters(user_indices, clusters)
 
         logger.info("Merging cluster information with raw data...")
-        data['cluster_id'] = data['user_id'].map(dict(zip(user_indices, clusters)))
+        cluster_of_user = np.full(len(user_registry), -1, dtype=np.int32)
+        cluster_of_user[np.asarray(user_indices)] = clusters
+        data['cluster_id'] = cluster_of_user[data['user_code'].to_numpy()]
 
         logger.info("Generating top ISBN recommendations for each cluster...")
         top_books_per_cluster = (
-            data.groupby(['cluster_id', 'isbn'])['book_rating']
+            data.groupby(['cluster_id', 'isbn_code'])['book_rating']
             .mean()
             .reset_index()
             .sort_values(by=['cluster_id', 'book_rating'], ascending=[True, False])
             .groupby('cluster_id')
-            .head(10)
-            .groupby('cluster_id')['isbn']
-            .apply(list)
-            .reset_index()
+            .head(TOP_N)
         )
+        top_books_per_cluster['isbn'] = id_registry.decode(isbn_registry, top_books_per_cluster['isbn_code'])
+        top_books_per_cluster = top_books_per_cluster.groupby('cluster_id')['isbn'].apply(list).reset_index()
 
         logger.info("Cluster recommendations generated successfully.")
         return user_cluster_mapping, top_books_per_cluster
@@ -87,43 +126,111 @@ def generate_cluster_recommendations(data: pd.DataFrame, clusters: pd.DataFrame,
         logger.error(f"Error generating cluster recommendations: {e}")
         raise
 
+def cluster_book_codes(top_books_per_cluster: pd.DataFrame, n_clusters: int, top_n: int = TOP_N) -> np.ndarray:
+    """Recommended ISBN codes per cluster as an n_clusters x top_n array, -1 padded."""
+    isbn_registry = id_registry.load_registry('isbn')
+    books = np.full((n_clusters, top_n), -1, dtype=np.int32)
+    for cluster_id, isbns in zip(top_books_per_cluster['cluster_id'], top_books_per_cluster['isbn']):
+        codes = id_registry.encode(isbn_registry, isbns[:top_n])
+        books[cluster_id, :len(codes)] = codes
+    return books
+
 def save_results(user_cluster_mapping: pd.DataFrame, top_books_per_cluster: pd.DataFrame, output_dir: str) -> None:
-    """Saves the results to CSV files."""
+    """Saves the user-cluster mapping (CSV) and the cluster recommendations (Parquet, native list column)."""
     try:
         logger.info("Saving user-cluster mapping to CSV...")
         user_cluster_mapping_path = os.path.join(output_dir, "user_clusters.csv")
         user_cluster_mapping.to_csv(user_cluster_mapping_path, index=False)
 
-        logger.info("Saving cluster recommendations to CSV...")
-        cluster_recommendations_path = os.path.join(output_dir, "cluster_recommendation.csv")
-        top_books_per_cluster.to_csv(cluster_recommendations_path, index=False, chunksize=10000)
+        logger.info("Saving cluster recommendations to Parquet...")
+        list_artifacts.save_cluster_recommendations(top_books_per_cluster['cluster_id'], top_books_per_cluster['isbn'], output_dir)
 
         logger.info(f"Results saved in {output_dir}.")
     except Exception as e:
         logger.error(f"Error saving results: {e}")
         raise
 
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Collaborative filtering with user clustering.")
+    parser.add_argument(
+        '--n_components', type=int, default=100, help='SVD rank (see hyperparameter_sweep).'
+    )
+    parser.add_argument(
+        '--n_clusters', type=int, default=30, help='Number of user clusters (see hyperparameter_sweep).'
+    )
+    parser.add_argument(
+        '--cluster_scoring', choices=['mean', 'centroid'], default='mean',
+        help='Rank cluster books by mean raw rating, or by centroid projection with a minimum-support mask.'
+    )
+    parser.add_argument(
+        '--min_support', type=int, default=MIN_SUPPORT, help='Minimum in-cluster ratings for centroid scoring.'
+    )
+    parser.add_argument(
+        '--score_users', type=int, default=0, help='Also write each user\'s top-N unseen books from the SVD factors (0 disables).'
+    )
+    parser.add_argument(
+        '--streaming', action='store_true', help='Bounded-memory training: sampled randomized SVD and partial_fit over user chunks.'
+    )
+    parser.add_argument(
+        '--source', choices=list(streaming_clustering.SOURCES), default='preprocessed',
+        help='Ratings clustered in streaming mode: the threshold-filtered raw_data or the full Ratings table.'
+    )
+    parser.add_argument(
+        '--chunk_users', type=int, default=streaming_clustering.CHUNK_USERS, help='User key range read per chunk in streaming mode.'
+    )
+    parser.add_argument(
+        '--n_passes', type=int, default=streaming_clustering.N_PASSES, help='partial_fit passes over the chunks in streaming mode.'
+    )
+    parser.add_argument(
+        '--sample_fraction', type=float, default=streaming_clustering.SAMPLE_FRACTION, help='Share of users the streaming SVD is fitted on.'
+    )
+    return parser.parse_args()
+
 def main():
     """Main executable for collaborative filtering with clustering."""
+    args = parse_args()
+    if args.streaming:
+        streaming_clustering.run(args.source, args.n_components, args.n_clusters, chunk_users=args.chunk_users, n_passes=args.n_passes,
+                                 sample_fraction=args.sample_fraction, output_dir=OUTPUT_DIR)
+        return
+
     try:
-        # Step 1: Read raw data
-        raw_data = read_raw_data(RAW_PARQUET_PATH)
+        # Step 1: Read raw data (only the mean-rating scoring needs the rating rows)
+        raw_data = read_raw_data(RAW_PARQUET_PATH) if args.cluster_scoring == 'mean' else None
 
-        # Step 2: Process user-book matrix
-        user_book_sparse, user_indices = process_user_book_matrix(raw_data)
+        # Step 2: Load the shared user-book matrix (built once per raw data version and cached)
+        user_book_sparse, user_indices, book_codes = interaction_matrix.load_interaction_matrix(RAW_PARQUET_PATH)
 
         # Step 3: Perform SVD
-        reduced_matrix = perform_svd(user_book_sparse)
+        reduced_matrix, svd = perform_svd(user_book_sparse, args.n_components)
 
         # Step 4: Cluster users
-        clusters = cluster_users(reduced_matrix)
+        clusters, kmeans = cluster_users(reduced_matrix, args.n_clusters)
 
         # Step 5: Generate cluster recommendations
-        user_cluster_mapping, top_books_per_cluster = generate_cluster_recommendations(raw_data, clusters, user_indices)
+        if args.cluster_scoring == 'centroid':
+            user_cluster_mapping = map_users_to_clusters(user_indices, clusters)
+            top_books_per_cluster = generate_centroid_recommendations(
+                user_book_sparse, clusters, kmeans.cluster_centers_, svd.components_, book_codes, min_support=args.min_support)
+        else:
+            user_cluster_mapping, top_books_per_cluster = generate_cluster_recommendations(raw_data, clusters, user_indices)
 
         # Step 6: Save results
         save_results(user_cluster_mapping, top_books_per_cluster, OUTPUT_DIR)
 
+        # Step 7: Save the fitted models so new users can be folded in without a refit
+        cluster_books = cluster_book_codes(top_books_per_cluster, kmeans.n_clusters)
+        user_model.save_user_model(svd.components_, kmeans.cluster_centers_, book_codes, cluster_books)
+
+        # Step 8: Optionally score every user individually against the SVD item factors
+        if args.score_users > 0:
+            # 0 ratings are reads too, so the seen mask keeps them; row and column sets match user_book_sparse
+            seen, _, _ = interaction_matrix.load_interaction_matrix(
+                RAW_PARQUET_PATH, interaction_matrix.IMPLICIT_MATRIX_CACHE_PATH, keep_zeros=True)
+            items, scores = latent_scoring.score_users(reduced_matrix, svd.components_, seen, args.score_users)
+            latent_scoring.save_user_topk(user_indices, book_codes, items, scores)
+
     except Exception as e:
         logger.error(f"An error occurred in the main process: {e}")
         raise
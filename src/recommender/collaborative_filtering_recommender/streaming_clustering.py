@@ -0,0 +1,191 @@
+import os
+import shutil
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+import pyarrow as pa  # type: ignore
+import pyarrow.dataset as ds  # type: ignore
+import pyarrow.parquet as pq  # type: ignore
+from scipy.sparse import csr_matrix  # type: ignore
+from sklearn.cluster import MiniBatchKMeans  # type: ignore
+from sklearn.utils.extmath import randomized_svd  # type: ignore
+from config.logging_configs import logger  # Assuming your logging is set up
+from src.data_inject.csv_to_parquet import raw_parquet_path
+from src.data_preprocessing import id_registry
+from src.data_preprocessing.partitioned_preprocessing import partition_of
+from src.recommender.collaborative_filtering_recommender import interaction_matrix, user_model
+from src.recommender import list_artifacts, seen_items
+
+# Define paths
+RAW_PARQUET_PATH = "data/preprocessed_files/raw_data.parquet"
+OUTPUT_DIR = "data/recommender_result"
+BUCKETS_DIR = "data/recommender_result/streaming_buckets"  # Scratch: encoded ratings bucketed by user key range
+
+# Rating sources: (path, user key column, ISBN column, rating column). 'preprocessed' holds the
+# threshold-filtered users; 'raw' is the full Ratings table, so every user gets a cluster.
+SOURCES = {
+    'preprocessed': (RAW_PARQUET_PATH, 'user_code', 'isbn_code', 'book_rating'),
+    'raw': (raw_parquet_path('Ratings'), 'User-ID', 'ISBN', 'Book-Rating'),
+}
+
+CHUNK_USERS = 50_000  # Width of the user key range read per chunk
+N_PASSES = 3  # partial_fit passes over all chunks
+SAMPLE_FRACTION = 0.1  # Share of users (by key hash) the randomized SVD is fitted on
+SCAN_BATCH_SIZE = 1_000_000  # Rows per streamed batch during the sampling scan
+TOP_N = seen_items.fetch_size(10)  # Books saved per cluster, so shelves stay full after seen-item filtering
+
+def encode_isbns(isbns, source: str, isbn_index: pd.Index) -> np.ndarray:
+    """ISBN codes of a chunk; raw ISBNs are canonicalized and looked up in the registry (-1 if unknown)."""
+    if source == 'preprocessed':
+        return np.asarray(isbns, dtype=np.int32)
+    return id_registry.encode(isbn_index, id_registry.canonicalize_isbn(pd.Series(isbns)))
+
+def chunk_matrix(user_keys: np.ndarray, isbn_codes: np.ndarray, ratings: np.ndarray, n_items: int):
+    """User rows of one chunk over every registry ISBN column (mean of duplicate ratings, as in training)."""
+    known = isbn_codes >= 0
+    matrix, row_ids, col_ids = interaction_matrix.build_interaction_matrix(
+        user_keys[known], isbn_codes[known], ratings[known],
+    )
+    matrix = matrix.tocoo()
+    return row_ids, csr_matrix((matrix.data, (matrix.row, col_ids[matrix.col])), shape=(len(row_ids), n_items))
+
+def bucket_path(bucket: int, buckets_dir: str = BUCKETS_DIR) -> str:
+    """Path of the scratch file holding one user key range."""
+    return os.path.join(buckets_dir, f"bucket-{bucket:08d}.parquet")
+
+def bucket_ratings(dataset, source: str, isbn_index: pd.Index, sample_fraction: float, chunk_users: int = CHUNK_USERS,
+                   buckets_dir: str = BUCKETS_DIR, batch_size: int = SCAN_BATCH_SIZE):
+    """One streamed pass: encodes the ratings, appends each batch's rows to their user key range
+    bucket (key // chunk_users) on disk, and keeps the rows of a hash sample of users.
+
+    Returns the sorted non-empty bucket ids and the sample matrix. Every later pass reads one
+    bucket file per chunk instead of re-scanning the source, and ISBNs are canonicalized once.
+    """
+    _, user_column, isbn_column, rating_column = SOURCES[source]
+    n_partitions = max(1, int(round(1 / sample_fraction)))
+    schema = pa.schema([('user_key', pa.int64()), ('isbn_code', pa.int32()), ('rating', pa.float64())])
+    shutil.rmtree(buckets_dir, ignore_errors=True)
+    os.makedirs(buckets_dir, exist_ok=True)
+    writers, sample = {}, []
+    try:
+        for batch in dataset.to_batches(columns=[user_column, isbn_column, rating_column], batch_size=batch_size):
+            frame = batch.to_pandas()
+            if frame.empty:
+                continue
+            keys = frame[user_column].to_numpy().astype(np.int64)
+            table = pa.table({
+                'user_key': keys,
+                'isbn_code': encode_isbns(frame[isbn_column].to_numpy(), source, isbn_index),
+                'rating': frame[rating_column].to_numpy(dtype=np.float64),
+            }, schema=schema)
+            sample.append(table.filter(pa.array(partition_of(keys, n_partitions) == 0)))
+
+            buckets = keys // chunk_users
+            order = np.argsort(buckets, kind='stable')
+            ids, starts = np.unique(buckets[order], return_index=True)
+            for bucket, start, stop in zip(ids, starts, np.append(starts[1:], len(order))):
+                if bucket not in writers:
+                    writers[bucket] = pq.ParquetWriter(bucket_path(int(bucket), buckets_dir), schema)
+                writers[bucket].write_table(table.take(order[start:stop]))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    sample = pa.concat_tables(sample).to_pandas() if sample else schema.empty_table().to_pandas()
+    _, matrix = chunk_matrix(sample['user_key'].to_numpy(), sample['isbn_code'].to_numpy(), sample['rating'].to_numpy(), len(isbn_index))
+    return sorted(int(bucket) for bucket in writers), matrix
+
+def iter_chunks(buckets: list, n_items: int, buckets_dir: str = BUCKETS_DIR):
+    """Yields (user keys, rows of the chunk's ratings, chunk matrix) for consecutive user key ranges.
+
+    Each chunk is one bucket file written by `bucket_ratings`, so only one chunk is ever in memory.
+    """
+    for bucket in buckets:
+        frame = pd.read_parquet(bucket_path(bucket, buckets_dir))
+        keys = frame['user_key'].to_numpy()
+        isbn_codes = frame['isbn_code'].to_numpy()
+        ratings = frame['rating'].to_numpy()
+        row_ids, matrix = chunk_matrix(keys, isbn_codes, ratings, n_items)
+        yield row_ids, (keys, isbn_codes, ratings), matrix
+
+def top_books(sums: np.ndarray, counts: np.ndarray, top_n: int = TOP_N) -> np.ndarray:
+    """Per cluster, the top_n ISBN codes by mean rating (ties by ISBN code), -1 padded."""
+    books = np.full((sums.shape[0], top_n), -1, dtype=np.int32)
+    for cluster_id in range(sums.shape[0]):
+        rated = np.flatnonzero(counts[cluster_id] > 0)
+        means = sums[cluster_id, rated] / counts[cluster_id, rated]
+        best = rated[np.lexsort((rated, -means))[:top_n]]
+        books[cluster_id, :len(best)] = best
+    return books
+
+def run(source: str = 'preprocessed', n_components: int = 100, n_clusters: int = 30, chunk_users: int = CHUNK_USERS,
+        n_passes: int = N_PASSES, sample_fraction: float = SAMPLE_FRACTION, output_dir: str = OUTPUT_DIR,
+        buckets_dir: str = BUCKETS_DIR) -> None:
+    """Streaming training: randomized SVD on a user sample, then MiniBatchKMeans.partial_fit over chunks.
+
+    The source is scanned once, into user key range buckets on disk. Memory is bounded by the
+    sample plus one chunk; writes the same outputs as the in-memory mode.
+    """
+    try:
+        isbn_index = id_registry.load_registry('isbn')
+        n_items = len(isbn_index)
+        dataset = ds.dataset(SOURCES[source][0], format='parquet')
+
+        # Step 1: Bucket the ratings by user key range and fit the item factors on a hash sample of users
+        logger.info(f"Bucketing the {source} ratings and sampling {sample_fraction:.0%} of users...")
+        buckets, sample = bucket_ratings(dataset, source, isbn_index, sample_fraction, chunk_users, buckets_dir)
+        n_components = max(1, min(n_components, min(sample.shape) - 1))
+        logger.info(f"Fitting randomized SVD with {n_components} components on {sample.shape[0]} sampled users...")
+        _, _, components = randomized_svd(sample, n_components, random_state=42)
+        components = components.astype(np.float32)
+
+        # Step 2: Train the clustering chunk by chunk; chunks smaller than n_clusters are carried over
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=1000)
+        for n_pass in range(n_passes):
+            pending = []
+            for _, _, matrix in iter_chunks(buckets, n_items, buckets_dir):
+                pending.append(np.asarray(matrix @ components.T))
+                if sum(len(p) for p in pending) >= n_clusters:
+                    kmeans.partial_fit(np.vstack(pending))
+                    pending = []
+            if pending and hasattr(kmeans, 'cluster_centers_'):
+                kmeans.partial_fit(np.vstack(pending))
+            logger.info(f"Clustering pass {n_pass + 1}/{n_passes} completed.")
+        if not hasattr(kmeans, 'cluster_centers_'):
+            # Fewer users than clusters in total: partial_fit never ran, so fit on all of them at once
+            if not pending:
+                raise ValueError(f"No users to cluster in the {source} ratings.")
+            users = np.vstack(pending)
+            logger.warning(f"Only {len(users)} users for {n_clusters} clusters; fitting {len(users)} clusters on all of them.")
+            n_clusters = len(users)
+            kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=1000).fit(users)
+
+        # Step 3: Assign every user and accumulate per-cluster book ratings
+        sums = np.zeros(n_clusters * n_items, dtype=np.float64)
+        counts = np.zeros(n_clusters * n_items, dtype=np.float64)
+        user_registry = id_registry.load_registry('user') if source == 'preprocessed' else None
+        clusters_path = os.path.join(output_dir, "user_clusters.csv")
+        os.makedirs(output_dir, exist_ok=True)
+        header = True
+        for row_ids, (keys, isbn_codes, ratings), matrix in iter_chunks(buckets, n_items, buckets_dir):
+            clusters = kmeans.predict(np.asarray(matrix @ components.T, dtype=kmeans.cluster_centers_.dtype))
+            user_ids = id_registry.decode(user_registry, row_ids) if user_registry is not None else row_ids
+            pd.DataFrame({'user_id': user_ids, 'cluster_id': clusters}).to_csv(
+                clusters_path, mode='w' if header else 'a', header=header, index=False)
+            header = False
+
+            rows = pd.Index(row_ids).get_indexer(keys)
+            rated = (rows >= 0) & (isbn_codes >= 0) & ~np.isnan(ratings)
+            slots = clusters[rows[rated]].astype(np.int64) * n_items + isbn_codes[rated]
+            sums += np.bincount(slots, weights=ratings[rated], minlength=len(sums))
+            counts += np.bincount(slots, minlength=len(counts))
+
+        # Step 4: Save cluster recommendations and the model for fold-in
+        cluster_books = top_books(sums.reshape(n_clusters, n_items), counts.reshape(n_clusters, n_items))
+        non_empty = np.flatnonzero((cluster_books >= 0).any(axis=1))
+        list_artifacts.save_cluster_recommendations(
+            non_empty, [id_registry.decode(isbn_index, cluster_books[c][cluster_books[c] >= 0]) for c in non_empty], output_dir)
+        user_model.save_user_model(components, kmeans.cluster_centers_, np.arange(n_items, dtype=np.int32), cluster_books)
+        shutil.rmtree(buckets_dir, ignore_errors=True)
+        logger.info("Streaming clustering completed.")
+    except Exception as e:
+        logger.error(f"Error in streaming clustering: {e}")
+        raise
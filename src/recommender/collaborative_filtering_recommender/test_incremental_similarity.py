@@ -0,0 +1,36 @@
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+from scipy.sparse import random as sparse_random  # type: ignore
+from src.data_preprocessing import id_registry
+from src.recommender.collaborative_filtering_recommender import incremental_similarity, item_similarity
+
+def test_incremental_matches_full_similarity():
+    rng = np.random.default_rng(9)
+    matrix = sparse_random(80, 40, density=0.15, format='csr', random_state=9, data_rvs=lambda n: rng.uniform(1, 10, n))
+    state = incremental_similarity.build_state(matrix, np.arange(80), np.arange(40), top_k=5)
+
+    # Changed ratings, removed ratings (0), a new user (code 80) and a new book (code 40)
+    pairs = np.unique(rng.integers(0, 81 * 41, 60))
+    deltas = pd.DataFrame({
+        'user_code': (pairs // 41).astype(np.int32),
+        'isbn_code': (pairs % 41).astype(np.int32),
+        'book_rating': np.where(rng.random(len(pairs)) < 0.2, 0.0, rng.uniform(1, 10, len(pairs))),
+    })
+    incremental_similarity.apply_deltas(state, deltas)
+
+    neighbours, scores = item_similarity.top_k_similar_items(state['matrix'], top_k=5)
+    np.testing.assert_allclose(state['scores'], scores, atol=1e-5)
+    np.testing.assert_array_equal(state['neighbours'], neighbours)
+
+def test_state_is_rebuilt_when_raw_data_or_registry_changes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    id_registry.save_registry({'isbn': id_registry.key_index([f"{code:010d}" for code in range(40)], 'isbn')})
+    matrix = sparse_random(80, 40, density=0.15, format='csr', random_state=9)
+    path = 'state/similarity.npz'
+    incremental_similarity.save_state(incremental_similarity.build_state(matrix, np.arange(80), np.arange(40), 5, 'v1'), path)
+    assert incremental_similarity.load_current_state('v1', 5, path) is not None
+    assert incremental_similarity.load_current_state('v2', 5, path) is None
+    assert incremental_similarity.load_current_state('v1', 10, path) is None
+
+    id_registry.save_registry({'isbn': id_registry.key_index([f"{code:010d}" for code in range(41)], 'isbn')})
+    assert incremental_similarity.load_current_state('v1', 5, path) is None
@@ -0,0 +1,89 @@
+import os
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+from scipy.sparse import csr_matrix  # type: ignore
+from config.logging_configs import logger  # Assuming your logging is set up
+from src.data_preprocessing import id_registry
+from src.recommender.collaborative_filtering_recommender import interaction_matrix
+
+# Define paths
+MODEL_PATH = "data/recommender_result/user_cluster_model.npz"
+
+def save_user_model(components: np.ndarray, centroids: np.ndarray, col_ids: np.ndarray, cluster_books: np.ndarray,
+                    path: str = MODEL_PATH) -> None:
+    """Persists what fold-in needs: SVD item factors, cluster centroids, column ISBN codes and each
+    cluster's recommended ISBN codes (n_clusters x k, -1 padded), stamped with the registry version."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path,
+                 components=np.asarray(components, dtype=np.float32),
+                 centroids=np.asarray(centroids, dtype=np.float32),
+                 col_ids=np.asarray(col_ids, dtype=np.int32),
+                 cluster_books=np.asarray(cluster_books, dtype=np.int32),
+                 registry_version=np.str_(id_registry.load_registry_version()))
+        os.replace(tmp_path, path)
+        logger.info(f"User cluster model saved to {path}.")
+    except Exception as e:
+        logger.error(f"Error saving user cluster model: {e}")
+        raise
+
+def load_user_model(path: str = MODEL_PATH) -> dict:
+    """Loads the model and adds the ISBN code -> column lookup used by fold-in.
+
+    Raises when the model's ISBN codes come from another registry than the current one.
+    """
+    try:
+        with np.load(path) as stored:
+            model = {name: stored[name] for name in stored.files}
+        id_registry.check_registry_version(model.get('registry_version'), 'User cluster model')
+        model['column_of'] = pd.Index(model['col_ids'])
+        model['centroid_norms'] = np.einsum('ij,ij->i', model['centroids'], model['centroids'])
+        return model
+    except Exception as e:
+        logger.error(f"Error loading user cluster model: {e}")
+        raise
+
+def rating_rows(model: dict, user_keys, isbn_codes, ratings):
+    """Rating vectors of a batch of users over the model's columns; ISBNs the model never saw are ignored.
+
+    Duplicate (user, book) ratings are averaged, as in the training matrix.
+    """
+    columns = model['column_of'].get_indexer(np.asarray(isbn_codes))
+    known = columns >= 0
+    users, rows = np.unique(np.asarray(user_keys), return_inverse=True)
+    matrix, row_ids, col_ids = interaction_matrix.build_interaction_matrix(
+        rows[known], columns[known], np.asarray(ratings, dtype=np.float64)[known],
+    )
+    # Re-spread the compacted rows / columns over every user of the batch and every model column
+    matrix = matrix.tocoo()
+    full = csr_matrix((matrix.data, (row_ids[matrix.row], col_ids[matrix.col])),
+                      shape=(len(users), len(model['col_ids'])))
+    return users, full
+
+def assign_clusters(model: dict, matrix: csr_matrix) -> np.ndarray:
+    """Projects rating rows into the SVD space and returns each row's nearest centroid."""
+    factors = np.asarray(matrix @ model['components'].T, dtype=np.float32)
+    distances = model['centroid_norms'][None, :] - 2 * factors @ model['centroids'].T
+    return np.argmin(distances, axis=1).astype(np.int32)
+
+def fold_in_users(model: dict, ratings: pd.DataFrame, user_column: str = 'user_id') -> pd.DataFrame:
+    """Batch fold-in: cluster of every user in a (user, isbn_code, book_rating) frame, without a refit."""
+    try:
+        users, matrix = rating_rows(model, ratings[user_column], ratings['isbn_code'], ratings['book_rating'])
+        return pd.DataFrame({user_column: users, 'cluster_id': assign_clusters(model, matrix)})
+    except Exception as e:
+        logger.error(f"Error folding in users: {e}")
+        raise
+
+def fold_in_user(model: dict, isbn_codes, ratings) -> int:
+    """Cluster of a single user from their rated ISBN codes; -1 when none of the books is known to the model."""
+    _, matrix = rating_rows(model, np.zeros(len(isbn_codes), dtype=np.int32), isbn_codes, ratings)
+    return int(assign_clusters(model, matrix)[0]) if matrix.nnz else -1
+
+def cluster_books(model: dict, cluster_id: int) -> np.ndarray:
+    """Recommended ISBN codes of one cluster."""
+    if cluster_id < 0:
+        return np.empty(0, dtype=np.int32)
+    books = model['cluster_books'][cluster_id]
+    return books[books >= 0]
@@ -1,88 +1,128 @@
 import os
-import pandas as pd  # type: ignore
-import json
 import argparse
-import logging
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
 from config.logging_configs import logger  # Assuming logging is already configured
+from src.data_preprocessing import id_registry
+from src.data_preprocessing.preprocessing_raw_data import LOCATION_LEVELS
+from src.recommender.segment_popularity import segment_popularity
 
-def read_parquet(file_path: str) -> pd.DataFrame:
-    """Reads the Parquet file and returns the DataFrame."""
-    try:
-        logger.info(f"Reading data from {file_path}...")
-        return pd.read_parquet(file_path)
-    except Exception as e:
-        logger.error(f"Error reading Parquet file from {file_path}: {e}")
-        raise
+# Define paths
+INPUT_FILE = "data/preprocessed_files/raw_data.parquet"
+ROLLUP_PATH = "data/recommender_result/location_rollup.npz"
 
-def process_geo_location_data(df: pd.DataFrame) -> pd.DataFrame:
-    """Processes the data to group by location and ISBN, calculating ratings and number of unique users."""
-    try:
-        logger.info("Selecting relevant columns for ratings and geo-location...")
-        ratings_with_geo_location_data = df[['user_id', 'isbn', 'book_rating', 'location']]
-
-        logger.info("Grouping ratings by location and ISBN...")
-        book_ratings_with_each_location = (
-            ratings_with_geo_location_data.groupby(['location', 'isbn'])
-            .agg(
-                avg_rating=('book_rating', 'mean'),
-                user_rated=('user_id', 'nunique')
-            )
-            .reset_index()
-        ).sort_values(by='user_rated', ascending=False)
-
-        logger.info("Geo-location data processed successfully.")
-        return book_ratings_with_each_location
-    except Exception as e:
-        logger.error(f"Error processing geo-location data: {e}")
-        raise
+TOP_K = segment_popularity.FETCH_K
+LEVEL_DIMENSIONS = ['location'] + LOCATION_LEVELS  # Code columns the rollup reads
+MIN_USERS = 5  # Distinct raters a city or state bucket needs before it is used instead of its parent
+
+def read_ratings(file_path: str) -> pd.DataFrame:
+    """Reads the encoded ratings with the location code of every hierarchy level."""
+    return segment_popularity.read_ratings(file_path, LEVEL_DIMENSIONS)
+
+def level_top_k(ratings: pd.DataFrame, segments: np.ndarray, n_segments: int, top_k: int = TOP_K):
+    """Top-k ISBN codes per segment as an (n_segments, top_k) matrix padded with -1, plus distinct raters per segment."""
+    user_codes = ratings['user_code'].to_numpy()
+    pair_segments, isbn_codes, avg_rating, user_rated = segment_popularity.segment_aggregates(
+        segments, ratings['isbn_code'].to_numpy(), user_codes, ratings['book_rating'].to_numpy())
+    top = segment_popularity.top_k_per_segment(
+        pair_segments, isbn_codes, segment_popularity.weighted_scores(avg_rating, user_rated), user_rated, top_k)
+    matrix = np.full((n_segments, top_k), -1, dtype=np.int32)
+    for segment, codes in top.items():
+        matrix[segment, :len(codes)] = codes
 
-def calculate_weighted_scores(df: pd.DataFrame) -> pd.DataFrame:
-    """Calculates the weighted score for each book based on average rating and number of unique users."""
+    known = segments >= 0
+    n_users = int(user_codes.max()) + 1 if len(user_codes) else 1
+    distinct = pd.unique(segments[known].astype(np.int64) * n_users + user_codes[known])
+    return matrix, np.bincount(distinct // n_users, minlength=n_segments)
+
+def build_location_rollup(ratings: pd.DataFrame, top_k: int = TOP_K, min_users: int = MIN_USERS) -> dict:
+    """Per-level top-k lists and a fallback index from location code to the list to serve.
+
+    `lists` stacks the city, state and country matrices and one global row. `row_of_location[code]`
+    is the row of the finest level whose bucket has at least `min_users` raters (countries are always
+    used when known); its trailing entry, reached by code -1, points at the global row. Lookups are
+    therefore a single array index, with no fallback chain walked at serve time.
+    """
     try:
-        logger.info("Calculating weighted score for each book...")
-        df["weighted_score"] = 0.8 * df["avg_rating"] + 0.2 * df["user_rated"]
-        return df
+        logger.info(f"Building the location rollup over {LOCATION_LEVELS} (min {min_users} raters per bucket)...")
+        blocks, level_start, trusted = [], {}, {}
+        start = 0
+        for level in LOCATION_LEVELS:
+            n_segments = len(id_registry.load_registry(level))
+            matrix, users = level_top_k(ratings, ratings[id_registry.code_column(level)].to_numpy(), n_segments, top_k)
+            blocks.append(matrix)
+            level_start[level], start = start, start + n_segments
+            trusted[level] = users >= (min_users if level != LOCATION_LEVELS[-1] else 1)
+        global_matrix, _ = level_top_k(ratings, np.zeros(len(ratings), dtype=np.int32), 1, top_k)
+        blocks.append(global_matrix)
+        global_row = start
+
+        # Resolve coarse to fine, so the finest trusted level overwrites its parents
+        n_locations = len(id_registry.load_registry('location'))
+        row_of_location = np.full(n_locations + 1, global_row, dtype=np.int32)
+        level_codes = ratings.drop_duplicates('location_code')
+        level_codes = level_codes[level_codes['location_code'] >= 0]
+        location_codes = level_codes['location_code'].to_numpy()
+        for level in reversed(LOCATION_LEVELS):
+            codes = level_codes[id_registry.code_column(level)].to_numpy()
+            usable = codes >= 0
+            usable[usable] = trusted[level][codes[usable]]
+            row_of_location[location_codes[usable]] = level_start[level] + codes[usable]
+
+        level_of_row = np.repeat(np.arange(len(LOCATION_LEVELS) + 1, dtype=np.int8),
+                                 [len(block) for block in blocks])
+        counts = np.bincount(level_of_row[row_of_location[:-1]], minlength=len(LOCATION_LEVELS) + 1)
+        logger.info("Locations served per level: " + ", ".join(
+            f"{level}={count}" for level, count in zip(LOCATION_LEVELS + ['global'], counts)))
+        return {
+            'lists': np.vstack(blocks),
+            'row_of_location': row_of_location,
+            'level_start': np.array([level_start[level] for level in LOCATION_LEVELS] + [global_row], dtype=np.int32),
+        }
     except Exception as e:
-        logger.error(f"Error calculating weighted scores: {e}")
+        logger.error(f"Error building the location rollup: {e}")
         raise
 
-def get_top_isbn_per_location(df: pd.DataFrame) -> pd.Series:
-    """Gets the top ISBNs per location based on weighted score."""
+def save_location_rollup(rollup: dict, path: str = ROLLUP_PATH) -> None:
+    """Saves the rollup arrays to one compressed .npz file."""
     try:
-        logger.info("Selecting top ISBNs per location...")
-        top_isbn_per_location = (
-            df.sort_values(by=["location", "weighted_score"], ascending=[True, False])
-            .groupby("location")
-            .head(10)
-            .groupby("location")["isbn"]
-            .apply(list)
-        )
-        logger.info("Top ISBNs per location selected successfully.")
-        return top_isbn_per_location
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(path, **rollup)
+        logger.info(f"Location rollup saved to {path} ({os.path.getsize(path)} bytes).")
     except Exception as e:
-        logger.error(f"Error selecting top ISBNs: {e}")
+        logger.error(f"Error saving location rollup: {e}")
         raise
 
-def save_top_isbn_to_json(top_isbn_dict: dict, output_dir: str) -> None:
-    """Saves the top ISBNs per location to a JSON file."""
+def load_location_rollup(path: str = ROLLUP_PATH) -> dict:
+    """Loads the rollup saved by `save_location_rollup`."""
     try:
-        os.makedirs(output_dir, exist_ok=True)  # Ensure output directory exists
-        output_file_path = os.path.join(output_dir, "top_isbn_per_location.json")
-        with open(output_file_path, "w") as json_file:
-            json.dump(top_isbn_dict, json_file)
-        logger.info(f"Top ISBNs saved to {output_file_path} successfully.")
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
     except Exception as e:
-        logger.error(f"Error saving top ISBNs to JSON: {e}")
+        logger.error(f"Error loading location rollup from {path}: {e}")
         raise
 
+def resolve_rows(rollup: dict, location_codes) -> np.ndarray:
+    """Row of `lists` to serve for each location code; unknown codes (-1) get the global row."""
+    return rollup['row_of_location'][np.asarray(location_codes)]
+
+def decoded_lists(rollup: dict, isbn_registry: pd.Index) -> np.ndarray:
+    """Object array with the decoded ISBN list of every rollup row, padding dropped."""
+    lists = np.empty(len(rollup['lists']), dtype=object)
+    lists[:] = [list(id_registry.decode(isbn_registry, row[row >= 0])) for row in rollup['lists']]
+    return lists
+
 def parse_args():
     """Parse command-line arguments."""
     parser = argparse.ArgumentParser(description="Process and recommend books by geo-location.")
     parser.add_argument(
-        '--input_file', type=str, default='data/preprocessed_files/raw_data.parquet', help='Path to the input Parquet file with ratings data.'
+        '--input_file', type=str, default=INPUT_FILE, help='Path to the input Parquet file with ratings data.'
+    )
+    parser.add_argument(
+        '--output_dir', type=str, default=os.path.dirname(ROLLUP_PATH), help='Directory to save the results.'
     )
     parser.add_argument(
-        '--output_dir', type=str, default='data/recommender_result', help='Directory to save the results.'
+        '--min_users', type=int, default=MIN_USERS, help='Distinct raters a city or state bucket needs to be used.'
     )
     return parser.parse_args()
 
@@ -91,21 +131,14 @@ def main():
     # Step 1: Parse arguments
     args = parse_args()
 
-    # Step 2: Read Parquet file
-    filtered_data = read_parquet(args.input_file)
-
-    # Step 3: Process data by location and ISBN
-    ratings_with_geo_location_data = process_geo_location_data(filtered_data)
-
-    # Step 4: Calculate weighted scores
-    weighted_ratings_data = calculate_weighted_scores(ratings_with_geo_location_data)
+    # Step 2: Read the ratings with every location level
+    ratings = read_ratings(args.input_file)
 
-    # Step 5: Get top ISBNs per location
-    top_isbn_per_location = get_top_isbn_per_location(weighted_ratings_data)
+    # Step 3: Top ISBNs per city, state and country, and the fallback index
+    rollup = build_location_rollup(ratings, min_users=args.min_users)
 
-    # Step 6: Convert to dictionary and save to JSON
-    top_isbn_dict = top_isbn_per_location.to_dict()
-    save_top_isbn_to_json(top_isbn_dict, args.output_dir)
+    # Step 4: Save the rollup
+    save_location_rollup(rollup, os.path.join(args.output_dir, os.path.basename(ROLLUP_PATH)))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,55 @@
+import os
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+import pyarrow as pa  # type: ignore
+import pyarrow.parquet as pq  # type: ignore
+from config.logging_configs import logger  # Assuming logging is already configured
+
+# Define paths
+CLUSTER_RECOMMENDATION_FILE = "cluster_recommendation.parquet"  # Inside a CF output directory
+
+def list_array(matrix: np.ndarray) -> pa.ListArray:
+    """Arrow list<int32> column from a -1 padded code matrix, one list per row."""
+    valid = matrix >= 0
+    offsets = np.zeros(len(matrix) + 1, dtype=np.int32)
+    np.cumsum(valid.sum(axis=1), out=offsets[1:])
+    return pa.ListArray.from_arrays(pa.array(offsets, type=pa.int32()), pa.array(matrix[valid], type=pa.int32()))
+
+def save_list_table(frame: pd.DataFrame, path: str) -> None:
+    """Writes a frame whose list-valued columns hold Python lists or arrays as native Parquet list columns."""
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), path)
+        logger.info(f"List table saved to {path}.")
+    except Exception as e:
+        logger.error(f"Error saving list table to {path}: {e}")
+        raise
+
+def load_lists(path: str, key_column: str, list_column: str) -> dict:
+    """key -> Python list, read from a native list column (no text parsing)."""
+    try:
+        table = pq.read_table(path, columns=[key_column, list_column])
+        return dict(zip(table[key_column].to_pylist(), table[list_column].to_pylist()))
+    except Exception as e:
+        logger.error(f"Error loading lists from {path}: {e}")
+        raise
+
+def load_list_arrays(path: str, list_column: str):
+    """(offsets, values) NumPy arrays of a list column: row i is values[offsets[i]:offsets[i + 1]]."""
+    try:
+        column = pq.read_table(path, columns=[list_column])[list_column].combine_chunks()
+        return column.offsets.to_numpy(), column.values.to_numpy(zero_copy_only=False)
+    except Exception as e:
+        logger.error(f"Error loading list arrays from {path}: {e}")
+        raise
+
+def save_cluster_recommendations(cluster_ids, isbn_lists, output_dir: str) -> None:
+    """The cluster-recommendation contract: cluster_id (int32) and isbn (list<string>)."""
+    save_list_table(pd.DataFrame({
+        'cluster_id': np.asarray(cluster_ids, dtype=np.int32),
+        'isbn': [list(isbns) for isbns in isbn_lists],
+    }), os.path.join(output_dir, CLUSTER_RECOMMENDATION_FILE))
+
+def load_cluster_recommendations(output_dir: str) -> dict:
+    """cluster_id -> ISBN list from a CF output directory."""
+    return load_lists(os.path.join(output_dir, CLUSTER_RECOMMENDATION_FILE), 'cluster_id', 'isbn')
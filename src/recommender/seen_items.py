@@ -0,0 +1,151 @@
+import os
+import json
+import shutil
+import argparse
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+from config.logging_configs import logger  # Assuming logging is already configured
+from src.data_preprocessing import id_registry
+from src.recommender.collaborative_filtering_recommender import interaction_matrix
+
+# Define paths
+RAW_PARQUET_PATH = "data/preprocessed_files/raw_data.parquet"
+SEEN_ITEMS_DIR = "data/recommender_result/seen_items"
+
+# Sources save this many times the shelf size, so shelves stay full once seen books are removed
+OVERFETCH_FACTOR = 2
+MASK_BLOCK = 1 << 20  # Seen books compared with their candidate rows per block, bounding temporary memory
+
+def fetch_size(top_k: int) -> int:
+    """Candidates a source should save for a shelf of `top_k` books."""
+    return OVERFETCH_FACTOR * top_k
+
+def build_seen_items(matrix, row_ids: np.ndarray, col_ids: np.ndarray, n_users: int) -> dict:
+    """Row-offset (CSR) layout of the ISBN codes every user has rated, keyed by user registry code.
+
+    Row `u` spans `indptr[u]:indptr[u + 1]` of `items`, sorted ascending; users without ratings
+    cost one offset. The matrix should keep explicit zeros, since a 0 rating is still a read.
+    """
+    counts = np.zeros(n_users, dtype=np.int64)
+    counts[row_ids] = np.diff(matrix.indptr)
+    indptr = np.zeros(n_users + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    # Matrix rows are in ascending user code and columns in ascending ISBN code, so rows are already sorted
+    return {'indptr': indptr, 'items': col_ids[matrix.indices].astype(np.int32)}
+
+def save_seen_items(index: dict, index_dir: str = SEEN_ITEMS_DIR) -> None:
+    """Writes one `.npy` file per array plus a small JSON header; swaps the directory in atomically."""
+    try:
+        tmp_dir = index_dir.rstrip('/') + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, array in index.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({'n_users': int(len(index['indptr']) - 1), 'n_items': int(len(index['items'])),
+                       'registry_version': id_registry.load_registry_version()}, f, indent=2)
+        shutil.rmtree(index_dir, ignore_errors=True)
+        os.replace(tmp_dir, index_dir)
+        logger.info(f"Seen-items index saved to {index_dir} ({len(index['items'])} entries).")
+    except Exception as e:
+        logger.error(f"Error saving seen-items index: {e}")
+        raise
+
+def load_seen_items(index_dir: str = SEEN_ITEMS_DIR) -> dict:
+    """Memory-maps the index read-only, so serving processes share its pages; rejects an index from another registry."""
+    try:
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            id_registry.check_registry_version(json.load(f).get('registry_version'), 'Seen-items index')
+        return {name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode='r') for name in ('indptr', 'items')}
+    except Exception as e:
+        logger.error(f"Error loading seen-items index: {e}")
+        raise
+
+def load_seen_items_if_built(index_dir: str = SEEN_ITEMS_DIR):
+    """The memory-mapped index, or None (with a warning) when it has not been built: shelves are then left unfiltered."""
+    if not os.path.isdir(index_dir):
+        logger.warning(f"No seen-items index at {index_dir}; already-rated books will not be filtered.")
+        return None
+    return load_seen_items(index_dir)
+
+def user_bounds(index: dict, user_codes: np.ndarray):
+    """(start, stop) of every user's row; unknown codes (-1 or newer than the index) get an empty row."""
+    user_codes = np.asarray(user_codes, dtype=np.int64)
+    known = (user_codes >= 0) & (user_codes < len(index['indptr']) - 1)
+    rows = np.where(known, user_codes, 0)
+    start = np.where(known, index['indptr'][rows], 0)
+    stop = np.where(known, index['indptr'][rows + 1], 0)
+    return start, stop
+
+def seen_mask(index: dict, user_codes: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """Boolean (users, candidates) mask of the candidate ISBN codes each user has already rated.
+
+    Works from the seen side: the users' rows are gathered once, only seen books that occur among
+    the candidates at all are kept (a bitmap lookup), and those few are compared with their own
+    row of candidates. Shelves share a small vocabulary, so the work follows the overlap rather
+    than users x candidates searches.
+    """
+    start, stop = user_bounds(index, user_codes)
+    lengths = stop - start
+    pair_row = np.repeat(np.arange(len(candidates)), lengths)
+    seen = np.asarray(index['items'][np.repeat(start - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))])
+
+    # -1 padding lands on the trailing slot, which is cleared again
+    in_candidates = np.zeros(max(int(candidates.max(initial=-1)), int(seen.max(initial=-1))) + 2, dtype=bool)
+    in_candidates[candidates.ravel()] = True
+    in_candidates[-1] = False
+    relevant = in_candidates[seen]
+    pair_row, seen = pair_row[relevant], seen[relevant]
+
+    mask = np.zeros(candidates.shape, dtype=bool)
+    for block in range(0, len(seen), MASK_BLOCK):
+        rows = pair_row[block:block + MASK_BLOCK]
+        hit_rows, hit_columns = np.nonzero(candidates[rows] == seen[block:block + MASK_BLOCK, None])
+        mask[rows[hit_rows], hit_columns] = True
+    return mask
+
+def filter_seen(index: dict, user_codes: np.ndarray, candidates: np.ndarray, top_k: int) -> np.ndarray:
+    """First `top_k` unseen candidates of every row, order kept, as a -1 padded (users, top_k) matrix."""
+    keep = (candidates >= 0) & ~seen_mask(index, user_codes, candidates)
+    place = np.cumsum(keep, axis=1) - 1
+    keep &= place < top_k
+    rows, columns = np.nonzero(keep)
+    filtered = np.full((len(candidates), top_k), -1, dtype=np.int32)
+    filtered[rows, place[rows, columns]] = candidates[rows, columns]
+    return filtered
+
+def unseen(index: dict, user_code: int, codes: np.ndarray, top_k: int = None) -> np.ndarray:
+    """Serve-time filter of one user's candidate ISBN codes, order kept."""
+    start, stop = user_bounds(index, [user_code])
+    codes = np.asarray(codes)
+    codes = codes[(codes >= 0) & ~np.isin(codes, np.asarray(index['items'][start[0]:stop[0]]))]
+    return codes if top_k is None else codes[:top_k]
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Build the per-user seen-items index used to filter already-read books.")
+    parser.add_argument(
+        '--input_file', type=str, default=RAW_PARQUET_PATH, help='Path to the encoded ratings Parquet file.'
+    )
+    return parser.parse_args()
+
+def main():
+    """Main executable for the seen-items index."""
+    args = parse_args()
+    try:
+        # Step 1: Build the interaction matrix, keeping 0 ratings as reads
+        ratings = pd.read_parquet(args.input_file, columns=['user_code', 'isbn_code', 'book_rating'])
+        matrix, row_ids, col_ids = interaction_matrix.build_interaction_matrix(
+            ratings['user_code'].to_numpy(), ratings['isbn_code'].to_numpy(), ratings['book_rating'].to_numpy(),
+            aggregate='max', keep_zeros=True)
+
+        # Step 2: Save the CSR arrays keyed by user registry code
+        index = build_seen_items(matrix, row_ids, col_ids, len(id_registry.load_registry('user')))
+        save_seen_items(index)
+    except Exception as e:
+        logger.error(f"An error occurred in the main process: {e}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import os
+import json
+import argparse
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+import pyarrow.dataset as ds  # type: ignore
+from config.logging_configs import logger  # Assuming logging is already configured
+from src.data_preprocessing import id_registry
+from src.recommender import seen_items
+from src.recommender.segment_popularity import sketches
+
+# Define paths
+INPUT_FILE = "data/preprocessed_files/raw_data.parquet"
+OUTPUT_DIR = "data/recommender_result"
+
+# Segment dimensions: the registry namespace whose code column defines the segment (None = one
+# global segment) and the JSON artifact written for it. Adding a dimension is one entry here.
+# Raw-location and per-level buckets are opt-in; geographic recommendations are served from the
+# city -> state -> country rollup built by geo_locational_recommender.
+DIMENSIONS = {
+    'age_group': ('age_group', 'top_isbn_per_age_group.json'),
+    'global': (None, 'top_isbn_global.json'),
+    'location': ('location', 'top_isbn_per_location.json'),
+    'city': ('city', 'top_isbn_per_city.json'),
+    'state': ('state', 'top_isbn_per_state.json'),
+    'country': ('country', 'top_isbn_per_country.json'),
+}
+DEFAULT_DIMENSIONS = ['age_group', 'global']
+
+TOP_K = 10
+FETCH_K = seen_items.fetch_size(TOP_K)  # Saved per segment, so shelves stay full after seen-item filtering
+RATING_WEIGHT = 0.8
+USER_WEIGHT = 0.2
+
+# Approximate mode: rows folded into the sketches per chunk, and candidates kept per segment
+# (as a multiple of top_k) between chunks
+CHUNK_ROWS = 250_000
+CANDIDATE_FACTOR = 4
+
+# Where approximate mode wins. The exact path holds every rating row at once, about
+# EXACT_BYTES_PER_ROW at its peak (read plus aggregation). Approximate mode holds its sketches,
+# capped at SKETCH_BUDGET of that footprint, one chunk, and CANDIDATE_FACTOR * top_k candidates
+# per segment. It is slower (every row is hashed once per sketch row) and its lists are estimates,
+# so it pays off for dimensions with few, large segments (age_group, global) once the ratings no
+# longer fit in memory comfortably, and when states saved per shard or per day are merged
+# (`--merge_from`) instead of re-reading the whole history. Dimensions with many small segments
+# (location) keep about as many candidates as the exact path has pairs and gain nothing.
+# On 1M ratings (sketch_benchmark): exact 93-104 MiB peak in 0.3-3.5 s; approximate age_group and
+# global 72-74 MiB in 0.9-1.3 s with top-k overlap 1.0, location 111 MiB in 14 s with overlap 0.40.
+EXACT_BYTES_PER_ROW = 100
+SKETCH_BUDGET = 0.25
+
+def read_ratings(file_path: str, dimensions: list) -> pd.DataFrame:
+    """One scan of the encoded ratings, with the code column of every requested dimension."""
+    try:
+        logger.info(f"Reading data from {file_path}...")
+        segment_columns = sorted({id_registry.code_column(DIMENSIONS[d][0]) for d in dimensions if DIMENSIONS[d][0]})
+        return pd.read_parquet(file_path, columns=['user_code', 'isbn_code', 'book_rating'] + segment_columns)
+    except Exception as e:
+        logger.error(f"Error reading Parquet file from {file_path}: {e}")
+        raise
+
+def segment_aggregates(segments: np.ndarray, isbn_codes: np.ndarray, user_codes: np.ndarray, ratings: np.ndarray):
+    """avg_rating and distinct-user count per (segment, book), from hashed int64 keys instead of a groupby.
+
+    Returns (segment, isbn_code, avg_rating, user_rated) arrays, one entry per distinct pair. Rows
+    with a negative (unknown) segment or ISBN code are skipped, as groupby skips missing keys.
+    """
+    valid = (segments >= 0) & (isbn_codes >= 0)
+    segments, isbn_codes, user_codes = segments[valid], isbn_codes[valid], user_codes[valid]
+    ratings = ratings[valid].astype(np.float64)
+    n_items = int(isbn_codes.max()) + 1 if len(isbn_codes) else 1
+
+    pair_keys = segments.astype(np.int64) * n_items + isbn_codes
+    slots, pairs = pd.factorize(pair_keys)
+    avg_rating = np.bincount(slots, weights=ratings, minlength=len(pairs)) / np.bincount(slots, minlength=len(pairs))
+
+    # Distinct users per pair: count the distinct (pair slot, user) combinations
+    n_users = int(user_codes.max()) + 1 if len(user_codes) else 1
+    distinct = pd.unique(slots.astype(np.int64) * n_users + user_codes)
+    user_rated = np.bincount(distinct // n_users, minlength=len(pairs))
+    return (pairs // n_items).astype(np.int32), (pairs % n_items).astype(np.int32), avg_rating, user_rated
+
+def weighted_scores(avg_rating: np.ndarray, user_rated: np.ndarray) -> np.ndarray:
+    """Popularity score of each (segment, book) pair.
+
+    Rounded so float noise in sum/count averages cannot decide ties; ties then break deterministically.
+    """
+    return np.round(RATING_WEIGHT * avg_rating + USER_WEIGHT * user_rated, 9)
+
+def top_k_per_segment(segments: np.ndarray, isbn_codes: np.ndarray, scores: np.ndarray, user_rated: np.ndarray,
+                      top_k: int = TOP_K) -> dict:
+    """Top-k ISBN codes of every segment by score (ties: more users, then lower ISBN code).
+
+    Segments are bucketed once; inside a bucket `argpartition` selects the k candidates and only those
+    k are ordered, so no full sort of the aggregate table is needed.
+    """
+    order = np.argsort(segments, kind='stable')
+    segments, isbn_codes, scores, user_rated = segments[order], isbn_codes[order], scores[order], user_rated[order]
+    unique_segments, starts = np.unique(segments, return_index=True)
+    stops = np.r_[starts[1:], len(segments)]
+    top = {}
+    for segment, start, stop in zip(unique_segments, starts, stops):
+        candidates = np.arange(start, stop)
+        if len(candidates) > top_k:
+            candidates = start + np.argpartition(-scores[start:stop], top_k - 1)[:top_k]
+            # Pull in every row tied with the k-th score, so the tie-break below sees all of them
+            threshold = scores[candidates].min()
+            candidates = start + np.flatnonzero(scores[start:stop] >= threshold)
+        ranked = candidates[np.lexsort((isbn_codes[candidates], -user_rated[candidates], -scores[candidates]))][:top_k]
+        top[int(segment)] = isbn_codes[ranked]
+    return top
+
+def segment_codes(ratings: pd.DataFrame, dimension: str) -> np.ndarray:
+    """Segment code of every rating row for one dimension (all zeros for the global dimension)."""
+    namespace = DIMENSIONS[dimension][0]
+    return (ratings[id_registry.code_column(namespace)].to_numpy() if namespace
+            else np.zeros(len(ratings), dtype=np.int32))
+
+def decode_top(top: dict, dimension: str) -> dict:
+    """Segment code -> ISBN codes, decoded to segment key (or 'global') -> ISBN list."""
+    namespace = DIMENSIONS[dimension][0]
+    isbn_registry = id_registry.load_registry('isbn')
+    segment_keys = id_registry.load_registry(namespace) if namespace else None
+    return {
+        (str(segment_keys[segment]) if namespace else 'global'): list(id_registry.decode(isbn_registry, codes))
+        for segment, codes in top.items()
+    }
+
+def segment_popularity(ratings: pd.DataFrame, dimension: str, top_k: int = TOP_K) -> dict:
+    """Top ISBNs per segment of one dimension, keyed by the decoded segment (or 'global')."""
+    try:
+        logger.info(f"Computing segment popularity for '{dimension}'...")
+        segments, isbn_codes, avg_rating, user_rated = segment_aggregates(
+            segment_codes(ratings, dimension), ratings['isbn_code'].to_numpy(),
+            ratings['user_code'].to_numpy(), ratings['book_rating'].to_numpy())
+        scores = weighted_scores(avg_rating, user_rated)
+        result = decode_top(top_k_per_segment(segments, isbn_codes, scores, user_rated, top_k), dimension)
+        logger.info(f"Top ISBNs selected for {len(result)} '{dimension}' segments.")
+        return result
+    except Exception as e:
+        logger.error(f"Error computing segment popularity for '{dimension}': {e}")
+        raise
+
+def rank_candidates(state: dict, keys: np.ndarray, top_n: int) -> dict:
+    """Top `top_n` ISBN codes per segment among candidate pair keys, by sketch estimates."""
+    n_items = int(state['n_items'])
+    avg_rating, user_rated = sketches.estimates(state, keys)
+    return top_k_per_segment(keys // n_items, keys % n_items, weighted_scores(avg_rating, user_rated), user_rated, top_n)
+
+def prune_candidates(state: dict, keys: np.ndarray, top_n: int) -> np.ndarray:
+    """Pair keys of the `top_n` best estimated candidates of every segment."""
+    top = rank_candidates(state, keys, top_n)
+    n_items = int(state['n_items'])
+    return np.concatenate([segment * n_items + codes for segment, codes in top.items()] or [np.empty(0, dtype=np.int64)])
+
+def sketch_widths(dimension: str, n_rows: int, n_items: int, merge_from: list = ()):
+    """(count-min width, HyperLogLog grid width) for a dimension.
+
+    Sized from the expected number of (segment, book) pairs: at most one per rating row, and
+    at most segments x books; then narrowed until the sketches take at most SKETCH_BUDGET of the
+    exact path's footprint. States that will be merged must share sizes, so with `merge_from`
+    the widths of the first saved state are reused.
+    """
+    if merge_from:
+        with np.load(os.path.join(merge_from[0], f"{dimension}.npz")) as data:
+            return int(data['count'].shape[1]), int(data['raters'].shape[1])
+    namespace = DIMENSIONS[dimension][0]
+    n_segments = len(id_registry.load_registry(namespace)) if namespace else 1
+    expected_keys = min(n_rows, n_segments * n_items)
+    return sketches.fit_widths(sketches.cms_width(expected_keys), sketches.hll_width(expected_keys),
+                               SKETCH_BUDGET * EXACT_BYTES_PER_ROW * n_rows)
+
+def approximate_popularity(file_path: str, dimensions: list, top_k: int = TOP_K, chunk_rows: int = CHUNK_ROWS,
+                           sketch_dir: str = None, merge_from: list = ()) -> dict:
+    """Sketch-based segment popularity in a fraction of the exact path's memory.
+
+    Ratings stream through in chunks of `chunk_rows`. Per dimension, count-min sketches hold
+    rating counts and sums and a HyperLogLog grid, both sized by `sketch_widths`, holds distinct raters
+    (see `sketches` for the error bounds). Only the `CANDIDATE_FACTOR * top_k` best pairs per segment are kept between
+    chunks. States saved under `sketch_dir` can be merged into later runs with `merge_from`.
+    """
+    try:
+        logger.info(f"Computing approximate segment popularity for {dimensions} in chunks of {chunk_rows} rows...")
+        n_items = len(id_registry.load_registry('isbn'))
+        candidates_per_segment = CANDIDATE_FACTOR * top_k
+        dataset = ds.dataset(file_path, format='parquet')
+        n_rows = dataset.count_rows()
+        states = {}
+        for dimension in dimensions:
+            cms_width, hll_width = sketch_widths(dimension, n_rows, n_items, merge_from)
+            states[dimension] = sketches.empty_state(n_items, cms_width=cms_width, hll_width=hll_width)
+        segment_columns = sorted({id_registry.code_column(DIMENSIONS[d][0]) for d in dimensions if DIMENSIONS[d][0]})
+        for batch in dataset.to_batches(columns=['user_code', 'isbn_code', 'book_rating'] + segment_columns,
+                                        batch_size=chunk_rows):
+            chunk = batch.to_pandas()
+            isbn_codes = chunk['isbn_code'].to_numpy()
+            for dimension, state in states.items():
+                segments = segment_codes(chunk, dimension)
+                valid = (segments >= 0) & (isbn_codes >= 0)
+                keys = segments[valid].astype(np.int64) * n_items + isbn_codes[valid]
+                sketches.add_ratings(state, keys, chunk['user_code'].to_numpy()[valid], chunk['book_rating'].to_numpy()[valid])
+                state['candidates'] = prune_candidates(state, np.union1d(state['candidates'], keys), candidates_per_segment)
+
+        results = {}
+        for dimension, state in states.items():
+            if sketch_dir:
+                os.makedirs(sketch_dir, exist_ok=True)
+                sketches.save_state(state, os.path.join(sketch_dir, f"{dimension}.npz"))
+            for other_dir in merge_from:
+                state = sketches.merge_states(state, sketches.load_state(os.path.join(other_dir, f"{dimension}.npz")))
+            results[dimension] = decode_top(rank_candidates(state, state['candidates'], top_k), dimension)
+            logger.info(f"Approximate top ISBNs selected for {len(results[dimension])} '{dimension}' segments "
+                        f"({sketches.state_nbytes(state) / 2**20:.1f} MiB of sketches).")
+        return results
+    except Exception as e:
+        logger.error(f"Error computing approximate segment popularity: {e}")
+        raise
+
+def save_top_isbn_to_json(top_isbn_dict: dict, dimension: str, output_dir: str = OUTPUT_DIR) -> None:
+    """Saves the top ISBNs per segment of one dimension to its JSON artifact."""
+    try:
+        os.makedirs(output_dir, exist_ok=True)  # Ensure output directory exists
+        output_file_path = os.path.join(output_dir, DIMENSIONS[dimension][1])
+        with open(output_file_path, "w") as json_file:
+            json.dump(top_isbn_dict, json_file)
+        logger.info(f"Top ISBNs saved to {output_file_path} successfully.")
+    except Exception as e:
+        logger.error(f"Error saving top ISBNs to JSON: {e}")
+        raise
+
+def run(dimensions: list, input_file: str = INPUT_FILE, output_dir: str = OUTPUT_DIR, top_k: int = FETCH_K,
+        approximate: bool = False, chunk_rows: int = CHUNK_ROWS, sketch_dir: str = None, merge_from: list = ()) -> None:
+    """Grouping-sets style run: one read, then one aggregation per requested dimension."""
+    if approximate:
+        for dimension, result in approximate_popularity(input_file, dimensions, top_k, chunk_rows, sketch_dir, merge_from).items():
+            save_top_isbn_to_json(result, dimension, output_dir)
+        return
+    save_segment_popularity(read_ratings(input_file, dimensions), dimensions, output_dir, top_k)
+
+def save_segment_popularity(ratings: pd.DataFrame, dimensions: list, output_dir: str = OUTPUT_DIR, top_k: int = FETCH_K) -> None:
+    """Computes and saves every requested dimension from an already-read ratings frame."""
+    for dimension in dimensions:
+        save_top_isbn_to_json(segment_popularity(ratings, dimension, top_k), dimension, output_dir)
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Recommend popular books per segment for several segment dimensions in one pass.")
+    parser.add_argument(
+        '--dimensions', nargs='+', choices=list(DIMENSIONS), default=DEFAULT_DIMENSIONS, help='Segment dimensions to compute.'
+    )
+    parser.add_argument(
+        '--input_file', type=str, default=INPUT_FILE, help='Path to the input Parquet file with ratings data.'
+    )
+    parser.add_argument(
+        '--output_dir', type=str, default=OUTPUT_DIR, help='Directory to save the results.'
+    )
+    parser.add_argument(
+        '--approximate', action='store_true', help='Use count-min and HyperLogLog sketches instead of exact aggregates.'
+    )
+    parser.add_argument(
+        '--chunk_rows', type=int, default=CHUNK_ROWS, help='Rows per chunk in approximate mode.'
+    )
+    parser.add_argument(
+        '--sketch_dir', type=str, default=None, help='Directory to save the sketch state of this run (approximate mode).'
+    )
+    parser.add_argument(
+        '--merge_from', type=str, nargs='*', default=[], help='Sketch directories of other shards or days to merge in (approximate mode).'
+    )
+    return parser.parse_args()
+
+def main():
+    """Main function to compute every segment dimension from a single scan."""
+    args = parse_args()
+    run(args.dimensions, args.input_file, args.output_dir, approximate=args.approximate, chunk_rows=args.chunk_rows,
+        sketch_dir=args.sketch_dir, merge_from=args.merge_from)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import time
+import argparse
+import tracemalloc
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+import pyarrow.dataset as ds  # type: ignore
+from config.logging_configs import logger  # Assuming logging is already configured
+from src.data_preprocessing import id_registry
+from src.recommender.segment_popularity import segment_popularity, sketches
+
+# Define paths
+REPORT_PATH = "data/recommender_result/sketch_benchmark.csv"
+
+BENCHMARK_DIMENSIONS = ['age_group', 'location', 'global']
+
+def timed(function, *args):
+    """Runs `function(*args)`, returning (result, seconds, peak traced memory in MiB)."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 2**20
+
+def exact_popularity(file_path: str, dimension: str, top_k: int) -> dict:
+    """The exact path for one dimension, read included, as `approximate_popularity` includes its scan."""
+    return segment_popularity.segment_popularity(segment_popularity.read_ratings(file_path, [dimension]), dimension, top_k)
+
+def top_k_overlap(exact: dict, approximate: dict) -> float:
+    """Mean fraction of each segment's exact top-k that the approximate top-k also contains."""
+    return float(np.mean([
+        len(set(isbns) & set(approximate.get(segment, []))) / len(isbns) for segment, isbns in exact.items() if isbns
+    ]))
+
+def benchmark(file_path: str, dimensions: list, top_k: int = segment_popularity.TOP_K,
+              chunk_rows: int = segment_popularity.CHUNK_ROWS) -> pd.DataFrame:
+    """Exact vs approximate time, peak memory and top-k overlap, one dimension at a time."""
+    try:
+        n_items = len(id_registry.load_registry('isbn'))
+        n_rows = ds.dataset(file_path, format='parquet').count_rows()
+        rows = []
+        for dimension in dimensions:
+            logger.info(f"Benchmarking '{dimension}'...")
+            sketch_mb = sketches.state_nbytes_for(*segment_popularity.sketch_widths(dimension, n_rows, n_items)) / 2**20
+            exact, exact_seconds, exact_peak = timed(exact_popularity, file_path, dimension, top_k)
+            approximate, approximate_seconds, approximate_peak = timed(
+                segment_popularity.approximate_popularity, file_path, [dimension], top_k, chunk_rows)
+            rows.append({
+                'dimension': dimension,
+                'segments': len(exact),
+                'top_k_overlap': round(top_k_overlap(exact, approximate[dimension]), 4),
+                'exact_seconds': round(exact_seconds, 3),
+                'approximate_seconds': round(approximate_seconds, 3),
+                'exact_peak_mb': round(exact_peak, 1),
+                'approximate_peak_mb': round(approximate_peak, 1),
+                'sketch_mb': round(sketch_mb, 1),
+            })
+        return pd.DataFrame(rows)
+    except Exception as e:
+        logger.error(f"Error benchmarking segment sketches: {e}")
+        raise
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark approximate (sketch) against exact segment popularity.")
+    parser.add_argument(
+        '--dimensions', nargs='+', choices=list(segment_popularity.DIMENSIONS), default=BENCHMARK_DIMENSIONS,
+        help='Segment dimensions to benchmark.'
+    )
+    parser.add_argument(
+        '--input_file', type=str, default=segment_popularity.INPUT_FILE, help='Path to the input Parquet file with ratings data.'
+    )
+    parser.add_argument(
+        '--chunk_rows', type=int, default=segment_popularity.CHUNK_ROWS, help='Rows per chunk in approximate mode.'
+    )
+    return parser.parse_args()
+
+def main():
+    """Main executable for the sketch benchmark."""
+    args = parse_args()
+    try:
+        # Step 1: Run both paths per dimension
+        report = benchmark(args.input_file, args.dimensions, chunk_rows=args.chunk_rows)
+
+        # Step 2: Save the report
+        report.to_csv(REPORT_PATH, index=False)
+        logger.info(f"Sketch benchmark saved to {REPORT_PATH}:\n{report.to_string(index=False)}")
+    except Exception as e:
+        logger.error(f"An error occurred in the main process: {e}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import numpy as np  # type: ignore
+from config.logging_configs import logger  # Assuming logging is already configured
+
+# Sketch sizes. Count-min: estimates never undercount, and overcount by at most (e / width) * N
+# (N = total weight added) with probability 1 - exp(-CMS_DEPTH); with width >= the number of keys
+# that is about e times the average weight per key. `cms_width` sizes the table from the expected keys.
+# HyperLogLog grid: two errors add up. (1) Collisions: a cell counts the distinct users of every
+# key hashed to it, so a key's estimate never undercounts (up to HLL noise) and overcounts by at
+# most (e / width) * D, D = distinct (key, user) pairs added, with probability 1 - exp(-HLL_DEPTH);
+# with width >= the number of keys a key shares each cell with one other key on average.
+# (2) HLL noise: 2**HLL_PRECISION one-byte registers per cell give a relative standard error of
+# 1.04 / sqrt(2**HLL_PRECISION) (13% at precision 6); small cardinalities use linear counting
+# and are close to exact. `hll_width` sizes the grid from the expected number of keys.
+# Per unit of width the two count-min tables cost 2 * CMS_DEPTH * 8 bytes and the grid
+# HLL_DEPTH * 2**HLL_PRECISION bytes; `fit_widths` halves both until the state fits a byte budget.
+CMS_WIDTH = 2**16
+CMS_MIN_WIDTH = 2**10
+CMS_MAX_WIDTH = 2**22  # 256 MiB of counters at depth 4
+CMS_DEPTH = 4
+HLL_WIDTH = 2**14
+HLL_MIN_WIDTH = 2**10
+HLL_MAX_WIDTH = 2**20  # 128 MiB of registers at depth 2 and precision 6
+HLL_DEPTH = 2
+HLL_PRECISION = 6
+QUERY_BLOCK = 1 << 16  # Keys estimated per block, bounding the (keys, 2**precision) temporaries
+
+_GOLDEN = 0x9E3779B97F4A7C15
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+def hash64(keys, seed: int = 0) -> np.ndarray:
+    """splitmix64 of integer keys; a different seed gives an independent hash."""
+    x = np.asarray(keys).astype(np.uint64) + np.uint64(_GOLDEN * (seed + 1) % 2**64)
+    x = (x ^ (x >> np.uint64(30))) * _MIX_1
+    x = (x ^ (x >> np.uint64(27))) * _MIX_2
+    return x ^ (x >> np.uint64(31))
+
+def _buckets(keys: np.ndarray, row: int, width: int) -> np.ndarray:
+    """Column of every key in one sketch row."""
+    return (hash64(keys, row) % np.uint64(width)).astype(np.int64)
+
+def count_min(width: int = CMS_WIDTH, depth: int = CMS_DEPTH) -> np.ndarray:
+    """Empty count-min sketch: a (depth, width) table of weight sums."""
+    return np.zeros((depth, width), dtype=np.float64)
+
+def count_min_add(table: np.ndarray, keys: np.ndarray, weights=None) -> None:
+    """Adds `weights` (default 1 each) for `keys` in place."""
+    depth, width = table.shape
+    for row in range(depth):
+        table[row] += np.bincount(_buckets(keys, row, width), weights=weights, minlength=width)
+
+def count_min_query(table: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """Estimated total weight of every key (minimum over the rows it hashes to)."""
+    depth, width = table.shape
+    return np.min([table[row][_buckets(keys, row, width)] for row in range(depth)], axis=0)
+
+def sketch_width(expected_keys: int, min_width: int, max_width: int) -> int:
+    """Width for `expected_keys` distinct keys: the next power of two at or above it, clipped to [min_width, max_width]."""
+    return int(min(max_width, max(min_width, 1 << max(int(expected_keys) - 1, 0).bit_length())))
+
+def cms_width(expected_keys: int, min_width: int = CMS_MIN_WIDTH, max_width: int = CMS_MAX_WIDTH) -> int:
+    """Count-min width for `expected_keys` distinct keys."""
+    return sketch_width(expected_keys, min_width, max_width)
+
+def hll_width(expected_keys: int, min_width: int = HLL_MIN_WIDTH, max_width: int = HLL_MAX_WIDTH) -> int:
+    """HyperLogLog grid width for `expected_keys` distinct keys."""
+    return sketch_width(expected_keys, min_width, max_width)
+
+def state_nbytes_for(cms_width: int, hll_width: int, cms_depth: int = CMS_DEPTH, hll_depth: int = HLL_DEPTH,
+                     precision: int = HLL_PRECISION) -> int:
+    """Memory of the sketches of a state with these sizes."""
+    return 2 * cms_depth * cms_width * 8 + hll_depth * hll_width * 2**precision
+
+def fit_widths(cms_width: int, hll_width: int, budget_bytes: float):
+    """Halves both widths (down to their minimum) until the sketches fit `budget_bytes`.
+
+    Narrower sketches trade accuracy for memory: more keys share each counter and each grid cell.
+    """
+    while state_nbytes_for(cms_width, hll_width) > budget_bytes and (cms_width > CMS_MIN_WIDTH or hll_width > HLL_MIN_WIDTH):
+        cms_width, hll_width = max(CMS_MIN_WIDTH, cms_width // 2), max(HLL_MIN_WIDTH, hll_width // 2)
+    return cms_width, hll_width
+
+def hll_grid(width: int = HLL_WIDTH, depth: int = HLL_DEPTH, precision: int = HLL_PRECISION) -> np.ndarray:
+    """Empty count-min grid of HyperLogLog cells: (depth, width, 2**precision) uint8 registers.
+
+    Each key hashes to one cell per row; a cell counts the distinct items of every key sharing it,
+    so the minimum over rows is the least-collided estimate, as in count-min.
+    """
+    return np.zeros((depth, width, 2**precision), dtype=np.uint8)
+
+def hll_grid_add(registers: np.ndarray, keys: np.ndarray, items: np.ndarray) -> None:
+    """Records that each key saw the matching item, in place."""
+    depth, width, m = registers.shape
+    precision = int(np.log2(m))
+    item_hash = hash64(items, seed=depth + 1)
+    slot = (item_hash >> np.uint64(64 - precision)).astype(np.int64)
+    # Rank = leading zeros + 1 of the low 32 bits; frexp gives the exact bit length of 32-bit values
+    _, bit_length = np.frexp((item_hash & np.uint64(0xFFFFFFFF)).astype(np.float64))
+    rank = (33 - bit_length).astype(np.uint8)
+    for row in range(depth):
+        np.maximum.at(registers[row], (_buckets(keys, row, width), slot), rank)
+
+def hll_estimate(registers: np.ndarray) -> np.ndarray:
+    """Distinct-count estimate of each register vector along the last axis."""
+    m = registers.shape[-1]
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int32)), axis=-1)
+    zeros = np.count_nonzero(registers == 0, axis=-1)
+    small = (estimate <= 2.5 * m) & (zeros > 0)
+    estimate[small] = m * np.log(m / zeros[small])
+    return estimate
+
+def hll_grid_query(registers: np.ndarray, keys: np.ndarray, block_size: int = QUERY_BLOCK) -> np.ndarray:
+    """Estimated distinct items of every key (minimum over the cells it hashes to).
+
+    Distinct keys are estimated once, `block_size` at a time, so the gathered registers and the
+    estimator temporaries stay bounded whatever the number of keys.
+    """
+    depth, width, _ = registers.shape
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    estimated = np.empty(len(unique_keys), dtype=np.float64)
+    for start in range(0, len(unique_keys), block_size):
+        block = unique_keys[start:start + block_size]
+        estimated[start:start + len(block)] = np.min([
+            hll_estimate(registers[row][_buckets(block, row, width)]) for row in range(depth)
+        ], axis=0)
+    return estimated[inverse.ravel()]
+
+def empty_state(n_items: int, cms_width: int = CMS_WIDTH, cms_depth: int = CMS_DEPTH,
+                hll_width: int = HLL_WIDTH, hll_depth: int = HLL_DEPTH, precision: int = HLL_PRECISION) -> dict:
+    """Sketch state of one segment dimension, keyed by (segment * n_items + isbn_code).
+
+    `count` and `total` are count-min sketches of rating counts and rating sums, `raters` the
+    HyperLogLog grid of distinct users, and `candidates` the bounded set of pair keys that can
+    still reach a segment's top-k.
+    """
+    return {
+        'n_items': np.int64(n_items),
+        'count': count_min(cms_width, cms_depth),
+        'total': count_min(cms_width, cms_depth),
+        'raters': hll_grid(hll_width, hll_depth, precision),
+        'candidates': np.empty(0, dtype=np.int64),
+    }
+
+def add_ratings(state: dict, keys: np.ndarray, user_codes: np.ndarray, ratings: np.ndarray) -> None:
+    """Folds one chunk of (pair key, user, rating) rows into the sketches."""
+    count_min_add(state['count'], keys)
+    count_min_add(state['total'], keys, ratings.astype(np.float64))
+    hll_grid_add(state['raters'], keys, user_codes)
+
+def estimates(state: dict, keys: np.ndarray):
+    """(avg_rating, user_rated) estimates for pair keys; distinct raters never exceed the rating count."""
+    count = np.maximum(count_min_query(state['count'], keys), 1.0)
+    avg_rating = count_min_query(state['total'], keys) / count
+    user_rated = np.minimum(np.rint(hll_grid_query(state['raters'], keys)), count)
+    return avg_rating, user_rated
+
+def merge_states(left: dict, right: dict) -> dict:
+    """Merges two states of the same dimension and sizes (other shards, other days).
+
+    Count-min tables add, HyperLogLog registers take the maximum and candidate sets union;
+    the result is the state of the combined input.
+    """
+    if int(left['n_items']) != int(right['n_items']) or any(
+            left[name].shape != right[name].shape for name in ('count', 'total', 'raters')):
+        raise ValueError("Sketch states differ in item count or sketch sizes and cannot be merged.")
+    return {
+        'n_items': left['n_items'],
+        'count': left['count'] + right['count'],
+        'total': left['total'] + right['total'],
+        'raters': np.maximum(left['raters'], right['raters']),
+        'candidates': np.union1d(left['candidates'], right['candidates']),
+    }
+
+def save_state(state: dict, path: str) -> None:
+    """Saves a sketch state to one compressed .npz file."""
+    try:
+        np.savez_compressed(path, **state)
+        logger.info(f"Sketch state saved to {path}.")
+    except Exception as e:
+        logger.error(f"Error saving sketch state to {path}: {e}")
+        raise
+
+def load_state(path: str) -> dict:
+    """Loads a state saved by `save_state`."""
+    try:
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    except Exception as e:
+        logger.error(f"Error loading sketch state from {path}: {e}")
+        raise
+
+def state_nbytes(state: dict) -> int:
+    """Memory held by a sketch state."""
+    return sum(np.asarray(value).nbytes for value in state.values())
@@ -0,0 +1,66 @@
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+import pytest  # type: ignore
+from src.data_preprocessing import id_registry
+from src.recommender.segment_popularity import segment_popularity, trending
+
+TOP_K = 5
+USER_INFO_PATH = 'users.parquet'
+
+@pytest.fixture
+def ratings(tmp_path, monkeypatch):
+    """A small encoded ratings table, with its registries and user info written under a temporary data directory."""
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(7)
+    n_users, n_items, n_rows = 60, 40, 900
+    id_registry.save_registry({
+        'isbn': id_registry.key_index([f"{code:010d}" for code in range(n_items)], 'isbn'),
+        'user': id_registry.key_index(np.arange(n_users), 'user_id'),
+        'age_group': id_registry.key_index(id_registry.AGE_GROUPS, 'age_group'),
+    })
+    age_group_of_user = rng.integers(0, len(id_registry.AGE_GROUPS), n_users).astype(np.int32)
+    pd.DataFrame({'user_code': np.arange(n_users, dtype=np.int32), 'age_group_code': age_group_of_user}).to_parquet(USER_INFO_PATH)
+    pairs = np.unique(rng.integers(0, n_users * n_items, n_rows))
+    user_codes = (pairs // n_items).astype(np.int32)
+    return pd.DataFrame({
+        'user_code': user_codes,
+        'isbn_code': (pairs % n_items).astype(np.int32),
+        'book_rating': rng.integers(0, 11, len(pairs)),
+        'age_group_code': age_group_of_user[user_codes],
+    }).sample(frac=1, random_state=7).reset_index(drop=True)
+
+def apply_in_batches(ratings: pd.DataFrame, n_batches: int, dimensions: list) -> dict:
+    state = trending.empty_state(dimensions, 0.0)
+    for batch in np.array_split(np.arange(len(ratings)), n_batches):
+        trending.apply_batch(state, ratings.iloc[batch], 0.0, half_life_hours=0, top_k=TOP_K, user_info_path=USER_INFO_PATH)
+    return state
+
+@pytest.mark.parametrize('n_batches', [1, 4])
+def test_trending_matches_batch_without_decay(ratings, n_batches):
+    dimensions = ['age_group', 'global']
+    state = apply_in_batches(ratings, n_batches, dimensions)
+    for dimension in dimensions:
+        assert trending.top_isbns(state, dimension, TOP_K) == segment_popularity.segment_popularity(ratings, dimension, TOP_K)
+
+def test_changed_rating_replaces_the_earlier_one(ratings):
+    changed = ratings.iloc[:50].assign(book_rating=lambda frame: (frame['book_rating'] + 3) % 11)
+    state = apply_in_batches(ratings, 1, ['global'])
+    trending.apply_batch(state, changed, 0.0, half_life_hours=0, top_k=TOP_K, user_info_path=USER_INFO_PATH)
+    expected = pd.concat([changed, ratings.iloc[50:]])
+    assert trending.top_isbns(state, 'global', TOP_K) == segment_popularity.segment_popularity(expected, 'global', TOP_K)
+
+def test_pairs_outside_the_candidates_overtake_lowered_candidates(ratings):
+    state = apply_in_batches(ratings, 1, ['global'])
+    n_items = int(state['n_items'])
+    lowered = ratings[np.isin(ratings['isbn_code'], state['global_candidates'] % n_items)].assign(book_rating=0)
+    trending.apply_batch(state, lowered, 0.0, half_life_hours=0, top_k=TOP_K, user_info_path=USER_INFO_PATH)
+    expected = pd.concat([lowered, ratings.drop(lowered.index)])
+    assert trending.top_isbns(state, 'global', TOP_K) == segment_popularity.segment_popularity(expected, 'global', TOP_K)
+
+def test_state_from_another_registry_is_rejected(ratings):
+    state = apply_in_batches(ratings, 1, ['global'])
+    trending.save_state(state, 'state/trending.npz')
+    isbns = id_registry.load_registry('isbn')
+    id_registry.save_registry({'isbn': id_registry.key_index(['0000000000X', *isbns], 'isbn')})
+    with pytest.raises(ValueError):
+        trending.load_state('state/trending.npz')
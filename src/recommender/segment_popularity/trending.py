@@ -0,0 +1,260 @@
+import os
+import time
+import argparse
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+from config.logging_configs import logger  # Assuming logging is already configured
+from src.data_preprocessing import id_registry
+from src.recommender.collaborative_filtering_recommender.incremental_similarity import read_deltas
+from src.recommender.segment_popularity import segment_popularity
+
+# Define paths
+STATE_PATH = "data/recommender_result/trending_state.npz"
+USER_INFO_PATH = "data/preprocessed_files/distinct_user_age_location.parquet"
+
+TOP_K = segment_popularity.FETCH_K
+CANDIDATE_FACTOR = segment_popularity.CANDIDATE_FACTOR
+HALF_LIFE_HOURS = 0.0  # 0 disables decay: scores then equal the full-history batch scores
+
+def empty_state(dimensions: list, as_of: float) -> dict:
+    """Running per-(segment, isbn) sums for every dimension, expressed as of time `as_of`.
+
+    Per dimension, `keys` are sorted pair keys (segment * n_items + isbn_code) with aligned
+    `total` (rating sum), `count` (ratings) and `raters` (distinct users) arrays, and
+    `candidates` holds the pair keys of the bounded per-segment top lists. `seen` holds the
+    sorted (user, book) keys already counted, shared by all dimensions, with the rating each one
+    last contributed (`seen_rating`) and when (`seen_time`), so a changed rating replaces the old one.
+    `n_items` and `registry_version` pin the codes to the registry the state was bootstrapped from.
+    """
+    state = {'as_of': np.float64(as_of), 'n_items': np.int64(len(id_registry.load_registry('isbn'))),
+             'registry_version': np.str_(id_registry.load_registry_version()),
+             'seen': np.empty(0, dtype=np.int64), 'seen_rating': np.empty(0, dtype=np.float64),
+             'seen_time': np.empty(0, dtype=np.float64)}
+    for dimension in dimensions:
+        state[f"{dimension}_keys"] = np.empty(0, dtype=np.int64)
+        state[f"{dimension}_candidates"] = np.empty(0, dtype=np.int64)
+        for name in ('total', 'count', 'raters'):
+            state[f"{dimension}_{name}"] = np.empty(0, dtype=np.float64)
+    return state
+
+def state_dimensions(state: dict) -> list:
+    """Dimensions a state tracks."""
+    return [name[:-len('_keys')] for name in state if name.endswith('_keys')]
+
+def save_state(state: dict, path: str = STATE_PATH) -> None:
+    """Saves the trending state to one .npz file."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, **state)
+        logger.info(f"Trending state saved to {path}.")
+    except Exception as e:
+        logger.error(f"Error saving trending state: {e}")
+        raise
+
+def load_state(path: str = STATE_PATH) -> dict:
+    """Loads a state saved by `save_state`; a state keyed by another registry's codes is rejected."""
+    try:
+        with np.load(path) as data:
+            state = {name: data[name] for name in data.files}
+        id_registry.check_registry_version(state.get('registry_version'), 'Trending state (re-run with --bootstrap)')
+        return state
+    except Exception as e:
+        logger.error(f"Error loading trending state from {path}: {e}")
+        raise
+
+def decay_weight(elapsed_seconds, half_life_hours: float = HALF_LIFE_HOURS):
+    """Weight left after `elapsed_seconds` of decay (1 when decay is disabled)."""
+    elapsed_seconds = np.asarray(elapsed_seconds, dtype=np.float64)
+    if half_life_hours <= 0:
+        return np.ones_like(elapsed_seconds)
+    return 0.5 ** (elapsed_seconds / 3600 / half_life_hours)
+
+def decay(state: dict, now: float, half_life_hours: float = HALF_LIFE_HOURS) -> bool:
+    """Brings every running sum to time `now`, halving weight every `half_life_hours`.
+
+    avg_rating (total / count) is unchanged by decay; user_rated shrinks, so books that stop
+    being rated fall behind books rated recently. That changes the order of pairs under the
+    weighted score, so when this returns True every segment has to be re-ranked.
+    """
+    decayed = half_life_hours > 0 and now > state['as_of']
+    if decayed:
+        factor = float(decay_weight(now - float(state['as_of']), half_life_hours))
+        for dimension in state_dimensions(state):
+            for name in ('total', 'count', 'raters'):
+                state[f"{dimension}_{name}"] *= factor
+    state['as_of'] = np.float64(max(now, float(state['as_of'])))
+    return decayed
+
+def segment_lookup(dimension: str, n_users: int, user_info_path: str = USER_INFO_PATH) -> np.ndarray:
+    """Segment code of every user code for one dimension, with a trailing -1 for code -1."""
+    namespace = segment_popularity.DIMENSIONS[dimension][0]
+    lookup = np.full(n_users + 1, -1 if namespace else 0, dtype=np.int32)
+    lookup[-1] = -1
+    if namespace:
+        users = pd.read_parquet(user_info_path, columns=['user_code', id_registry.code_column(namespace)])
+        lookup[users['user_code'].to_numpy()] = users[id_registry.code_column(namespace)].to_numpy()
+    return lookup
+
+def _locate(sorted_keys: np.ndarray, keys: np.ndarray):
+    """Insertion positions of `keys` in `sorted_keys`, and which keys are already there."""
+    positions = np.searchsorted(sorted_keys, keys)
+    present = np.zeros(len(keys), dtype=bool)
+    inside = positions < len(sorted_keys)
+    present[inside] = sorted_keys[positions[inside]] == keys[inside]
+    return positions, present
+
+def pair_values(state: dict, dimension: str, keys: np.ndarray):
+    """(avg_rating, user_rated) of pair keys that are present in the state."""
+    positions = np.searchsorted(state[f"{dimension}_keys"], keys)
+    count = state[f"{dimension}_count"][positions]
+    avg_rating = np.divide(state[f"{dimension}_total"][positions], count, out=np.zeros_like(count), where=count > 0)
+    return avg_rating, state[f"{dimension}_raters"][positions]
+
+def pair_scores(state: dict, dimension: str, keys: np.ndarray) -> np.ndarray:
+    """Current weighted score of pair keys that are present in the state."""
+    return segment_popularity.weighted_scores(*pair_values(state, dimension, keys))
+
+def ranked(state: dict, dimension: str, keys: np.ndarray, top_n: int) -> dict:
+    """Top `top_n` ISBN codes per segment among pair keys, by current score."""
+    n_items = int(state['n_items'])
+    avg_rating, user_rated = pair_values(state, dimension, keys)
+    return segment_popularity.top_k_per_segment(
+        keys // n_items, keys % n_items, segment_popularity.weighted_scores(avg_rating, user_rated), user_rated, top_n)
+
+def apply_batch(state: dict, batch: pd.DataFrame, now: float, half_life_hours: float = HALF_LIFE_HOURS,
+                top_k: int = TOP_K, user_info_path: str = USER_INFO_PATH) -> None:
+    """Folds one encoded rating batch (user_code, isbn_code, book_rating) into the state in place.
+
+    Without decay a touched segment is re-ranked over its kept candidates plus the pairs the
+    batch changed, so the cost follows the batch size rather than the history, as long as scores
+    only rise. When the batch lowers the score of one of a segment's candidates, pairs outside
+    the candidate set may now overtake it, so that segment is re-ranked over all of its pairs.
+    A decay step reorders untouched pairs as well, so then every segment is re-ranked over all
+    of its pairs. Either way the lists equal a recompute over the full history. A rating for an already-counted (user, book) replaces the earlier one:
+    what is left of the earlier contribution after decay is subtracted. Within a batch the last
+    rating of a (user, book) wins.
+    """
+    try:
+        decayed = decay(state, now, half_life_hours)
+        as_of = float(state['as_of'])
+        n_items = int(state['n_items'])
+
+        # One row per (user, book), in key order, holding its last rating in the batch
+        batch_keys = batch['user_code'].to_numpy().astype(np.int64) * n_items + batch['isbn_code'].to_numpy().astype(np.int64)
+        seen_keys, last = np.unique(batch_keys[::-1], return_index=True)
+        rows = len(batch_keys) - 1 - last
+        user_codes = batch['user_code'].to_numpy()[rows]
+        isbn_codes = batch['isbn_code'].to_numpy().astype(np.int64)[rows]
+        ratings = batch['book_rating'].to_numpy().astype(np.float64)[rows]
+
+        # Replace earlier contributions of (user, book) pairs already counted
+        at, known = _locate(state['seen'], seen_keys)
+        old_weight = np.zeros(len(seen_keys))
+        old_rating = np.zeros(len(seen_keys))
+        old_weight[known] = decay_weight(as_of - state['seen_time'][at[known]], half_life_hours)
+        old_rating[known] = state['seen_rating'][at[known]]
+        delta = {'total': ratings - old_weight * old_rating, 'count': 1.0 - old_weight, 'raters': 1.0 - old_weight}
+
+        state['seen_rating'][at[known]] = ratings[known]
+        state['seen_time'][at[known]] = as_of
+        state['seen'] = np.insert(state['seen'], at[~known], seen_keys[~known])
+        state['seen_rating'] = np.insert(state['seen_rating'], at[~known], ratings[~known])
+        state['seen_time'] = np.insert(state['seen_time'], at[~known], as_of)
+
+        n_users = len(id_registry.load_registry('user'))
+        for dimension in state_dimensions(state):
+            segments = segment_lookup(dimension, n_users, user_info_path)[user_codes]
+            valid = segments >= 0
+            pair_keys, slots = np.unique(segments[valid].astype(np.int64) * n_items + isbn_codes[valid], return_inverse=True)
+            added = {name: np.bincount(slots, weights=values[valid], minlength=len(pair_keys)) for name, values in delta.items()}
+
+            # Merge into the sorted running sums: add to existing pairs, insert the new ones
+            keys = state[f"{dimension}_keys"]
+            at, exists = _locate(keys, pair_keys)
+            old_scores = pair_scores(state, dimension, pair_keys[exists])
+            for name, values in added.items():
+                column = state[f"{dimension}_{name}"]
+                column[at[exists]] += values[exists]
+                state[f"{dimension}_{name}"] = np.insert(column, at[~exists], values[~exists])
+            state[f"{dimension}_keys"] = np.insert(keys, at[~exists], pair_keys[~exists])
+
+            # Re-rank the touched segments over their candidates plus the changed pairs, and over
+            # all of their pairs where a candidate lost score; every segment after a decay step
+            candidates = state[f"{dimension}_candidates"]
+            if decayed:
+                touched = np.ones(len(candidates), dtype=bool)
+                pool = state[f"{dimension}_keys"]
+            else:
+                touched = np.isin(candidates // n_items, np.unique(pair_keys // n_items))
+                lowered = pair_keys[exists][pair_scores(state, dimension, pair_keys[exists]) < old_scores]
+                lowered_segments = np.unique(lowered[np.isin(lowered, candidates)] // n_items)
+                keys = state[f"{dimension}_keys"]
+                full = keys[np.isin(keys // n_items, lowered_segments)] if len(lowered_segments) else keys[:0]
+                pool = np.union1d(np.union1d(candidates[touched], pair_keys), full)
+            top = ranked(state, dimension, pool, CANDIDATE_FACTOR * top_k)
+            state[f"{dimension}_candidates"] = np.concatenate(
+                [candidates[~touched]] + [segment * n_items + codes for segment, codes in top.items()]).astype(np.int64)
+        logger.info(f"Applied a batch of {len(batch)} ratings ({int((~known).sum())} new raters, "
+                    f"{int(known.sum())} changed) to the trending state.")
+    except Exception as e:
+        logger.error(f"Error applying rating batch: {e}")
+        raise
+
+def top_isbns(state: dict, dimension: str, top_k: int = TOP_K) -> dict:
+    """Current top ISBNs per segment of one dimension, keyed like the batch artifacts."""
+    return segment_popularity.decode_top(ranked(state, dimension, state[f"{dimension}_candidates"], top_k), dimension)
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Incrementally refresh segment top-k lists from rating batches.")
+    parser.add_argument(
+        '--batch', type=str, default=None, help='CSV or Parquet batch of ratings (user_id, isbn, book_rating) to apply.'
+    )
+    parser.add_argument(
+        '--bootstrap', action='store_true', help='Start a new state from the full preprocessed ratings.'
+    )
+    parser.add_argument(
+        '--dimensions', nargs='+', choices=list(segment_popularity.DIMENSIONS), default=segment_popularity.DEFAULT_DIMENSIONS,
+        help='Segment dimensions to track (used with --bootstrap).'
+    )
+    parser.add_argument(
+        '--half_life_hours', type=float, default=HALF_LIFE_HOURS, help='Exponential decay half-life; 0 disables decay.'
+    )
+    parser.add_argument(
+        '--as_of', type=float, default=None, help='Batch time as a Unix timestamp (default: now).'
+    )
+    parser.add_argument(
+        '--output_dir', type=str, default=segment_popularity.OUTPUT_DIR, help='Directory to save the results.'
+    )
+    return parser.parse_args()
+
+def main():
+    """Main executable for the trending refresh."""
+    args = parse_args()
+    try:
+        now = args.as_of if args.as_of is not None else time.time()
+        started = time.perf_counter()
+
+        # Step 1: Load the state, or bootstrap it from the full history
+        if args.bootstrap:
+            state = empty_state(args.dimensions, now)
+            history = pd.read_parquet(segment_popularity.INPUT_FILE, columns=['user_code', 'isbn_code', 'book_rating'])
+            apply_batch(state, history, now, args.half_life_hours)
+        else:
+            state = load_state(STATE_PATH)
+
+        # Step 2: Apply the new batch
+        if args.batch:
+            apply_batch(state, read_deltas(args.batch), now, args.half_life_hours)
+
+        # Step 3: Save the state and the refreshed artifacts
+        save_state(state, STATE_PATH)
+        for dimension in state_dimensions(state):
+            segment_popularity.save_top_isbn_to_json(top_isbns(state, dimension), dimension, args.output_dir)
+        logger.info(f"Trending lists refreshed in {time.perf_counter() - started:.2f}s.")
+    except Exception as e:
+        logger.error(f"An error occurred in the main process: {e}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import numpy as np  # type: ignore
+from scipy.sparse import random as sparse_random  # type: ignore
+from src.recommender import seen_items
+
+def seen_index(n_users: int = 120, n_items: int = 50):
+    """Seen-items index of a random rating matrix; every second user code has no ratings."""
+    matrix = sparse_random(n_users // 2, n_items, density=0.2, format='csr', random_state=3)
+    row_ids = np.arange(0, n_users, 2)
+    index = seen_items.build_seen_items(matrix, row_ids, np.arange(n_items), n_users)
+    seen = {user: set() for user in range(n_users)}
+    for row, user in enumerate(row_ids):
+        seen[user] = set(matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]].tolist())
+    return index, seen
+
+def naive_unseen(candidates, seen: set, top_k: int) -> list:
+    return [int(code) for code in candidates if code >= 0 and code not in seen][:top_k]
+
+def test_filter_seen_matches_naive_filter():
+    index, seen = seen_index()
+    rng = np.random.default_rng(5)
+    user_codes = np.concatenate([rng.integers(0, 120, 300), [-1, 500]])
+    candidates = np.where(rng.random((len(user_codes), 20)) < 0.1, -1, rng.integers(0, 50, (len(user_codes), 20))).astype(np.int32)
+    filtered = seen_items.filter_seen(index, user_codes, candidates, top_k=10)
+    for user, row, result in zip(user_codes, candidates, filtered):
+        assert [int(code) for code in result if code >= 0] == naive_unseen(row, seen.get(int(user), set()), 10)
+
+def test_unseen_matches_naive_filter():
+    index, seen = seen_index()
+    rng = np.random.default_rng(6)
+    for user in range(120):
+        codes = rng.choice(50, 20, replace=False)
+        assert seen_items.unseen(index, user, codes, top_k=10).tolist() == naive_unseen(codes, seen[user], 10)
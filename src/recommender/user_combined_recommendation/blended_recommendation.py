@@ -0,0 +1,177 @@
+import os
+import argparse
+import numpy as np # type: ignore
+import pandas as pd # type: ignore
+import pyarrow as pa # type: ignore
+import pyarrow.parquet as pq # type: ignore
+from config.logging_configs import logger  # Ensure logging is set up
+from src.recommender import list_artifacts, seen_items
+from src.recommender.user_combined_recommendation import user_combined_recommendation as combiner
+
+# Define paths
+OUTPUT_PATH = "data/recommender_result/user_for_you.parquet"
+
+# Source shelf -> fusion weight; a weight of 0 leaves the source out
+SOURCE_WEIGHTS = {
+    'collaborative_cluster_recommendation': 1.0,
+    'demographic_recommendation': 1.0,
+    'geographic_recommendation': 1.0,
+}
+FUSION_METHODS = ('rrf', 'score')
+RRF_K = 60  # Reciprocal-rank constant: larger values flatten the gap between top and lower ranks
+TOP_K = 10
+
+def rank_scores(ranks: np.ndarray, lengths: np.ndarray, method: str = 'rrf', rrf_k: int = RRF_K) -> np.ndarray:
+    """Score of 1-based `ranks` in lists of `lengths` items.
+
+    'rrf' is reciprocal-rank fusion, 1 / (rrf_k + rank). The source lists carry an order but no
+    scores, so 'score' fuses their positions min-max normalized to (0, 1]: 1 - (rank - 1) / length.
+    """
+    if method == 'rrf':
+        return 1.0 / (rrf_k + ranks)
+    if method == 'score':
+        return 1.0 - (ranks - 1) / np.maximum(lengths, 1)
+    raise ValueError(f"Unknown fusion method '{method}'; expected one of {FUSION_METHODS}.")
+
+def blend_matrix(matrices: list, weights: list, method: str = 'rrf', rrf_k: int = RRF_K, top_k: int = TOP_K) -> np.ndarray:
+    """Fuses aligned -1 padded ISBN-code matrices (one per source) into one (rows, top_k) matrix.
+
+    Every (row, book) pair is scored once per source it appears in, the scores are summed with
+    `np.bincount`, and books are ordered by fused score (ties: earliest source, then best rank),
+    all without a Python loop over rows.
+    """
+    codes, scores, positions = [], [], []
+    offset = 0
+    for matrix, weight in zip(matrices, weights):
+        ranks = np.broadcast_to(np.arange(1, matrix.shape[1] + 1), matrix.shape)
+        lengths = (matrix >= 0).sum(axis=1, keepdims=True)
+        codes.append(matrix)
+        scores.append(weight * rank_scores(ranks, lengths, method, rrf_k))
+        positions.append(np.broadcast_to(offset + np.arange(matrix.shape[1]), matrix.shape))
+        offset += matrix.shape[1]
+    codes, scores, positions = np.hstack(codes), np.hstack(scores), np.hstack(positions)
+
+    # Row-major order keeps each row's entries in source-then-rank order, so sums match `blend`
+    rows, columns = np.nonzero(codes >= 0)
+    n_items = int(codes.max(initial=-1)) + 1
+    pairs, slots = np.unique(rows.astype(np.int64) * n_items + codes[rows, columns], return_inverse=True)
+    fused = np.round(np.bincount(slots, weights=scores[rows, columns], minlength=len(pairs)), 9)
+    first = np.full(len(pairs), offset, dtype=np.int64)
+    np.minimum.at(first, slots, positions[rows, columns])
+
+    pair_rows = pairs // max(n_items, 1)
+    order = np.lexsort((first, -fused, pair_rows))
+    sorted_rows = pair_rows[order]
+    place = np.arange(len(order)) - np.searchsorted(sorted_rows, sorted_rows)
+    keep = place < top_k
+    blended = np.full((len(codes), top_k), -1, dtype=np.int32)
+    blended[sorted_rows[keep], place[keep]] = (pairs % max(n_items, 1))[order][keep]
+    return blended
+
+def blend(shelves: dict, weights: dict = SOURCE_WEIGHTS, method: str = 'rrf', rrf_k: int = RRF_K,
+          top_k: int = TOP_K) -> list:
+    """Serve-time fusion of one user's shelves; returns the same list as the batch `blend_matrix`."""
+    fused, first = {}, {}
+    position = 0
+    for source, weight in weights.items():
+        if weight == 0:
+            continue
+        items = list(shelves.get(source, []))
+        scores = weight * rank_scores(np.arange(1, len(items) + 1), np.array(len(items)), method, rrf_k)
+        for isbn, score in zip(items, scores):
+            fused[isbn] = fused.get(isbn, 0.0) + float(score)
+            first.setdefault(isbn, position)
+            position += 1
+    rounded = dict(zip(fused, np.round(np.array(list(fused.values()), dtype=np.float64), 9)))
+    return sorted(fused, key=lambda isbn: (-rounded[isbn], first[isbn]))[:top_k]
+
+def source_matrices(segments: pd.DataFrame, tables: dict, weights: dict = SOURCE_WEIGHTS):
+    """Unique (cluster, age group, location) segment rows, their source matrices and each user's row."""
+    keys = np.stack([
+        tables['cluster_of_user'][segments['user_code'].to_numpy()],
+        segments['age_group_code'].to_numpy(),
+        tables['geographic_row'][segments['location_code'].to_numpy()],
+    ], axis=1)
+    unique_keys, user_rows = np.unique(keys, axis=0, return_inverse=True)
+    by_source = {
+        'collaborative_cluster_recommendation': tables['collaborative'][unique_keys[:, 0]],
+        'demographic_recommendation': tables['demographic'][unique_keys[:, 1]],
+        'geographic_recommendation': tables['geographic'][unique_keys[:, 2]],
+    }
+    sources = [source for source, weight in weights.items() if weight != 0]
+    return [by_source[source] for source in sources], [weights[source] for source in sources], user_rows.ravel()
+
+def blend_users(segments: pd.DataFrame, cf_dir: str, weights: dict = SOURCE_WEIGHTS, method: str = 'rrf',
+                rrf_k: int = RRF_K, top_k: int = TOP_K) -> np.ndarray:
+    """Blended ISBN-code matrix for every user in the segment table, in its row order.
+
+    Users sharing cluster, age group and location row share their inputs, so each distinct
+    combination is fused once (over-fetched) and users take its row; books a user has already
+    rated are then removed per user before the shelf is cut to `top_k`.
+    """
+    try:
+        logger.info(f"Blending {len(weights)} sources for {len(segments)} users ({method})...")
+        tables = combiner.load_list_tables(cf_dir)
+        matrices, source_weights, user_rows = source_matrices(segments, tables, weights)
+        blended = blend_matrix(matrices, source_weights, method, rrf_k, seen_items.fetch_size(top_k))
+        logger.info(f"Blended {len(blended)} distinct segment combinations.")
+        return combiner.unseen_codes(blended[user_rows], segments['user_code'].to_numpy(), tables['seen'], top_k)
+    except Exception as e:
+        logger.error(f"Error blending recommendations: {e}")
+        raise
+
+def save_blended(segments: pd.DataFrame, blended: np.ndarray, output_path: str = OUTPUT_PATH) -> None:
+    """Saves the For You shelf as a list<int32> ISBN-code column (decode with the `isbn` registry)."""
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        pq.write_table(pa.table({
+            'user_id': pa.array(segments['user_id']),
+            'user_code': pa.array(segments['user_code'].to_numpy(), type=pa.int32()),
+            'for_you_recommendation': list_artifacts.list_array(blended),
+        }), output_path)
+        logger.info(f"For You shelf saved to {output_path}.")
+    except Exception as e:
+        logger.error(f"Error saving For You shelf: {e}")
+        raise
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Blend the per-user shelves into one ranked For You list.")
+    parser.add_argument(
+        '--cf_dir', type=str, default=os.path.dirname(combiner.USER_CLUSTER_MAPPING_PATH),
+        help='Directory with user_clusters.csv and cluster_recommendation.parquet.'
+    )
+    parser.add_argument(
+        '--weights', type=float, nargs=len(SOURCE_WEIGHTS), default=list(SOURCE_WEIGHTS.values()),
+        help=f"Source weights, in the order {', '.join(SOURCE_WEIGHTS)} (0 drops a source)."
+    )
+    parser.add_argument(
+        '--method', type=str, choices=FUSION_METHODS, default='rrf', help='Reciprocal-rank or score fusion.'
+    )
+    parser.add_argument(
+        '--rrf_k', type=int, default=RRF_K, help='Reciprocal-rank fusion constant.'
+    )
+    parser.add_argument(
+        '--top_k', type=int, default=TOP_K, help='Books on the blended shelf.'
+    )
+    return parser.parse_args()
+
+def main():
+    """Main executable for the blended For You shelf."""
+    args = parse_args()
+    try:
+        # Step 1: Load the user segment table written by the combiner
+        segments = pd.read_parquet(combiner.USER_SEGMENTS_PATH)
+
+        # Step 2: Fuse the sources for every user
+        weights = dict(zip(SOURCE_WEIGHTS, args.weights))
+        blended = blend_users(segments, args.cf_dir, weights, args.method, args.rrf_k, args.top_k)
+
+        # Step 3: Save the shelf
+        save_blended(segments, blended, OUTPUT_PATH)
+    except Exception as e:
+        logger.error(f"An error occurred in the main process: {e}")
+        raise
+
+if __name__ == "__main__":
+    main()
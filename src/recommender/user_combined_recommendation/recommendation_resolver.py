@@ -0,0 +1,95 @@
+import os
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+from config.logging_configs import logger  # Ensure logging is set up
+from src.data_preprocessing import id_registry
+from src.recommender import list_artifacts, seen_items
+from src.recommender.geographic_recommender import geo_locational_recommender
+from src.recommender.user_combined_recommendation import blended_recommendation
+from src.recommender.user_combined_recommendation import user_combined_recommendation as combiner
+
+SHELVES = ('collaborative_cluster_recommendation', 'demographic_recommendation', 'geographic_recommendation')
+
+def load_resolver(segments_path: str = combiner.USER_SEGMENTS_PATH,
+                  age_group_path: str = combiner.AGE_GROUP_RECOMMENDATION_PATH,
+                  rollup_path: str = combiner.LOCATION_ROLLUP_PATH,
+                  cf_dir: str = os.path.dirname(combiner.CLUSTER_RECOMMENDATION_PATH),
+                  for_you_path: str = blended_recommendation.OUTPUT_PATH,
+                  seen_dir: str = seen_items.SEEN_ITEMS_DIR) -> dict:
+    """Loads the user segment table and the shared per-segment lists it points into.
+
+    The lists are code-indexed object arrays (code -1 gets an empty list, or the global list for
+    locations), so resolving a user is three array lookups. Refreshing a segment artifact only needs a reload, not a rewrite
+    of every user row. The blended For You shelf is read when its stage has run, and blended per
+    request otherwise. The memory-mapped seen-items index removes already-rated books per request.
+    """
+    try:
+        segments = pd.read_parquet(segments_path)
+        age_group_rec = combiner.load_recommendations(age_group_path, is_json=True)
+        rollup = geo_locational_recommender.load_location_rollup(rollup_path)
+        cluster_rec = list_artifacts.load_cluster_recommendations(cf_dir)
+        n_clusters = int(max(cluster_rec, default=-1)) + 1
+        isbn_registry = id_registry.load_registry('isbn')
+        resolver = {
+            'user_ids': pd.Index(segments['user_id']),
+            'user_code': segments['user_code'].to_numpy(),
+            'age_group_code': segments['age_group_code'].to_numpy(),
+            'location_code': segments['location_code'].to_numpy(),
+            'cluster_id': np.where(segments['cluster_id'].to_numpy() < n_clusters, segments['cluster_id'].to_numpy(), -1),
+            'collaborative': combiner.code_indexed_lists(cluster_rec, range(n_clusters)),
+            'demographic': combiner.code_indexed_lists(age_group_rec, id_registry.load_registry('age_group')),
+            'geographic': geo_locational_recommender.decoded_lists(rollup, isbn_registry),
+            'geographic_row': rollup['row_of_location'],
+            'isbn': isbn_registry,
+            'seen': seen_items.load_seen_items_if_built(seen_dir),
+        }
+        if os.path.exists(for_you_path):
+            for_you = pd.read_parquet(for_you_path, columns=['user_id'])
+            resolver['for_you_row'] = pd.Index(for_you['user_id']).get_indexer(resolver['user_ids'])
+            resolver['for_you_offsets'], resolver['for_you_codes'] = list_artifacts.load_list_arrays(
+                for_you_path, 'for_you_recommendation')
+        return resolver
+    except Exception as e:
+        logger.error(f"Error loading recommendation resolver: {e}")
+        raise
+
+def unseen_shelf(resolver: dict, position: int, isbns, top_k: int = combiner.TOP_K) -> list:
+    """First `top_k` ISBNs of a shelf that the user at `position` has not rated yet."""
+    codes = id_registry.encode(resolver['isbn'], list(isbns))
+    if resolver['seen'] is not None:
+        codes = seen_items.unseen(resolver['seen'], resolver['user_code'][position], codes, top_k)
+    else:
+        codes = codes[codes >= 0][:top_k]
+    return list(id_registry.decode(resolver['isbn'], codes))
+
+def resolve(resolver: dict, user_id, exclude_seen: bool = True) -> dict:
+    """The shelves of one user, keyed like the columns of the materialized combined table.
+
+    With `exclude_seen` (the default) already-rated books are removed and each shelf is cut to the
+    combiner's shelf size; otherwise the full over-fetched segment lists are returned.
+    """
+    position = resolver['user_ids'].get_indexer([user_id])[0]
+    if position < 0:
+        return {shelf: [] for shelf in SHELVES}
+    shelves = {
+        'collaborative_cluster_recommendation': resolver['collaborative'][resolver['cluster_id'][position]],
+        'demographic_recommendation': resolver['demographic'][resolver['age_group_code'][position]],
+        'geographic_recommendation': resolver['geographic'][resolver['geographic_row'][resolver['location_code'][position]]],
+    }
+    if exclude_seen:
+        return {shelf: unseen_shelf(resolver, position, isbns) for shelf, isbns in shelves.items()}
+    return shelves
+
+def resolve_for_you(resolver: dict, user_id) -> list:
+    """The blended For You shelf of one user: one slice of the precomputed shelf when available."""
+    position = resolver['user_ids'].get_indexer([user_id])[0]
+    if position < 0:
+        return []
+    if 'for_you_row' not in resolver or resolver['for_you_row'][position] < 0:
+        # Same steps as the batch stage: blend the full lists, then drop already-rated books
+        candidates = blended_recommendation.blend(resolve(resolver, user_id, exclude_seen=False),
+                                                  top_k=seen_items.fetch_size(blended_recommendation.TOP_K))
+        return unseen_shelf(resolver, position, candidates, blended_recommendation.TOP_K)
+    row = resolver['for_you_row'][position]
+    codes = resolver['for_you_codes'][resolver['for_you_offsets'][row]:resolver['for_you_offsets'][row + 1]]
+    return list(id_registry.decode(resolver['isbn'], codes))
@@ -0,0 +1,23 @@
+import numpy as np  # type: ignore
+import pytest  # type: ignore
+from src.recommender.user_combined_recommendation import blended_recommendation
+
+def random_shelves(rng: np.random.Generator, n_rows: int, width: int, n_items: int) -> np.ndarray:
+    """-1 padded matrix of distinct ISBN codes per row, with rows of every length."""
+    shelves = np.full((n_rows, width), -1, dtype=np.int32)
+    for row in range(n_rows):
+        length = rng.integers(0, width + 1)
+        shelves[row, :length] = rng.choice(n_items, length, replace=False)
+    return shelves
+
+@pytest.mark.parametrize('method', blended_recommendation.FUSION_METHODS)
+@pytest.mark.parametrize('weights', [(1.0, 1.0, 1.0), (2.0, 0.5, 1.0)])
+def test_blend_matches_blend_matrix(method, weights):
+    rng = np.random.default_rng(11)
+    sources = list(blended_recommendation.SOURCE_WEIGHTS)
+    matrices = [random_shelves(rng, 200, width, 30) for width in (10, 8, 12)]
+    blended = blended_recommendation.blend_matrix(matrices, list(weights), method, top_k=6)
+    for row in range(len(blended)):
+        shelves = {source: [int(code) for code in matrix[row] if code >= 0] for source, matrix in zip(sources, matrices)}
+        expected = blended_recommendation.blend(shelves, dict(zip(sources, weights)), method, top_k=6)
+        assert [int(code) for code in blended[row] if code >= 0] == expected
@@ -1,16 +1,32 @@
 import os
+import time
+import argparse
+import numpy as np # type: ignore
 import pandas as pd # type: ignore
+import pyarrow as pa # type: ignore
+import pyarrow.csv as pv # type: ignore
+import pyarrow.dataset as ds # type: ignore
+import pyarrow.parquet as pq # type: ignore
 import json
 import logging
 from config.logging_configs import logger  # Ensure logging is set up
+from src.data_inject.csv_to_parquet import BLOCK_SIZE
+from src.data_preprocessing import id_registry
+from src.recommender import list_artifacts, seen_items
+from src.recommender.geographic_recommender import geo_locational_recommender
 
 # Define paths
 USER_AGE_LOCATION_PATH = "data/preprocessed_files/distinct_user_age_location.parquet"
 AGE_GROUP_RECOMMENDATION_PATH = "data/recommender_result/top_isbn_per_age_group.json"
-GEO_LOCATION_RECOMMENDATION_PATH = "data/recommender_result/top_isbn_per_location.json"
+LOCATION_ROLLUP_PATH = geo_locational_recommender.ROLLUP_PATH
 USER_CLUSTER_MAPPING_PATH = "data/recommender_result/user_clusters.csv"
-CLUSTER_RECOMMENDATION_PATH = "data/recommender_result/cluster_recommendation.csv"
+CLUSTER_RECOMMENDATION_PATH = "data/recommender_result/" + list_artifacts.CLUSTER_RECOMMENDATION_FILE
 OUTPUT_PATH = "data/recommender_result/user_combined_recommendations.csv"
+USER_SEGMENTS_PATH = "data/recommender_result/user_segments.parquet"
+STREAMING_OUTPUT_PATH = "data/recommender_result/user_combined_recommendations.parquet"
+
+CHUNK_USERS = 1_000_000  # Users per chunk in streaming mode
+TOP_K = 10  # Books per shelf once already-rated books are removed
 
 def load_user_info(file_path: str) -> pd.DataFrame:
     """Loads user info including user_id, location, and age_group."""
@@ -34,15 +50,50 @@ def load_recommendations(file_path: str, is_json: bool = False) -> dict:
         logger.error(f"Error loading recommendations: {e}")
         raise
 
+def code_indexed_lists(recommendations: dict, keys) -> np.ndarray:
+    """Object array of recommendation lists indexed by code, with a trailing empty list for code -1."""
+    lists = np.empty(len(keys) + 1, dtype=object)
+    lists[:len(keys)] = [list(recommendations.get(key, [])) for key in keys]
+    lists[-1] = []
+    return lists
+
+def build_user_segments(user_info: pd.DataFrame, cluster_mapping: pd.DataFrame) -> pd.DataFrame:
+    """One row per user holding only the keys its shelves resolve from: age group, location and cluster."""
+    try:
+        logger.info("Building the user segment table...")
+        registry = {namespace: id_registry.load_registry(namespace) for namespace in ('user', 'location', 'age_group')}
+        users = user_info.drop_duplicates(subset="user_id").reset_index(drop=True)
+        segments = pd.DataFrame({"user_id": users["user_id"]})
+        for namespace, column in (('user', 'user_id'), ('location', 'location'), ('age_group', 'age_group')):
+            code = id_registry.code_column(namespace)
+            codes = users[code] if code in users.columns else id_registry.encode(registry[namespace], users[column])
+            segments[code] = np.asarray(codes, dtype=np.int32)
+
+        cluster_of_user = np.full(len(registry['user']) + 1, -1, dtype=np.int32)
+        cluster_of_user[id_registry.encode(registry['user'], cluster_mapping["user_id"])] = cluster_mapping["cluster_id"].to_numpy()
+        cluster_of_user[-1] = -1
+        segments["cluster_id"] = cluster_of_user[segments["user_code"].to_numpy()]
+        logger.info(f"User segment table built for {len(segments)} users.")
+        return segments
+    except Exception as e:
+        logger.error(f"Error building user segment table: {e}")
+        raise
+
 def map_recommendations(
     user_info: pd.DataFrame, 
     age_group_rec: dict, 
-    geo_rec: dict, 
+    location_rollup: dict, 
     cluster_mapping: pd.DataFrame, 
-    cluster_rec: pd.DataFrame
+    cluster_rec: dict,
+    seen: dict = None,
+    top_k: int = TOP_K
 ) -> pd.DataFrame:
     """
     Maps recommendations to each user based on demographic, geographic, and collaborative cluster filtering.
+
+    Every lookup is an integer array index over registry codes; users without a match get the
+    trailing empty list. With a `seen` index, books a user has already rated are removed before
+    each shelf is cut to `top_k`.
     """
     try:
         logger.info("Starting the mapping of recommendations to users...")
@@ -54,34 +105,46 @@ def map_recommendations(
         if "location" not in user_info.columns:
             logger.warning("'location' column not found in user_info. Adding default value.")
             user_info["location"] = "Unknown"
+        registry = {namespace: id_registry.load_registry(namespace) for namespace in ('user', 'location', 'age_group')}
+        for namespace, column in (('user', 'user_id'), ('location', 'location'), ('age_group', 'age_group')):
+            if id_registry.code_column(namespace) not in user_info.columns:
+                user_info[id_registry.code_column(namespace)] = id_registry.encode(registry[namespace], user_info[column])
 
         # Step 2: Map cluster IDs to users
         logger.info("Mapping cluster IDs to users...")
-        cluster_mapping_dict = cluster_mapping.set_index("user_id")["cluster_id"].to_dict()
-        user_info["cluster_id"] = user_info["user_id"].map(cluster_mapping_dict)
+        cluster_of_user = np.full(len(registry['user']) + 1, -1, dtype=np.int32)
+        cluster_of_user[id_registry.encode(registry['user'], cluster_mapping["user_id"])] = cluster_mapping["cluster_id"].to_numpy()
+        cluster_of_user[-1] = -1
+        cluster_ids = cluster_of_user[user_info["user_code"].to_numpy()]
+        user_info["cluster_id"] = pd.Series(cluster_ids, index=user_info.index).where(cluster_ids >= 0)
+
+        isbn_registry = id_registry.load_registry('isbn')
+        user_codes = user_info["user_code"].to_numpy()
 
         # Step 3: Map collaborative cluster recommendations
         logger.info("Mapping collaborative recommendations based on cluster IDs...")
-        cluster_rec_dict = cluster_rec.set_index("cluster_id")["isbn"].apply(eval).to_dict()  # Ensure isbn is a list
-        user_info["collaborative_cluster_recommendation"] = user_info["cluster_id"].map(cluster_rec_dict)
+        n_clusters = int(max(cluster_rec, default=-1)) + 1
+        collaborative = padded_lists(cluster_rec, range(n_clusters), isbn_registry)[
+            np.where(cluster_ids < n_clusters, cluster_ids, -1)
+        ]
+        user_info["collaborative_cluster_recommendation"] = shelf_lists(
+            unseen_codes(collaborative, user_codes, seen, top_k), isbn_registry)
 
         # Step 4: Map demographic recommendations based on age group
         logger.info("Mapping demographic recommendations...")
-        user_info["demographic_recommendation"] = user_info["age_group"].map(age_group_rec)
+        demographic = padded_lists(age_group_rec, registry['age_group'], isbn_registry)[
+            user_info["age_group_code"].to_numpy()
+        ]
+        user_info["demographic_recommendation"] = shelf_lists(
+            unseen_codes(demographic, user_codes, seen, top_k), isbn_registry)
 
-        # Step 5: Map geographic recommendations based on location
+        # Step 5: Map geographic recommendations through the city -> state -> country fallback index
         logger.info("Mapping geographic recommendations...")
-        user_info["geographic_recommendation"] = user_info["location"].map(geo_rec)
-
-        # Step 6: Fill missing values with empty lists
-        logger.info("Filling missing recommendations with empty lists...")
-        recommendation_columns = [
-            "collaborative_cluster_recommendation", 
-            "demographic_recommendation", 
-            "geographic_recommendation"
+        geographic = location_rollup['lists'][
+            geo_locational_recommender.resolve_rows(location_rollup, user_info["location_code"].to_numpy())
         ]
-        for column in recommendation_columns:
-            user_info[column] = user_info[column].apply(lambda x: x if isinstance(x, list) else [])
+        user_info["geographic_recommendation"] = shelf_lists(
+            unseen_codes(geographic, user_codes, seen, top_k), isbn_registry)
 
         logger.info("Recommendations mapped successfully.")
         return user_info
@@ -103,23 +166,195 @@ def save_combined_recommendations(user_info: pd.DataFrame, output_path: str) ->
         logger.error(f"Error saving combined recommendations: {e}")
         raise
 
+def save_user_segments(segments: pd.DataFrame, output_path: str = USER_SEGMENTS_PATH) -> None:
+    """Saves the user segment table as Parquet."""
+    try:
+        segments.to_parquet(output_path, index=False)
+        logger.info(f"User segment table saved to {output_path} ({os.path.getsize(output_path) / 1024:.1f} KiB).")
+    except Exception as e:
+        logger.error(f"Error saving user segment table: {e}")
+        raise
+
+def padded_lists(recommendations: dict, keys, isbn_registry: pd.Index) -> np.ndarray:
+    """(len(keys) + 1, width) int32 ISBN codes per key, -1 padded; the trailing row serves code -1."""
+    lists = [id_registry.encode(isbn_registry, recommendations.get(key, [])) for key in keys]
+    width = max((len(codes) for codes in lists), default=0)
+    matrix = np.full((len(lists) + 1, width), -1, dtype=np.int32)
+    for row, codes in enumerate(lists):
+        matrix[row, :len(codes)] = codes
+    return matrix
+
+def unseen_codes(candidates: np.ndarray, user_codes: np.ndarray, seen: dict = None, top_k: int = TOP_K) -> np.ndarray:
+    """First `top_k` candidate codes of every user, skipping books the user has rated when `seen` is given."""
+    if seen is None:
+        return candidates[:, :top_k]
+    return seen_items.filter_seen(seen, user_codes, candidates, top_k)
+
+def shelf_lists(codes: np.ndarray, isbn_registry: pd.Index) -> np.ndarray:
+    """Object array of ISBN lists decoded from a -1 padded code matrix, one per row."""
+    names = np.asarray(isbn_registry, dtype=object)
+    lists = np.empty(len(codes), dtype=object)
+    lists[:] = [names[row[row >= 0]].tolist() for row in codes]
+    return lists
+
+def peak_memory_mb() -> float:
+    """Peak resident memory of this process in MiB (NaN where the platform does not report it)."""
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        return float('nan')
+
+def load_cluster_of_user(mapping_path: str, user_index: pd.Index, n_clusters: int, block_size: int = BLOCK_SIZE) -> np.ndarray:
+    """user_code -> cluster_id array, with a trailing -1 for code -1, streamed from the user_clusters CSV.
+
+    The CSV is parsed one block at a time, so only the int32 array grows with the number of
+    users. Unknown users and clusters without a recommendation list map to -1.
+    """
+    cluster_of_user = np.full(len(user_index) + 1, -1, dtype=np.int32)
+    reader = pv.open_csv(mapping_path, read_options=pv.ReadOptions(block_size=block_size),
+                         convert_options=pv.ConvertOptions(include_columns=['user_id', 'cluster_id']))
+    for batch in reader:
+        codes = id_registry.encode(user_index, batch.column('user_id').to_numpy(zero_copy_only=False))
+        cluster_of_user[codes] = batch.column('cluster_id').to_numpy(zero_copy_only=False)
+    cluster_of_user[-1] = -1
+    cluster_of_user[cluster_of_user >= n_clusters] = -1
+    return cluster_of_user
+
+def load_list_tables(cf_dir: str, age_group_path: str = AGE_GROUP_RECOMMENDATION_PATH,
+                     rollup_path: str = LOCATION_ROLLUP_PATH) -> dict:
+    """Every shared list source as an integer-keyed code matrix, the user -> cluster array and the seen-items index."""
+    try:
+        registry = {namespace: id_registry.load_registry(namespace) for namespace in ('isbn', 'user', 'age_group')}
+        cluster_rec = list_artifacts.load_cluster_recommendations(cf_dir)
+        n_clusters = int(max(cluster_rec, default=-1)) + 1
+        cluster_of_user = load_cluster_of_user(os.path.join(cf_dir, os.path.basename(USER_CLUSTER_MAPPING_PATH)),
+                                               registry['user'], n_clusters)
+        rollup = geo_locational_recommender.load_location_rollup(rollup_path)
+        return {
+            'cluster_of_user': cluster_of_user,
+            'collaborative': padded_lists(cluster_rec, range(n_clusters), registry['isbn']),
+            'demographic': padded_lists(load_recommendations(age_group_path, is_json=True),
+                                        registry['age_group'], registry['isbn']),
+            'geographic': rollup['lists'],
+            'geographic_row': rollup['row_of_location'],
+            'seen': seen_items.load_seen_items_if_built(),
+        }
+    except Exception as e:
+        logger.error(f"Error loading recommendation list tables: {e}")
+        raise
+
+def combine_chunk(users: pd.DataFrame, tables: dict) -> pa.Table:
+    """One chunk of users joined to their three shelves through array indexing, already-rated books removed."""
+    user_codes = users['user_code'].to_numpy()
+    cluster_ids = tables['cluster_of_user'][user_codes]
+    shelves = {
+        'collaborative_cluster_recommendation': tables['collaborative'][cluster_ids],
+        'demographic_recommendation': tables['demographic'][users['age_group_code'].to_numpy()],
+        'geographic_recommendation': tables['geographic'][tables['geographic_row'][users['location_code'].to_numpy()]],
+    }
+    return pa.table({
+        'user_id': pa.array(users['user_id']),
+        'user_code': pa.array(user_codes, type=pa.int32()),
+        'cluster_id': pa.array(cluster_ids, type=pa.int32()),
+        **{shelf: list_artifacts.list_array(unseen_codes(candidates, user_codes, tables['seen']))
+           for shelf, candidates in shelves.items()},
+    })
+
+def chunk_segments(users: pd.DataFrame, tables: dict) -> pa.Table:
+    """The user segment rows of one chunk, in the layout of `build_user_segments`."""
+    return pa.table({
+        'user_id': pa.array(users['user_id']),
+        'user_code': pa.array(users['user_code'].to_numpy(), type=pa.int32()),
+        'location_code': pa.array(users['location_code'].to_numpy(), type=pa.int32()),
+        'age_group_code': pa.array(users['age_group_code'].to_numpy(), type=pa.int32()),
+        'cluster_id': pa.array(tables['cluster_of_user'][users['user_code'].to_numpy()], type=pa.int32()),
+    })
+
+def streaming_combine(user_info_path: str, cf_dir: str, output_path: str = STREAMING_OUTPUT_PATH,
+                      segments_path: str = USER_SEGMENTS_PATH, chunk_users: int = CHUNK_USERS) -> None:
+    """Combines recommendations for users read `chunk_users` at a time, in bounded memory.
+
+    Each chunk is joined through integer-keyed arrays and written as one Parquet row group with
+    list<int32> ISBN-code columns (decode with the `isbn` registry), so memory follows the chunk
+    size and the shared lists rather than the number of users. The user segment table the
+    serve-time resolver reads is written alongside, chunk by chunk.
+    """
+    try:
+        logger.info(f"Streaming combine of {user_info_path} in chunks of {chunk_users} users...")
+        started = time.perf_counter()
+        tables = load_list_tables(cf_dir)
+        dataset = ds.dataset(user_info_path, format='parquet')
+        columns = ['user_id', 'user_code', 'age_group_code', 'location_code']
+
+        for path in (output_path, segments_path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        paths = {'combined': output_path, 'segments': segments_path}
+        writers = {}
+        n_users = 0
+        try:
+            for batch in dataset.to_batches(columns=columns, batch_size=chunk_users):
+                users = batch.to_pandas()
+                for name, chunk in (('combined', combine_chunk(users, tables)), ('segments', chunk_segments(users, tables))):
+                    if name not in writers:
+                        writers[name] = pq.ParquetWriter(paths[name] + '.tmp', chunk.schema)
+                    writers[name].write_table(chunk)
+                n_users += batch.num_rows
+        finally:
+            for writer in writers.values():
+                writer.close()
+        for name in writers:
+            os.replace(paths[name] + '.tmp', paths[name])
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"Combined {n_users} users in {elapsed:.2f}s ({n_users / max(elapsed, 1e-9):,.0f} users/sec, "
+                    f"peak memory {peak_memory_mb():.0f} MiB); saved to {output_path}.")
+    except Exception as e:
+        logger.error(f"Error in streaming combine: {e}")
+        raise
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Combine demographic, geographic and collaborative recommendations.")
+    parser.add_argument(
+        '--cf_dir', type=str, default=os.path.dirname(USER_CLUSTER_MAPPING_PATH),
+        help='Directory with user_clusters.csv and cluster_recommendation.parquet (e.g. data/recommender_result/als).'
+    )
+    parser.add_argument(
+        '--legacy_csv', action='store_true',
+        help='Also write the materialized per-user lists to user_combined_recommendations.csv.'
+    )
+    parser.add_argument(
+        '--streaming', action='store_true',
+        help='Materialize per-user lists in bounded memory to user_combined_recommendations.parquet (list<int32> ISBN codes).'
+    )
+    parser.add_argument(
+        '--chunk_users', type=int, default=CHUNK_USERS, help='Users per chunk in streaming mode.'
+    )
+    return parser.parse_args()
+
 def main():
     """Main executable for mapping user recommendations."""
+    args = parse_args()
+    if args.streaming:
+        streaming_combine(USER_AGE_LOCATION_PATH, args.cf_dir, chunk_users=args.chunk_users)
+        return
     try:
-        # Step 1: Load user info
+        # Step 1: Load user info and the user -> cluster mapping
         user_info = load_user_info(USER_AGE_LOCATION_PATH)
+        cluster_mapping = load_recommendations(os.path.join(args.cf_dir, os.path.basename(USER_CLUSTER_MAPPING_PATH)))
 
-        # Step 2: Load recommendations
-        age_group_rec = load_recommendations(AGE_GROUP_RECOMMENDATION_PATH, is_json=True)
-        geo_rec = load_recommendations(GEO_LOCATION_RECOMMENDATION_PATH, is_json=True)
-        cluster_mapping = load_recommendations(USER_CLUSTER_MAPPING_PATH)
-        cluster_rec = load_recommendations(CLUSTER_RECOMMENDATION_PATH)
-
-        # Step 3: Map recommendations
-        combined_user_info = map_recommendations(user_info, age_group_rec, geo_rec, cluster_mapping, cluster_rec)
+        # Step 2: Save each user's segment keys; shelves are resolved from them at serve time
+        save_user_segments(build_user_segments(user_info, cluster_mapping))
 
-        # Step 4: Save combined recommendations
-        save_combined_recommendations(combined_user_info, OUTPUT_PATH)
+        # Step 3: Optionally materialize every user's lists as well
+        if args.legacy_csv:
+            age_group_rec = load_recommendations(AGE_GROUP_RECOMMENDATION_PATH, is_json=True)
+            location_rollup = geo_locational_recommender.load_location_rollup(LOCATION_ROLLUP_PATH)
+            cluster_rec = list_artifacts.load_cluster_recommendations(args.cf_dir)
+            combined_user_info = map_recommendations(user_info, age_group_rec, location_rollup, cluster_mapping, cluster_rec,
+                                                     seen_items.load_seen_items_if_built())
+            save_combined_recommendations(combined_user_info, OUTPUT_PATH)
 
     except Exception as e:
         logger.error(f"An error occurred in the main process: {e}")